@@ -0,0 +1,62 @@
+"""Microbenchmark of the expected-score kernel against inline ``math.pow``.
+
+Usage: python benchmarks/expected_score.py [--n N] [--ratio R]
+
+Rating differences are drawn uniformly from [-DIFF_RANGE, DIFF_RANGE], once as
+integers (the table path) and once with the fractional part left by factoravg.
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from elo_core.batch import expected_score_batch  # noqa: E402
+from elo_core.kernel import DIFF_RANGE, expected_score, expected_table  # noqa: E402
+
+
+def best(stmt, repeat=5):
+    timer = timeit.Timer(stmt)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--ratio", type=int, default=400)
+    args = parser.parse_args()
+    n, ratio = args.n, args.ratio
+
+    rng = random.Random(0)
+    cases = {
+        "integer": [float(rng.randint(-DIFF_RANGE, DIFF_RANGE)) for _ in range(n)],
+        "fractional": [rng.randint(-DIFF_RANGE, DIFF_RANGE) * 0.7 + 0.5 for _ in range(n)],
+    }
+    pow_ = math.pow
+    table = expected_table(ratio)
+
+    for name, diffs in cases.items():
+        array = np.array(diffs)
+        results = {
+            "math.pow loop": best(lambda: [1 / (1 + pow_(10, d / ratio)) for d in diffs]),
+            "expected_score loop": best(lambda: [expected_score(d, ratio) for d in diffs]),
+            "numpy power": best(lambda: 1 / (1 + np.power(10.0, array / ratio))),
+            "expected_score_batch": best(lambda: expected_score_batch(array, ratio)),
+        }
+        if name == "integer":
+            results["table index loop"] = best(lambda: [table[int(d) + DIFF_RANGE] for d in diffs])
+
+        reference = results["math.pow loop"]
+        print(f"{name} differences, n={n}, ratio={ratio}")
+        for label, seconds in results.items():
+            print(f"  {label:<22} {seconds / n * 1e9:8.2f} ns/op  {reference / seconds:6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Measure the cold import time of ``elo_core`` in fresh interpreters.
+
+Usage: python benchmarks/import_time.py [--runs N] [--budget MS]
+
+Exits with status 1 when the median import time is over the budget.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPET = """
+import time
+start = time.perf_counter()
+import elo_core
+elapsed = time.perf_counter() - start
+import sys
+heavy = sorted(m for m in ("numpy", "pandas", "streamlit") if m in sys.modules)
+print(elapsed * 1000, ",".join(heavy))
+"""
+
+
+def measure(runs):
+    times = []
+    heavy = set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", SNIPPET], cwd=ROOT, capture_output=True, text=True, check=True)
+        ms, _, modules = out.stdout.strip().partition(" ")
+        times.append(float(ms))
+        heavy.update(filter(None, modules.split(",")))
+    return times, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--budget", type=float, default=50.0, help="maximum median import time in ms")
+    args = parser.parse_args()
+
+    times, heavy = measure(args.runs)
+    median = statistics.median(times)
+    print(f"import elo_core: median {median:.2f} ms, max {max(times):.2f} ms over {args.runs} runs")
+    if heavy:
+        print(f"heavy modules imported: {', '.join(sorted(heavy))}")
+    if median > args.budget or heavy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
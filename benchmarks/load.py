@@ -0,0 +1,137 @@
+"""Load generator for the scoring service.
+
+Usage:
+    python benchmarks/load.py [--connections 64] [--duration 10] [--endpoint 2v2|americana]
+    python benchmarks/load.py --url http://127.0.0.1:8080   (an already running service)
+
+Without --url the service is started in a subprocess on a free port. Every
+connection is kept alive and sends one request after another, so the number of
+connections is the number of requests in flight. Throughput and latency
+percentiles are printed at the end.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _bodies(endpoint, n, seed):
+    rng = random.Random(seed)
+    bodies = []
+    for _ in range(n):
+        if endpoint == "2v2":
+            loser = rng.randint(0, 6)
+            result = [7, loser] if rng.random() < 0.5 else [loser, 7]
+            body = {"team1": [rng.randint(800, 2200) for _ in range(2)],
+                    "team2": [rng.randint(800, 2200) for _ in range(2)], "result": result}
+        else:
+            initial = [c for c in range(1, 7) for _ in range(2)]
+            final = initial[:]
+            rng.shuffle(initial)
+            rng.shuffle(final)
+            body = {"ratings": [[rng.randint(800, 2200) for _ in range(2)] for _ in range(12)],
+                    "courts": list(zip(initial, final))}
+        bodies.append(json.dumps(body).encode())
+    return bodies
+
+
+async def _client(host, port, path, bodies, stop_at, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    i = 0
+    try:
+        while time.perf_counter() < stop_at:
+            body = bodies[i % len(bodies)]
+            i += 1
+            start = time.perf_counter()
+            writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if not head.startswith(b"HTTP/1.1 200"):
+                errors.append(head.split(b"\r\n", 1)[0].decode())
+    finally:
+        writer.close()
+
+
+async def run(host, port, endpoint, connections, duration, seed):
+    path = f"/score/{endpoint}"
+    bodies = _bodies(endpoint, 1024, seed)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, path, bodies, start + duration, latencies, errors)
+                           for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_listening(host, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"the service did not start on {host}:{port}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="service to load; started in a subprocess when omitted")
+    parser.add_argument("--endpoint", choices=("2v2", "americana"), default="2v2")
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-batch", type=int, default=256, help="for the subprocess service")
+    parser.add_argument("--max-delay", type=float, default=0.002, help="for the subprocess service")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = "127.0.0.1", _free_port()
+        server = subprocess.Popen([sys.executable, "-m", "elo_core.service", "--host", host, "--port", str(port),
+                                   "--max-batch", str(args.max_batch), "--max-delay", str(args.max_delay)],
+                                  cwd=ROOT)
+    try:
+        _wait_until_listening(host, port)
+        latencies, errors, elapsed = asyncio.run(
+            run(host, port, args.endpoint, args.connections, args.duration, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    latencies.sort()
+    print(f"{args.endpoint}: {len(latencies)} requests over {args.connections} connections in {elapsed:.1f} s")
+    print(f"  {len(latencies) / elapsed:,.0f} req/s  p50 {1000 * statistics.median(latencies):.2f} ms  "
+          f"p99 {1000 * latencies[int(0.99 * (len(latencies) - 1))]:.2f} ms  errors {len(errors)}")
+    if errors:
+        print(f"  first error: {errors[0]}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Benchmark suite for the scoring functions, the batch and replay engines and the page3 rerun.
+
+Usage:
+    python benchmarks/run.py [--sizes 1,1000,1000000] [--only NAME ...] [--output results.json]
+    python benchmarks/run.py --compare baseline.json [--threshold 0.10] [--p99-floor 0.05]
+
+Every case is timed for a number of iterations. One iteration processes ``size``
+events, and its latency is the wall time of that whole call. Throughput is reported
+in events per second. Peak memory is measured with tracemalloc in one extra
+iteration, so tracing does not distort the timings. Results are written as JSON.
+The scalar americana and page3 cases stop at 100k events, and page3_rerun (skipped
+when streamlit is not installed) only runs single reruns.
+With --compare, cases whose throughput dropped by more than the threshold are
+reported as regressions, and the exit status is 1. So are cases whose p99 latency
+grew by more than the threshold and by more than --p99-floor milliseconds, when
+both runs timed at least 100 iterations.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+from elo_core import update_elo_2v2, update_elo_american  # noqa: E402
+from elo_core.batch import update_elo_2v2_batch, update_elo_american_batch  # noqa: E402
+from elo_core.pozo import PozoState, score_pozo  # noqa: E402
+from elo_core.replay import MatchLog, PlayerStore, Replay  # noqa: E402
+from elo_core.sweep import DEFAULTS_2V2, DEFAULTS_AMERICAN  # noqa: E402
+
+PAIRS = 12
+NUMPISTAS = 6
+MIN_P99_ITERATIONS = 100
+
+
+def _matches(rng, n):
+    ratings = rng.integers(800, 2200, (n, 4))
+    loser = rng.integers(0, 7, n)
+    team1_wins = rng.random(n) < 0.5
+    scores = np.where(team1_wins[:, np.newaxis], np.column_stack((np.full(n, 7), loser)),
+                      np.column_stack((loser, np.full(n, 7))))
+    return ratings, scores
+
+
+def _pozos(rng, n):
+    ratings = rng.integers(800, 2200, (n, PAIRS, 2))
+    courts = np.repeat(np.arange(1, NUMPISTAS + 1), PAIRS // NUMPISTAS)
+    initial = rng.permuted(np.broadcast_to(courts, (n, PAIRS)), axis=1)
+    final = rng.permuted(np.broadcast_to(courts, (n, PAIRS)), axis=1)
+    return ratings, np.stack((initial, final), axis=-1)
+
+
+def case_scalar_2v2(rng, n):
+    ratings, scores = _matches(rng, n)
+    rows = list(zip(ratings[:, :2].tolist(), ratings[:, 2:].tolist(), scores.tolist()))
+
+    def run():
+        for team1, team2, result in rows:
+            update_elo_2v2(team1, team2, result, **DEFAULTS_2V2)
+    return run
+
+
+def case_scalar_american(rng, n):
+    ratings, courts = _pozos(rng, n)
+    rows = list(zip(ratings.tolist(), courts.tolist()))
+
+    def run():
+        for pozo, results in rows:
+            update_elo_american(pozo, results, **DEFAULTS_AMERICAN)
+    return run
+
+
+def case_batch_2v2(rng, n):
+    ratings, scores = _matches(rng, n)
+    return lambda: update_elo_2v2_batch(ratings[:, :2], ratings[:, 2:], scores, **DEFAULTS_2V2)
+
+
+def case_batch_american(rng, n):
+    ratings, courts = _pozos(rng, n)
+    return lambda: update_elo_american_batch(ratings, courts, **DEFAULTS_AMERICAN)
+
+
+def case_replay_2v2(rng, n):
+    num_players = max(4 * n // 50, 8)
+    players = _distinct_players(rng, n, num_players)
+    _, scores = _matches(rng, n)
+    empty = np.empty((0, 2), dtype=np.int64)
+    log = MatchLog(np.zeros(n, dtype=np.int8), players, scores, np.zeros(1, dtype=np.int64), empty, empty)
+
+    def run():
+        store = PlayerStore(capacity=num_players)
+        store.indices(range(num_players))
+        Replay(store, DEFAULTS_2V2, DEFAULTS_AMERICAN).run_log(log)
+    return run
+
+
+def _distinct_players(rng, n, num_players):
+    players = rng.integers(0, num_players, (n, 4))
+    while True:
+        s = np.sort(players, axis=1)
+        bad = (s[:, 1:] == s[:, :-1]).any(axis=1)
+        if not bad.any():
+            return players
+        players[bad] = rng.integers(0, num_players, (int(bad.sum()), 4))
+
+
+def case_page3_scoring(rng, n):
+    """The data path of one page3 rerun: decode the pozo once and score it (cache cleared)."""
+    pozos = []
+    for ratings, courts in zip(*_pozos(rng, n)):
+        pozo = PozoState(PAIRS)
+        pozo.set_pairs(ratings.tolist(), courts.tolist())
+        pozos.append(pozo)
+
+    def run():
+        score_pozo.cache_clear()
+        for pozo in pozos:
+            ratings, courts = pozo.key()
+            score_pozo(ratings, courts, 20, 0, 10, 0, k=32, ratio=600, base=20, factoravg=0.7)
+    return run
+
+
+def case_page3_rerun(rng, n):
+    """A full Streamlit rerun of page3 with 12 pairs, through streamlit's AppTest."""
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return None
+    app = AppTest.from_file(os.path.join(ROOT, "elo.py"), default_timeout=60)
+    app.run()
+    app.sidebar.radio[0].set_value("Americana Sube-Baja Entera").run()
+
+    def run():
+        for _ in range(n):
+            app.run()
+    return run
+
+
+CASES = {
+    "scalar_2v2": (case_scalar_2v2, None),
+    "scalar_american": (case_scalar_american, 100_000),
+    "batch_2v2": (case_batch_2v2, None),
+    "batch_american": (case_batch_american, None),
+    "replay_2v2": (case_replay_2v2, None),
+    "page3_scoring": (case_page3_scoring, 100_000),
+    "page3_rerun": (case_page3_rerun, 1),
+}
+
+
+def measure(run, size, min_time, max_iterations):
+    run()
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < max_iterations and (not latencies or time.perf_counter() - start < min_time):
+        t = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - t)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "size": size,
+        "iterations": len(latencies),
+        "ops_per_sec": size / statistics.median(latencies),
+        "p50_ms": 1000 * statistics.median(latencies),
+        "p99_ms": 1000 * latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))],
+        "peak_mem_kb": peak / 1024,
+    }
+
+
+def compare(results, baseline, threshold, p99_floor=0.05):
+    """
+    Return the regressions of ``results`` against ``baseline``, as printable strings.
+
+    A p99 latency is the slowest of a handful of iterations unless there were many, so it
+    is only compared when both runs had ``MIN_P99_ITERATIONS`` iterations, and only flagged
+    when it grew by more than ``p99_floor`` milliseconds as well as by the threshold.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current["ops_per_sec"] < previous["ops_per_sec"] * (1 - threshold):
+            regressions.append(f"{name}: {previous['ops_per_sec']:.0f} -> {current['ops_per_sec']:.0f} ops/s")
+        if min(current["iterations"], previous["iterations"]) < MIN_P99_ITERATIONS:
+            continue
+        if current["p99_ms"] > max(previous["p99_ms"] * (1 + threshold), previous["p99_ms"] + p99_floor):
+            regressions.append(f"{name}: p99 {previous['p99_ms']:.3f} -> {current['p99_ms']:.3f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1,1000,1000000", help="comma separated event counts")
+    parser.add_argument("--only", nargs="*", choices=sorted(CASES), help="cases to run")
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds spent timing each case")
+    parser.add_argument("--max-iterations", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown")
+    parser.add_argument("--p99-floor", type=float, default=0.05, help="allowed p99 increase in ms")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    results = {}
+    for name in args.only or CASES:
+        build, max_size = CASES[name]
+        for size in sizes:
+            if max_size is not None and size > max_size:
+                continue
+            run = build(np.random.default_rng(args.seed), size)
+            key = f"{name}[{size}]"
+            if run is None:
+                print(f"{key:<28} skipped")
+                continue
+            results[key] = measure(run, size, args.min_time, args.max_iterations)
+            r = results[key]
+            print(f"{key:<28} {r['ops_per_sec']:>14,.0f} ops/s  p50 {r['p50_ms']:>10.3f} ms  "
+                  f"p99 {r['p99_ms']:>10.3f} ms  peak {r['peak_mem_kb']:>10,.0f} KiB")
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.p99_floor)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,179 +1,57 @@
-import math
 import random
+import time
+
 import streamlit as st
-import pandas as pd
-from pickle import dumps, loads
 
-def update_elo_2v2(team1_ratings, team2_ratings, result, k=32, ratio=400, base=50, factoravg = 0.5):
-    """
-    Calculate new Elo ratings for two teams based on the outcome of a match.
-
-    Args:
-        team1_ratings (list): List of integers representing the Elo ratings of the first team's players.
-        team2_ratings (list): List of integers representing the Elo ratings of the second team's players.
-        result (list): List of two integers representing the scores of team 1 and team 2, respectively.
-        k (int, optional): The maximum possible adjustment per player per game. Defaults to 32.
-        ratio (int, optional): Used to scale the difference in ratings. Defaults to 400.
-        base (int, optional): A base adjustment factor that can be modified based on the rating difference. Defaults to 50.
-
-    Returns:
-        tuple: Two lists containing the new Elo ratings for the players of team 1 and team 2 respectively.
-    """
-    team1_avg = sum(team1_ratings) / len(team1_ratings)
-    team2_avg = sum(team2_ratings) / len(team2_ratings)
-    
-    # if (result[0] == 0): result[0] = 1
-    # if (result[1] == 0): result[1] = 1
-    
-    # game_result = (result[0] / sum(result))*0.8 + 0.1
-    game_result = (result[0] / sum(result))*0.9+ 0.05
-    # game_result = result[0] / sum(result)
-        
-    rating_diff = abs(team1_avg - team2_avg)
-    
-    if result[0] > result[1]:
-        team1_factor, team2_factor = 1, -1
-    else:
-        team1_factor, team2_factor = -1, 1
-    
-    if rating_diff > 1000:
-        base -= 15
-    elif rating_diff > 700:
-        base -= 10
-    elif rating_diff > 400:
-        base -= 5
-    
-    def calculate_new_rating(rating, opponent_avg, game_result, factor):
-        P = 1 / (1 + math.pow(10, (opponent_avg - rating) / ratio))
-        return int(round(factor * base + k * (game_result - P)))
-    
-    team1_new_ratings = []
-    for i in range(len(team1_ratings)):
-        if i == 0:
-            weightedavg = team1_ratings[i] * factoravg + team1_ratings[i+1] * (1-factoravg)
-        else:
-            weightedavg = team1_ratings[i] * factoravg + team1_ratings[i-1] * (1-factoravg)
-
-        new_rating = calculate_new_rating(weightedavg, team2_avg, game_result, team1_factor)
-        team1_new_ratings.append(new_rating)
-    
-    team2_new_ratings = []
-    for i in range(len(team2_ratings)):
-        if i == 0:
-            weightedavg = team2_ratings[i] * factoravg + team2_ratings[i+1] * (1-factoravg)
-        else:
-            weightedavg = team2_ratings[i] * factoravg + team2_ratings[i-1] * (1-factoravg)
-        new_rating = calculate_new_rating(weightedavg, team1_avg, 1 - game_result, team2_factor)
-        team2_new_ratings.append(new_rating)
-    
-    return team1_new_ratings, team2_new_ratings
-   
-def update_elo_american(ratings, results, multipistes, compensacio, compensacio2, bonificacion, k=20, ratio = 800,numpistas = 6, base = 10, factoravg = 0.5):
-    # Calcula los nuevos puntajes Elo de los jugadores
-    new_ratings = []
-    avg = 0
-    for pareja in ratings: 
-        avg += pareja[0] + pareja[1]
-    avg = avg / (len(ratings)*2)
-    
-    i = 0
-    first = True
-    for result in results:
-        pistainicial = result[0]
-        pistafinal = result[1]
-        gained = pistainicial - pistafinal
-        gainedfactor = 0
-        
-        if (gained != 0):
-            gainedfactor = abs(gained) - 1
-            
-        factor = (1 + gainedfactor * (multipistes/100))
-        if (gained < 0):
-            factor *= -1
-        
-        
-        americana_result = (gained / numpistas)/2+0.5
-        
-        preajuste = 0
-        if ((pistainicial == 1 or pistainicial == 2) and pistafinal == 1):
-            preajuste = compensacio
-        elif ((pistainicial == 5 or pistainicial == 6) and pistafinal == 6):
-            preajuste = -compensacio
-        
-        
-        
-        new_ratings_pareja = []
-        
-        for j in range(len(ratings[i])):
-            if j == 0:
-                weightedavg = ratings[i][j] * factoravg + ratings[i][j+1] * (1-factoravg)
-            else:
-                weightedavg = ratings[i][j] * factoravg + ratings[i][j-1] * (1-factoravg)
+from elo_core import instrument, update_elo_2v2, update_elo_american
+from elo_core.pozo import PozoState, score_pozo
 
+# Panels that only depend on their own widgets rerun alone when one of them changes,
+# instead of the whole script. Streamlit < 1.37 only has the experimental name, and
+# without either the panels simply run with the page.
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", lambda func: func)
 
-            P = 1/ (1 + math.pow(10, (avg - weightedavg) / ratio))
-            new_elo = int(round(factor * base + k * (americana_result - P)))
 
+@st.cache_data(max_entries=1024, show_spinner=False)
+def score_2v2(team1, team2, result, k, ratio, base, factoravg):
+    """``update_elo_2v2`` cached on the ratings, the result and the parameters, shared by every session."""
+    return update_elo_2v2(list(team1), list(team2), list(result), k, ratio, base, factoravg)
 
-            ajuste = preajuste
-            diff = weightedavg - avg
 
-            if compensacio2 != 0:
-                if pistafinal == 6:
-                    ajuste -= compensacio2 * (1+(abs(diff)//200)/10 if diff > 0 else 1)
-                elif pistafinal == 5:
-                    ajuste -= compensacio2*0.5
-                elif pistafinal == 1:
-                    ajuste += bonificacion * (1+(abs(diff)//200)/10 if diff < 0 else 1)
-                elif pistafinal == 2:
-                    ajuste += bonificacion*0.5
+@st.cache_data(max_entries=1024, show_spinner=False)
+def score_american(ratings, results, multpistes, compensacio, penalizacion, bonificacion, k, ratio, base, factoravg):
+    """``update_elo_american`` cached on the ratings, the results and the parameters."""
+    return update_elo_american([list(r) for r in ratings], [list(r) for r in results], multpistes, compensacio,
+                               penalizacion, bonificacion, k=k, ratio=ratio, base=base, factoravg=factoravg)
 
 
-            new_elo += round(ajuste)
-            new_ratings_pareja.append(new_elo)
-            
-        new_ratings.append((new_ratings_pareja[0],new_ratings_pareja[1]))
-        i += 1
-        first = False
+@st.cache_data(max_entries=256, show_spinner=False)
+def results_table(columns):
+    """Build a result table from ``((name, values), ...)``, once per distinct content."""
+    import pandas as pd
 
+    with instrument.stage("ui.dataframe"):
+        return pd.DataFrame({name: list(values) for name, values in columns})
 
-    return new_ratings
 
-####################################################################INTERFICIE STREAMLIT####################################################################
+def report_cpu(container, label, start, stage):
+    """
+    Show the CPU time spent since ``start`` and record it as ``stage``.
 
+    Streamlit runs every session in its own thread, so the thread CPU time is the cost of
+    this rerun alone, even with other users connected.
+    """
+    cpu = time.thread_time() - start
+    if instrument.enabled:
+        instrument.observe(stage, cpu)
+    container.caption(f"{label}: {cpu * 1000:.1f} ms de CPU")
 
-def page1():
-    st.header("Calculadora de Puntajes Elo Partidos Normales")
-    
-    col1, col2= st.columns(2)
-    with col2:
-        st.subheader("Parámetros de Elo")
-        with st.expander("Parámetros de Elo", expanded=True,):
-            ratio = st.slider("Importancia de Diferencia de Ratings (Ratio)", min_value=100, max_value=2000, value=400, step=50)
-            k = st.slider("Factor de Ajuste Elo (k)", min_value=0, max_value=100, value=20, step=2)
-            base = st.slider("Valor Base (Base)", min_value=0, max_value=100, value=50, step=1)
-            factoravg = st.slider("Peso media pareja", min_value=0, max_value=100, value=70, step=1)
+####################################################################INTERFICIE STREAMLIT####################################################################
 
-    if "ratings" not in st.session_state:
-        st.session_state["ratings"] = [1200, 1210, 1220, 1230]
-        st.session_state["result"] = [7, 5]
-    
-    with col2:
-        with st.expander("Parámetros de Aleatoriedad", expanded=True):
-            min_rating = st.number_input("Rating Mínimo", value=1000)
-            max_rating = st.number_input("Rating Máximo", value=1500)
-        
-        generate_button = st.button("Generar Ratings Aleatorios")   
-        if generate_button:
-            st.session_state["ratings"] = [random.randint(min_rating, max_rating) for _ in range(4)]
-            result1 = random.randint(0, 7)
-            result2 = 7 if result1 != 7 else random.randint(0, 6)
-            st.session_state["result"] = [result1, result2]
-    
-    with col1:
-        st.subheader("Entrada de Ratings y Resultados")
-        with st.expander("Explicación de Parámetros:"):
-            st.write("""
+
+def match_explanation():
+    with st.expander("Explicación de Parámetros:"):
+        st.write("""
             - **Ratio**: Determina la importancia de la diferencia de ratings entre los equipos. Un valor más alto reduce la influencia de la diferencia de ratings.
             
             - **k**: Controla la velocidad de ajuste del rating Elo. Un valor más alto significa ajustes más rápidos.
@@ -181,43 +59,21 @@ def page1():
             - **Base**: Ajuste adicional que puede influir en el cambio de rating, especialmente cuando hay grandes diferencias de rating entre equipos.
                      
             - **Peso media pareja**: Factor que pondera el rating de los jugadores en función de la pareja. Un valor más alto significa que el rating del jugador se basa más en su propio rating que en el de su compañero. Un valor de 50, equivale a una media normal.
-            """)
-
-        col3, col4 = st.columns(2)
-        with col3:
-            st.write("Equipo 1:")
-            team1_elo = [int(st.text_input(f"Jugador {i+1}: ", st.session_state["ratings"][i])) for i in range(2)]
-        with col4:
-            st.write("Equipo 2:")
-            team2_elo = [int(st.text_input(f"Jugador {i+3}: ", st.session_state["ratings"][i+2])) for i in range(2)]
-            
-        result_input = st.text_input("Resultado: ", f"{st.session_state['result'][0]}-{st.session_state['result'][1]}")
-        st.session_state["result"] = list(map(int, result_input.split("-")))
-
-        new_elo_team1, new_elo_team2 = update_elo_2v2(team1_elo, team2_elo, st.session_state["result"], k, ratio, base, factoravg/100)
-
-        data = {
-            "Jugador": ["Jugador 1", "Jugador 2", "Jugador 3", "Jugador 4"],
-            "Equipo": ["Equipo 1", "Equipo 1", "Equipo 2", "Equipo 2"],
-            "Rating Anterior": team1_elo + team2_elo,
-            "Nuevo Rating": new_elo_team1 + new_elo_team2
-        }
+        """)
 
-        df = pd.DataFrame(data)
-        st.table(df)
+@fragment
+def match_panel(base_default):
+    start = time.thread_time()
 
-def page2():
-    st.header("Calculadora de Puntajes Elo Partidos Americana")
-    
     col1, col2= st.columns(2)
     with col2:
         st.subheader("Parámetros de Elo")
         with st.expander("Parámetros de Elo", expanded=True,):
             ratio = st.slider("Importancia de Diferencia de Ratings (Ratio)", min_value=100, max_value=2000, value=400, step=50)
             k = st.slider("Factor de Ajuste Elo (k)", min_value=0, max_value=100, value=20, step=2)
-            base = st.slider("Valor Base (Base)", min_value=0, max_value=100, value=20, step=1)
+            base = st.slider("Valor Base (Base)", min_value=0, max_value=100, value=base_default, step=1)
             factoravg = st.slider("Peso media pareja", min_value=0, max_value=100, value=70, step=1)
-            
+
     if "ratings" not in st.session_state:
         st.session_state["ratings"] = [1200, 1210, 1220, 1230]
         st.session_state["result"] = [7, 5]
@@ -236,90 +92,70 @@ def page2():
     
     with col1:
         st.subheader("Entrada de Ratings y Resultados")
-        with st.expander("Explicación de Parámetros:"):
-            st.write("""
-            - **Ratio**: Determina la importancia de la diferencia de ratings entre los equipos. Un valor más alto reduce la influencia de la diferencia de ratings.
-            
-            - **k**: Controla la velocidad de ajuste del rating Elo. Un valor más alto significa ajustes más rápidos.
-        
-            - **Base**: Ajuste adicional que puede influir en el cambio de rating, especialmente cuando hay grandes diferencias de rating entre equipos.
-                     
-            - **Peso media pareja**: Factor que pondera el rating de los jugadores en función de la pareja. Un valor más alto significa que el rating del jugador se basa más en su propio rating que en el de su compañero. Un valor de 50, equivale a una media normal.
-            """)
         col3, col4 = st.columns(2)
         with col3:
             st.write("Equipo 1:")
-            team1_elo = [int(st.text_input(f"Jugador {i+1}: ", st.session_state["ratings"][i])) for i in range(2)]
+            team1_elo = tuple(int(st.text_input(f"Jugador {i+1}: ", st.session_state["ratings"][i])) for i in range(2))
         with col4:
             st.write("Equipo 2:")
-            team2_elo = [int(st.text_input(f"Jugador {i+3}: ", st.session_state["ratings"][i+2])) for i in range(2)]
+            team2_elo = tuple(int(st.text_input(f"Jugador {i+3}: ", st.session_state["ratings"][i+2])) for i in range(2))
             
         result_input = st.text_input("Resultado: ", f"{st.session_state['result'][0]}-{st.session_state['result'][1]}")
         st.session_state["result"] = list(map(int, result_input.split("-")))
 
-        new_elo_team1, new_elo_team2 = update_elo_2v2(team1_elo, team2_elo, st.session_state["result"], k, ratio, base, factoravg/100)
+        new_elo_team1, new_elo_team2 = score_2v2(team1_elo, team2_elo, tuple(st.session_state["result"]), k, ratio, base, factoravg/100)
+
+        st.table(results_table((
+            ("Jugador", ("Jugador 1", "Jugador 2", "Jugador 3", "Jugador 4")),
+            ("Equipo", ("Equipo 1", "Equipo 1", "Equipo 2", "Equipo 2")),
+            ("Rating Anterior", team1_elo + team2_elo),
+            ("Nuevo Rating", tuple(new_elo_team1 + new_elo_team2)),
+        )))
+
+    report_cpu(st, "Panel", start, "ui.fragment")
 
-        data = {
-            "Jugador": ["Jugador 1", "Jugador 2", "Jugador 3", "Jugador 4"],
-            "Equipo": ["Equipo 1", "Equipo 1", "Equipo 2", "Equipo 2"],
-            "Rating Anterior": team1_elo + team2_elo,
-            "Nuevo Rating": new_elo_team1 + new_elo_team2
-        }
+def page1():
+    st.header("Calculadora de Puntajes Elo Partidos Normales")
+    match_explanation()
+    match_panel(50)
 
-        df = pd.DataFrame(data)
-        st.table(df)
+def page2():
+    st.header("Calculadora de Puntajes Elo Partidos Americana")
+    match_explanation()
+    match_panel(20)
         
 def update_ratingsComplets(key, index, isSecond, ratings):
 
     value = st.session_state[key]
     
     if ratings:
-        if not isSecond:
-            newRating = (value, loads(st.session_state.ratingsComplets)[index][1])
-        else:
-            newRating = (loads(st.session_state.ratingsComplets)[index][0], value)
-        aux = loads(st.session_state.ratingsComplets)
-        aux[index] = newRating
-        st.session_state.ratingsComplets = dumps(aux)
+        st.session_state.pozo.set_rating(index, isSecond, value)
     else:
-        if not isSecond:
-            newResult = (value, loads(st.session_state.resultsComplets)[index][1])
-        else:
-            newResult = (loads(st.session_state.resultsComplets)[index][0], value)
-        aux = loads(st.session_state.resultsComplets)
-        aux[index] = newResult
-        st.session_state.resultsComplets = dumps(aux)    
+        st.session_state.pozo.set_court(index, isSecond, value)
 
-def page3():
-    st.header("Calculadora de Puntajes Elo Partidos Americana Sube-Baja")
-    st.write("")
-    st.write("")
-
-    if "ratingsComplets" not in st.session_state:
-        ratingsComplets = [(1000, 1000)] * 12
-        st.session_state.ratingsComplets = dumps(ratingsComplets)
-
-    if "resultsComplets" not in st.session_state:
-        resultsComplets = [(1, 1), (1, 1), (2, 2), (2, 2), (3, 3), (3, 3), (4, 4), (4, 4), (5, 5), (5, 5), (6, 6), (6, 6)]
-        st.session_state.resultsComplets = dumps(resultsComplets)
-
-    for i in range(0, 12):
-        st.session_state[f"rating_{i*2}"] = loads(st.session_state.ratingsComplets)[i][0]
-        st.session_state[f"rating_{i*2+1}"] = loads(st.session_state.ratingsComplets)[i][1]
-        st.session_state[f"result_INI_{i}"] = loads(st.session_state.resultsComplets)[i][0]
-        st.session_state[f"result_FIN_{i}"] = loads(st.session_state.resultsComplets)[i][1]
-
-    with st.expander(r"$\textsf{\Large Explicacion de parametros}$", expanded=True):
-        st.markdown("""
-            - **Importancia de Diferencia de Ratings:** Determina la sensibilidad del cálculo Elo a la diferencia de ratings entre jugadores. Valores más altos hacen que la diferencia de rating tenga menos impacto.
-            - **Factor de Ajuste Elo:** Controla la magnitud del ajuste del rating después de cada partida. Valores más altos resultan en cambios de rating más grandes.
-            - **Puntuación Base:** Añade una cantidad fija al ajuste de Elo en cada partida.
-            - **Multiplicador de Pistas en %:** Ajusta el impacto de la diferencia de pistas ganadas o perdidas en el cálculo del Elo. Se aplica sobre la puntuación base. Si se suben 5 pistas se ganará (4 * multiplicador * base) como valor base.
-            - **Compensación:** Ajusta el Elo de los jugadores que empiezan en la pista 1/2 y terminan en la 1 y de los jugadores que empiezan en la 5/6 y terminan en la 6.
-            - **penalizacion 5/6:** Aplica una esta penalización por terminar en la pista 6 y la mitad por terminal en la pista 5. La penalizacion se ve aumentada en caso de que la mendia ponderada del jugador sea peor que la media.
-            - **bonificacion 1/2:** Aplica una bonificación por terminar en la pista 1 y la mitad por terminal en la pista 2. La bonificación se ve aumentada en caso de que la mendia ponderada del jugador sea mejor que la media.
-            - **Peso media pareja:** Factor que pondera el rating de los jugadores en función de la pareja. Un valor más alto significa que el rating del jugador se basa más en su propio rating que en el de su compañero. Un valor de 50 equivale a una media normal.
-        """)
+def pair_inputs(i, numpistas):
+    """Draw the inputs of pair ``i`` and return the column its adjustments go to."""
+    with st.expander(f"pareja {i}", expanded=True):
+        col3, colR, col5 = st.columns(3)
+        with col3:
+            st.number_input(f"Jugador {i*2}", key=f"rating_{i*2}", step=1, 
+                            on_change=update_ratingsComplets, args=(f"rating_{i*2}", i, False, True))
+            st.number_input(f"Jugador {i*2+1}", key=f"rating_{i*2+1}", step=1, 
+                            on_change=update_ratingsComplets, args=(f"rating_{i*2+1}", i, True, True))
+        with col5:
+            st.number_input(f"Pista Inicial Pareja {i}", key=f"result_INI_{i}", min_value=1, max_value=numpistas, step=1, 
+                            on_change=update_ratingsComplets, args=(f"result_INI_{i}", i, False, False))
+            st.number_input(f"Pista Final Pareja {i}", key=f"result_FIN_{i}", min_value=1, max_value=numpistas, step=1, 
+                            on_change=update_ratingsComplets, args=(f"result_FIN_{i}", i, True, False))
+    return colR
+
+@fragment
+def pozo_panel():
+    start = time.thread_time()
+
+    if "pozo" not in st.session_state:
+        st.session_state.pozo = PozoState(pairs=12, rating=1000)
+    pozo = st.session_state.pozo
 
     st.subheader("Configuración de Parámetros Aleatorios")
     with st.expander(r"$\textsf{\Large Configuración de Ratings Aleatorios}$", expanded=True):
@@ -341,111 +177,100 @@ def page3():
             factoravg = st.slider("Peso Media Pareja", min_value=0, max_value=100, value=70, step=1)
             bonificacion = st.slider("Bonificacion 1/2", min_value=0, max_value=100, value=0, step=1)
     
-    generate_ratings = st.button("Ratings Aleatorios")
+        num_pairs = st.number_input("Número de parejas", key="pozo_pairs", min_value=4, max_value=48,
+                                    value=len(pozo), step=2)
+    # Two pairs per court; with an odd number of pairs, the last court has only one.
+    numpistas = (num_pairs + 1) // 2
 
-    if generate_ratings:
-        num_pairs = 12
-        st.session_state.ratingsComplets = dumps([(random.randint(average - variability, average + variability), 
-                                                   random.randint(average - variability, average + variability)) for _ in range(num_pairs)])
-        aux = []
-        pistasInicials = {}
-        pistasFinals = {}
-        
-        for i in range(0, num_pairs):
-            pIni = random.randint(1, 6)
-            while (pIni in pistasInicials and pistasInicials[pIni] >= 2):
-                pIni = random.randint(1, 6)
-            pistasInicials[pIni] = pistasInicials.get(pIni, 0) + 1
-            pFin = random.randint(1, 6)
-            while (pFin in pistasFinals and pistasFinals[pFin] >= 2):
-                pFin = random.randint(1, 6)
-            pistasFinals[pFin] = pistasFinals.get(pFin, 0) + 1
-            aux.append((pIni, pFin))
-
-        for i in range(12):
-            st.session_state[f"rating_{i*2}"] = loads(st.session_state.ratingsComplets)[i][0]
-            st.session_state[f"rating_{i*2+1}"] = loads(st.session_state.ratingsComplets)[i][1]
-            st.session_state[f"result_INI_{i}"] = aux[i][0]
-            st.session_state[f"result_FIN_{i}"] = aux[i][1]
-        st.session_state.resultsComplets = dumps(aux)
+    # A new size starts a new pozo.
+    resized = num_pairs != len(pozo)
+    if resized:
+        st.session_state.pozo = pozo = PozoState(pairs=num_pairs, rating=1000, numpistas=numpistas)
 
+    generate_ratings = st.button("Ratings Aleatorios")
+    seed_courts = st.button("Pistas Equilibradas")
 
+    if generate_ratings:
+        randratings = [(random.randint(average - variability, average + variability), 
+                        random.randint(average - variability, average + variability)) for _ in range(num_pairs)]
+        pistas = [i // 2 + 1 for i in range(num_pairs)]
+        aux = list(zip(random.sample(pistas, num_pairs), random.sample(pistas, num_pairs)))
+        pozo.set_pairs(randratings, aux)
+
+    if seed_courts:
+        from elo_core.seeding import assign_courts
+
+        flat, _ = pozo.key()
+        pairs = list(zip(flat[::2], flat[1::2]))
+        courts, _ = assign_courts(pairs, numpistas=numpistas, ratio=ratio, factoravg=factoravg / 100)
+        pozo.set_pairs(pairs, [(c, c) for c in courts.tolist()])
+
+    # The inputs keep the pozo up to date through their callbacks, so their state is only
+    # written when the pozo changed some other way, or when Streamlit dropped it after
+    # the page was left.
+    ratingsComplets, resultsComplets = pozo.key()
+    overwrite = resized or generate_ratings or seed_courts
+    for i in range(num_pairs):
+        for key, value in ((f"rating_{i*2}", ratingsComplets[i*2]), (f"rating_{i*2+1}", ratingsComplets[i*2+1]),
+                           (f"result_INI_{i}", resultsComplets[i*2]), (f"result_FIN_{i}", resultsComplets[i*2+1])):
+            if overwrite or key not in st.session_state:
+                st.session_state[key] = value
 
     st.subheader("Entrada de Ratings y Resultados")
 
-    avg = sum([sum(pair) for pair in loads(st.session_state.ratingsComplets)]) / (len(loads(st.session_state.ratingsComplets)) * 2)
+    avg = sum(ratingsComplets) / len(ratingsComplets)
     st.subheader(f"Media del pozo: {round(avg)}")
 
     colR = {}
     col1, col2 = st.columns(2)
     with col1:
-        for i in range(0, 12, 2):
-            with st.expander(f"pareja {i}", expanded=True):
-                col3, colR[i], col5 = st.columns(3)
-                with col3:
-                    st.number_input(f"Jugador {i*2}", key=f"rating_{i*2}", step=1, 
-                                    on_change=update_ratingsComplets, args=(f"rating_{i*2}", i, False, True))
-                    st.number_input(f"Jugador {i*2+1}", key=f"rating_{i*2+1}", step=1, 
-                                    on_change=update_ratingsComplets, args=(f"rating_{i*2+1}", i, True, True))
-                with col5:
-                    st.number_input(f"Pista Inicial Pareja {i}", key=f"result_INI_{i}", min_value=1, max_value=6, step=1, 
-                                    on_change=update_ratingsComplets, args=(f"result_INI_{i}", i, False, False))
-                    st.number_input(f"Pista Final Pareja {i}", key=f"result_FIN_{i}", min_value=1, max_value=6, step=1, 
-                                    on_change=update_ratingsComplets, args=(f"result_FIN_{i}", i, True, False))
-    
+        for i in range(0, num_pairs, 2):
+            colR[i] = pair_inputs(i, numpistas)
     with col2:
-        for i in range(1, 12, 2):
-            with st.expander(f"pareja {i}", expanded=True):
-                col3, colR[i], col5 = st.columns(3)
-                with col3:
-                    st.number_input(f"Jugador {i*2}", key=f"rating_{i*2}", step=1, 
-                                    on_change=update_ratingsComplets, args=(f"rating_{i*2}", i, False, True))
-                    st.number_input(f"Jugador {i*2+1}", key=f"rating_{i*2+1}", step=1, 
-                                    on_change=update_ratingsComplets, args=(f"rating_{i*2+1}", i, True, True))
-                with col5:
-                    st.number_input(f"Pista Inicial Pareja {i}", key=f"result_INI_{i}", min_value=1, max_value=6, step=1, 
-                                    on_change=update_ratingsComplets, args=(f"result_INI_{i}", i, False, False))
-                    st.number_input(f"Pista Final Pareja {i}", key=f"result_FIN_{i}", min_value=1, max_value=6, step=1, 
-                                    on_change=update_ratingsComplets, args=(f"result_FIN_{i}", i, True, False))
+        for i in range(1, num_pairs, 2):
+            colR[i] = pair_inputs(i, numpistas)
 
+    new_elo_team1 = score_pozo(ratingsComplets, resultsComplets, multpistes, compensacio, penalizacion, bonificacion, k = k, ratio = ratio, numpistas = numpistas, base = base, factoravg = factoravg/100)
 
-    new_elo_team1 = update_elo_american(loads(st.session_state.ratingsComplets),  loads(st.session_state.resultsComplets), multpistes, compensacio, penalizacion, bonificacion, k = k, ratio = ratio, base = base, factoravg = factoravg/100)
-
-
-
-    for i in range(12):
+    # Plain text instead of disabled inputs: no widget state to rebuild for every player.
+    for i in range(num_pairs):
         with colR[i]:
-            st.text_input(f"Cambio Elo Jugador {i*2}", str(new_elo_team1[i][0]), disabled=True)
-            st.text_input(f"Cambio Elo Jugador {i*2+1}", str(new_elo_team1[i][1]), disabled=True)
-
-
-
+            st.markdown(f"Cambio Elo Jugador {i*2}: **{new_elo_team1[i][0]}**  \n"
+                        f"Cambio Elo Jugador {i*2+1}: **{new_elo_team1[i][1]}**")
 
     st.write("")
     st.write("")
+    report_cpu(st, "Panel", start, "ui.fragment")
 
-
-
-def page4():
+def page3():
     st.header("Calculadora de Puntajes Elo Partidos Americana Sube-Baja")
     st.write("")
     st.write("")
 
+    with st.expander(r"$\textsf{\Large Explicacion de parametros}$", expanded=True):
+        st.markdown("""
+            - **Importancia de Diferencia de Ratings:** Determina la sensibilidad del cálculo Elo a la diferencia de ratings entre jugadores. Valores más altos hacen que la diferencia de rating tenga menos impacto.
+            - **Factor de Ajuste Elo:** Controla la magnitud del ajuste del rating después de cada partida. Valores más altos resultan en cambios de rating más grandes.
+            - **Puntuación Base:** Añade una cantidad fija al ajuste de Elo en cada partida.
+            - **Multiplicador de Pistas en %:** Ajusta el impacto de la diferencia de pistas ganadas o perdidas en el cálculo del Elo. Se aplica sobre la puntuación base. Si se suben 5 pistas se ganará (4 * multiplicador * base) como valor base.
+            - **Compensación:** Ajusta el Elo de los jugadores que empiezan en la pista 1/2 y terminan en la 1 y de los jugadores que empiezan en la 5/6 y terminan en la 6.
+            - **penalizacion 5/6:** Aplica una esta penalización por terminar en la pista 6 y la mitad por terminal en la pista 5. La penalizacion se ve aumentada en caso de que la mendia ponderada del jugador sea peor que la media.
+            - **bonificacion 1/2:** Aplica una bonificación por terminar en la pista 1 y la mitad por terminal en la pista 2. La bonificación se ve aumentada en caso de que la mendia ponderada del jugador sea mejor que la media.
+            - **Peso media pareja:** Factor que pondera el rating de los jugadores en función de la pareja. Un valor más alto significa que el rating del jugador se basa más en su propio rating que en el de su compañero. Un valor de 50 equivale a una media normal.
+        """)
+
+    pozo_panel()
+
+
+
+@fragment
+def pair_panel():
+    start = time.thread_time()
+
     if "ratings" not in st.session_state:
         st.session_state.ratings = (1500, 1500)
     if "results" not in st.session_state:
         st.session_state.results = (1, 1)
-    with st.expander(r"$\textsf{\Large Explicacion de parametros}$", expanded = True):
-            st.markdown("""
-                - **Importancia de Diferencia de Ratings:** Determina la sensibilidad del cálculo Elo a la diferencia de ratings entre jugadores. Valores más altos hacen que la diferencia de rating tenga menos impacto.
-                - **Factor de Ajuste Elo:** Controla la magnitud del ajuste del rating después de cada partida. Valores más altos resultan en cambios de rating más grandes.
-                - **Puntuación Base:** Añade una cantidad fija al ajuste de Elo en cada partida.
-                - **Multiplicador de Pistas en %:** Ajusta el impacto de la diferencia de pistas ganadas o perdidas en el cálculo del Elo. Se aplica sobre la puntuacion base. Si se suben 5 pistas se ganara (4 * multiplcador * base) como valor base.
-                - **Compensación:** Ajusta el Elo de los jugadores que empiezan en la pista 1/2 y terminan en la 1 y de los jugadores que empiezan en la 5/6 y terminan en la 6.
-                - **penalizacion 5/6:** Aplica una esta penalización por terminar en la pista 6 y la mitad por terminal en la pista 5. La penalizacion se ve aumentada en caso de que la mendia ponderada del jugador sea peor que la media.
-                - **bonificacion 1/2:** Aplica una bonificación por terminar en la pista 1 y la mitad por terminal en la pista 2. La bonificación se ve aumentada en caso de que la mendia ponderada del jugador sea mejor que la media.
-                - **Peso media pareja:** Factor que pondera el rating de los jugadores en función de la pareja. Un valor más alto significa que el rating del jugador se basa más en su propio rating que en el de su compañero. un valor de 50, equivale a una media normal.
-            """)
     col1, col2 = st.columns([2,1])
     with col2:
         st.subheader("Configuración Parámetros")
@@ -493,31 +318,55 @@ def page4():
         with col4:
             results[0] = (st.number_input("Pista Inicial: ", min_value=1, max_value = 6, value=results[0][0]), st.number_input("Pista Final: ", min_value=1, max_value = 6, value=results[0][1]))
             
-        new_elo_team1 = update_elo_american(ratings, results, multpistes, compensacio, penalizacion, bonificacion, k = k, ratio = ratio, base = base, factoravg = factoravg/100)
+        new_elo_team1 = score_american(tuple(ratings), tuple(results), multpistes, compensacio, penalizacion, bonificacion, k, ratio, base, factoravg/100)
 
     with col5:
         st.write("Resultados:")
-        data = {
-            'Jugador': ['Jugador 1', 'Jugador 2'],
-            'Rating inicial': [ratings[0][0], ratings[0][1]],
-            'Cambio Elo': [new_elo_team1[0][0], new_elo_team1[0][1]]
-        }
+        st.write(results_table((
+            ('Jugador', ('Jugador 1', 'Jugador 2')),
+            ('Rating inicial', (ratings[0][0], ratings[0][1])),
+            ('Cambio Elo', (new_elo_team1[0][0], new_elo_team1[0][1])),
+        )))
 
-        df = pd.DataFrame(data)
-        st.write(df)
+    report_cpu(st, "Panel", start, "ui.fragment")
 
-st.set_page_config(layout="wide")
-            
-menu = st.sidebar.radio("Menu", ["Partido Normal", "Americana", "Americana Sube-Baja Entera", "Americana Sube-Baja"])
-
-
-if menu == "Partido Normal":
-    page1()
-elif menu == "Americana":
-    page2()
-elif menu == "Americana Sube-Baja Entera":
-    page3()
-elif menu == "Americana Sube-Baja":
-    page4()
-else:
-    st.error("Opción no válida")
+def page4():
+    st.header("Calculadora de Puntajes Elo Partidos Americana Sube-Baja")
+    st.write("")
+    st.write("")
+
+    with st.expander(r"$\textsf{\Large Explicacion de parametros}$", expanded = True):
+            st.markdown("""
+                - **Importancia de Diferencia de Ratings:** Determina la sensibilidad del cálculo Elo a la diferencia de ratings entre jugadores. Valores más altos hacen que la diferencia de rating tenga menos impacto.
+                - **Factor de Ajuste Elo:** Controla la magnitud del ajuste del rating después de cada partida. Valores más altos resultan en cambios de rating más grandes.
+                - **Puntuación Base:** Añade una cantidad fija al ajuste de Elo en cada partida.
+                - **Multiplicador de Pistas en %:** Ajusta el impacto de la diferencia de pistas ganadas o perdidas en el cálculo del Elo. Se aplica sobre la puntuacion base. Si se suben 5 pistas se ganara (4 * multiplcador * base) como valor base.
+                - **Compensación:** Ajusta el Elo de los jugadores que empiezan en la pista 1/2 y terminan en la 1 y de los jugadores que empiezan en la 5/6 y terminan en la 6.
+                - **penalizacion 5/6:** Aplica una esta penalización por terminar en la pista 6 y la mitad por terminal en la pista 5. La penalizacion se ve aumentada en caso de que la mendia ponderada del jugador sea peor que la media.
+                - **bonificacion 1/2:** Aplica una bonificación por terminar en la pista 1 y la mitad por terminal en la pista 2. La bonificación se ve aumentada en caso de que la mendia ponderada del jugador sea mejor que la media.
+                - **Peso media pareja:** Factor que pondera el rating de los jugadores en función de la pareja. Un valor más alto significa que el rating del jugador se basa más en su propio rating que en el de su compañero. un valor de 50, equivale a una media normal.
+            """)
+    pair_panel()
+
+def main():
+    start = time.thread_time()
+    st.set_page_config(layout="wide")
+
+    menu = st.sidebar.radio("Menu", ["Partido Normal", "Americana", "Americana Sube-Baja Entera", "Americana Sube-Baja"])
+
+    if menu == "Partido Normal":
+        page1()
+    elif menu == "Americana":
+        page2()
+    elif menu == "Americana Sube-Baja Entera":
+        page3()
+    elif menu == "Americana Sube-Baja":
+        page4()
+    else:
+        st.error("Opción no válida")
+
+    report_cpu(st.sidebar, "Última ejecución", start, "ui.rerun")
+
+
+if __name__ == "__main__":
+    main()
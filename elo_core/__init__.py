@@ -0,0 +1,57 @@
+"""Headless Elo scoring for padel matches.
+
+Importing this package only loads the scalar scoring functions, which depend on
+nothing but ``math``. The NumPy-backed engines are imported on first access, so
+workers that only score single matches never pay for them.
+"""
+from importlib import import_module
+
+from .kernel import expected_score, expected_table
+from .scoring import update_elo_2v2, update_elo_american
+
+_LAZY = {
+    "update_elo_2v2_batch": ".batch",
+    "update_elo_american_batch": ".batch",
+    "court_tables": ".batch",
+    "expected_score_batch": ".batch",
+    "PlayerStore": ".replay",
+    "Replay": ".replay",
+    "Snapshot": ".replay",
+    "save_snapshot": ".replay",
+    "load_snapshot": ".replay",
+    "MatchLog": ".replay",
+    "encode_log": ".replay",
+    "grid_search": ".sweep",
+    "random_search": ".sweep",
+    "simulate_league": ".simulate",
+    "monte_carlo": ".simulate",
+    "LeaderboardIndex": ".leaderboard",
+    "read_events": ".ingest",
+    "PozoState": ".pozo",
+    "score_pozo": ".pozo",
+    "ScoringService": ".service",
+    "HistoryWriter": ".history",
+    "RatingHistory": ".history",
+    "IncrementalReplay": ".recompute",
+    "plan_shards": ".shard",
+    "sharded_replay": ".shard",
+    "seed_pozos": ".seeding",
+    "seed_matches": ".seeding",
+    "assign_courts": ".seeding",
+    "AmericanaSession": ".live",
+}
+
+__all__ = ["update_elo_2v2", "update_elo_american", "expected_score", "expected_table", *_LAZY]
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return __all__
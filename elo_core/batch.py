@@ -0,0 +1,296 @@
+"""Vectorized versions of the Elo scoring functions in ``elo_core.scoring``.
+
+Every function here mirrors a scalar function operation by operation so the
+results are identical, not just close. Expected scores at integer rating
+differences come from the shared ``expected_table``. Elsewhere NumPy's SIMD
+``power`` may differ from ``math.pow`` in the last bit, so values that land
+next to a rounding tie are recomputed with ``expected_score`` before rounding.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from . import instrument
+from .kernel import DIFF_RANGE, expected_score, expected_table
+
+# A few ulps of error in P moves k * (result - P) by far less than this.
+_TIE_EPS = 1e-7
+
+# Above this many distinct ratios in one call, the tables are not worth gathering from.
+_MAX_TABLES = 16
+
+# Bound of every rounded term, so that the sum of the two americana terms fits in an int64.
+_MAX_ADJUSTMENT = 2.0 ** 62
+
+
+def _expected_score(diff, ratio):
+    """
+    Return the expected score of every element and a mask of the ones taken from the tables.
+
+    ``ratio`` is a scalar or has the shape of ``diff``.
+    """
+    P = np.empty(diff.shape)
+    in_table = (diff == np.floor(diff)) & (np.abs(diff) <= DIFF_RANGE)
+    scalar = np.ndim(ratio) == 0
+    if not in_table.any():
+        ratios = []
+    else:
+        ratios = [float(ratio)] if scalar else np.unique(ratio).tolist()
+    if len(ratios) > _MAX_TABLES:
+        in_table[...] = False
+    else:
+        for r in ratios:
+            sel = in_table if len(ratios) == 1 else in_table & (ratio == r)
+            table = np.frombuffer(expected_table(r))
+            P[sel] = table[diff[sel].astype(np.intp) + DIFF_RANGE]
+
+    rest = ~in_table
+    if rest.any():
+        P[rest] = 1 / (1 + np.power(10.0, diff[rest] / (ratio if scalar else ratio[rest])))
+    return P, in_table
+
+
+def expected_score_batch(diff, ratio):
+    """Vectorized ``expected_score``. Values off the tables may differ from it in the last bit."""
+    diff = np.asarray(diff, dtype=np.float64)
+    ratio = np.broadcast_to(np.asarray(ratio, dtype=np.float64), diff.shape)
+    return _expected_score(diff, ratio)[0]
+
+
+def _check_finite(*values):
+    """
+    Raise what ``int(round(x))`` raises on the first NaN or infinite element.
+
+    ``values`` are interleaved element by element, so the first one found is the one the
+    scalar functions would have rounded first. Finite values too large for the int64 result
+    raise ``OverflowError`` too, where the scalar functions would return a Python int.
+    """
+    if all((np.abs(v) < _MAX_ADJUSTMENT).all() for v in values):
+        return
+    stacked = np.stack(np.broadcast_arrays(*values), axis=-1)
+    bad = ~(np.abs(stacked) < _MAX_ADJUSTMENT)
+    first = stacked.flat[np.flatnonzero(bad)[0]]
+    if np.isnan(first):
+        raise ValueError("cannot convert float NaN to integer")
+    if np.isinf(first):
+        raise OverflowError("cannot convert float infinity to integer")
+    raise OverflowError(f"adjustment {first:g} does not fit in an int64")
+
+
+def _round_expected(factor, base, k, game_result, opponent, rating, ratio, check=True):
+    """Return ``int(round(factor * base + k * (game_result - P)))`` for arrays.
+
+    The arguments must broadcast to the shape of ``opponent - rating``. Only the few
+    values next to a rounding tie are expanded to that shape, to recompute them. Non-finite
+    values raise like the scalar functions; with ``check=False`` they are left to the caller
+    and the rounded values are returned as floats.
+    """
+    diff = opponent - rating
+    if np.ndim(ratio) != 0:
+        ratio = np.broadcast_to(ratio, diff.shape)
+    with instrument.stage("batch.expected_score"):
+        P, exact = _expected_score(diff, ratio)
+    value = factor * base + k * (game_result - P)
+    out = np.rint(value)
+
+    near_tie = ~exact & (np.abs(np.abs(value - np.floor(value)) - 0.5) < _TIE_EPS)
+    if near_tie.any():
+        factor, base, k, game_result, ratio = np.broadcast_arrays(factor, base, k, game_result, ratio, diff)[:5]
+        for idx in zip(*np.nonzero(near_tie)):
+            P = expected_score(diff[idx], ratio[idx])
+            out[idx] = round(factor[idx] * base[idx] + k[idx] * (game_result[idx] - P))
+
+    if not check:
+        return out
+    _check_finite(out)
+    return out.astype(np.int64)
+
+
+def _weighted_pair(ratings, factoravg):
+    """Weight each player of a pair with their partner, as ``update_elo_2v2`` does."""
+    first = ratings[..., 0] * factoravg + ratings[..., 1] * (1 - factoravg)
+    second = ratings[..., 1] * factoravg + ratings[..., 0] * (1 - factoravg)
+    return np.stack((first, second), axis=-1)
+
+
+# NaN and infinities are reported by _check_finite, as the scalar functions raise them.
+@np.errstate(invalid="ignore", over="ignore")
+def update_elo_2v2_batch(team1_ratings, team2_ratings, results, k=32, ratio=400, base=50, factoravg=0.5):
+    """
+    Calculate the Elo adjustments of many 2v2 matches in one vectorized pass.
+
+    Args:
+        team1_ratings (array_like): Shape (n, 2) with the ratings of the first team's players.
+        team2_ratings (array_like): Shape (n, 2) with the ratings of the second team's players.
+        results (array_like): Shape (n, 2) with the scores of team 1 and team 2.
+        k (int or array_like, optional): Scalar or shape (n,). Defaults to 32.
+        ratio (int or array_like, optional): Scalar or shape (n,). Defaults to 400.
+        base (int or array_like, optional): Scalar or shape (n,). Defaults to 50.
+        factoravg (float or array_like, optional): Scalar or shape (n,). Defaults to 0.5.
+
+    Returns:
+        tuple: Two int64 arrays of shape (n, 2) with the adjustments of team 1 and team 2,
+        equal to calling ``update_elo_2v2`` on every match.
+    """
+    team1 = np.asarray(team1_ratings, dtype=np.float64).reshape(-1, 2)
+    team2 = np.asarray(team2_ratings, dtype=np.float64).reshape(-1, 2)
+    results = np.asarray(results).reshape(-1, 2)
+    n = len(results)
+    if len(team1) != n or len(team2) != n:
+        raise ValueError("team1_ratings, team2_ratings and results must have the same length")
+
+    score1 = results[:, 0]
+    total = results.sum(axis=1)
+    if (total == 0).any():
+        raise ZeroDivisionError("float division by zero")
+
+    def per_match(value):
+        value = np.asarray(value, dtype=np.float64)
+        return value if value.ndim == 0 else np.broadcast_to(value, (n,))
+
+    k, ratio, base, factoravg = per_match(k), per_match(ratio), per_match(base), per_match(factoravg)
+
+    team1_avg = (team1[:, 0] + team1[:, 1]) / 2
+    team2_avg = (team2[:, 0] + team2[:, 1]) / 2
+
+    game_result = (score1 / total) * 0.9 + 0.05
+
+    rating_diff = np.abs(team1_avg - team2_avg)
+    team1_factor = np.where(score1 > results[:, 1], 1.0, -1.0)
+
+    base = base - np.where(rating_diff > 1000, 15, np.where(rating_diff > 700, 10, np.where(rating_diff > 400, 5, 0)))
+
+    def column(value):
+        return value[:, np.newaxis] if value.ndim else value
+
+    def new_ratings(team, opponent_avg, result, factor):
+        return _round_expected(
+            factor[:, np.newaxis],
+            base[:, np.newaxis],
+            column(k),
+            result[:, np.newaxis],
+            opponent_avg[:, np.newaxis],
+            _weighted_pair(team, factoravg),
+            column(ratio),
+        )
+
+    team1_new_ratings = new_ratings(team1, team2_avg, game_result, team1_factor)
+    team2_new_ratings = new_ratings(team2, team1_avg, 1 - game_result, -team1_factor)
+
+    return team1_new_ratings, team2_new_ratings
+
+
+@lru_cache(maxsize=16)
+def court_tables(max_courts):
+    """
+    Build the final-court adjustments of ``update_elo_american`` as lookup tables.
+
+    Tables are indexed by ``numpistas`` first, so pozos with different court counts can be
+    scored together. The last court is ``numpistas`` and the second to last ``numpistas - 1``.
+
+    Returns:
+        tuple: ``penalty[numpistas, pista_final]`` and ``bonus[numpistas, pista_final]`` with
+        the weight of ``compensacio2`` and ``bonificacion``: 1 for the full adjustment, 0.5
+        for half of it and 0 for none.
+    """
+    numpistas = np.arange(max_courts + 1)[:, np.newaxis]
+    final = np.arange(max_courts + 1)[np.newaxis, :]
+    on_court = (final >= 1) & (final <= numpistas)
+    last = on_court & (final == numpistas)
+    second_last = on_court & ~last & (final == numpistas - 1)
+    penalty = np.where(last, 1.0, np.where(second_last, 0.5, 0.0))
+    first = on_court & ~last & ~second_last & (final == 1)
+    second = on_court & ~last & ~second_last & (final == 2)
+    bonus = np.where(first, 1.0, np.where(second, 0.5, 0.0))
+
+    for table in (penalty, bonus):
+        table.flags.writeable = False
+    return penalty, bonus
+
+
+@np.errstate(invalid="ignore", over="ignore")
+def update_elo_american_batch(ratings, results, multipistes, compensacio, compensacio2, bonificacion,
+                              k=20, ratio=800, numpistas=6, base=10, factoravg=0.5, npairs=None):
+    """
+    Calculate the Elo adjustments of many americana sube-baja pozos in one vectorized pass.
+
+    Args:
+        ratings (array_like): Shape (events, pairs, 2) with the integer ratings of every pair.
+        results (array_like): Shape (events, pairs, 2) with the initial and final court of every pair.
+        multipistes, compensacio, compensacio2, bonificacion, k, ratio, numpistas, base, factoravg:
+            Same meaning as in ``update_elo_american``. Each one is a scalar or has shape (events,).
+        npairs (array_like, optional): Shape (events,) with the number of pairs of every pozo when
+            they have different sizes. Pairs past ``npairs`` are padding and get a zero adjustment.
+
+    Returns:
+        numpy.ndarray: Int64 array of shape (events, pairs, 2) with the adjustment of every player,
+        equal to calling ``update_elo_american`` on every pozo.
+    """
+    ratings = np.asarray(ratings)
+    if ratings.ndim == 2:
+        ratings = ratings[np.newaxis]
+    results = np.asarray(results, dtype=np.int64).reshape(ratings.shape)
+    events, pairs, _ = ratings.shape
+
+    def per_event(value, dtype=np.float64):
+        return np.broadcast_to(np.asarray(value, dtype=dtype), (events,))[:, np.newaxis, np.newaxis]
+
+    numpistas_e = per_event(numpistas, np.int64)
+    valid = np.ones((events, pairs), dtype=bool)
+    if npairs is not None:
+        valid = np.arange(pairs) < np.asarray(npairs)[:, np.newaxis]
+    valid3 = valid[..., np.newaxis]
+
+    initial = np.where(valid3, results[..., :1], 1)
+    final = np.where(valid3, results[..., 1:], 1)
+    if (initial < 1).any() or (final < 1).any() or (initial > numpistas_e).any() or (final > numpistas_e).any():
+        raise ValueError("Courts must be between 1 and numpistas")
+
+    pair_sum = np.where(valid, ratings[..., 0] + ratings[..., 1], 0)
+    avg = np.cumsum(pair_sum, axis=1)[:, -1] / (valid.sum(axis=1) * 2)
+    avg = np.broadcast_to(avg[:, np.newaxis, np.newaxis], (events, pairs, 2))
+
+    gained = initial - final
+    gainedfactor = np.where(gained != 0, np.abs(gained) - 1, 0)
+    factor = 1 + gainedfactor * (per_event(multipistes) / 100)
+    factor = np.where(gained < 0, -factor, factor)
+
+    americana_result = (gained / numpistas_e) / 2 + 0.5
+
+    weightedavg = _weighted_pair(ratings.astype(np.float64), per_event(factoravg)[..., 0])
+    shape = (events, pairs, 2)
+    new_elo = _round_expected(
+        np.broadcast_to(factor, shape),
+        np.broadcast_to(per_event(base), shape),
+        np.broadcast_to(per_event(k), shape),
+        np.broadcast_to(americana_result, shape),
+        avg,
+        weightedavg,
+        np.broadcast_to(per_event(ratio), shape),
+        check=False,
+    )
+
+    with instrument.stage("batch.court_adjustments"):
+        penalty, bonus = court_tables(int(numpistas_e.max()))
+        compensation = np.where((initial <= 2) & (final == 1), 1,
+                                np.where((initial >= numpistas_e - 1) & (final == numpistas_e), -1, 0))
+        compensacio = per_event(compensacio)
+        ajuste = np.where(compensation == 1, compensacio, np.where(compensation == -1, -compensacio, 0))
+
+        diff = weightedavg - avg
+        tier = 1 + (np.abs(diff) // 200) / 10
+        penalty_w = penalty[numpistas_e, final]
+        bonus_w = bonus[numpistas_e, final]
+        penalty_w = np.where(penalty_w == 1, np.where(diff > 0, tier, 1), penalty_w)
+        bonus_w = np.where(bonus_w == 1, np.where(diff < 0, tier, 1), bonus_w)
+
+        compensacio2 = per_event(compensacio2)
+        # Only the weighted terms are evaluated, so an infinite parameter that the scalar
+        # function never reaches does not turn into NaN here.
+        penalty_term = np.where(penalty_w != 0, compensacio2 * penalty_w, 0)
+        bonus_term = np.where(bonus_w != 0, per_event(bonificacion) * bonus_w, 0)
+        ajuste = np.where(compensacio2 != 0, ajuste - penalty_term + bonus_term, ajuste)
+
+    _check_finite(np.where(valid3, new_elo, 0), np.where(valid3, ajuste, 0))
+    new_elo = new_elo.astype(np.int64) + np.rint(ajuste).astype(np.int64)
+    return np.where(valid3, new_elo, 0)
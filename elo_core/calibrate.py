@@ -0,0 +1,259 @@
+"""Calibration of the americana parameters against target scenarios and historical logs.
+
+A scenario is one pair of a pozo with the adjustment it should get, such as the
+targets noted in ``observacions.txt``: a pair much weaker than the pozo that drops
+from court 1 to court 6 should lose 10 to 15 points. ``calibrate`` fits k, ratio,
+base, multipistes, compensacio, compensacio2 (the 5/6 penalty) and bonificacion
+within the slider ranges with a bounded Nelder-Mead search.
+
+Every step of the search proposes several candidates at once (reflection,
+expansion and both contractions, or a whole shrunk simplex). All scenarios of
+all candidates are scored in a single ``update_elo_american_batch`` call, and
+when a historical log is given the candidates are replayed in parallel on a
+process pool, as in ``sweep``.
+"""
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+from .batch import update_elo_american_batch
+from .sweep import DEFAULTS_2V2, DEFAULTS_AMERICAN, _evaluate_shared, _init_worker, _share, evaluate
+
+PARAMS = ("k", "ratio", "base", "multipistes", "compensacio", "compensacio2", "bonificacion")
+
+# Slider ranges of the "Americana Sube-Baja Entera" page.
+BOUNDS = {
+    "k": (10, 300),
+    "ratio": (100, 3000),
+    "base": (0, 100),
+    "multipistes": (0, 100),
+    "compensacio": (0, 100),
+    "compensacio2": (0, 100),
+    "bonificacion": (0, 100),
+}
+
+
+class Scenario(NamedTuple):
+    """
+    A pozo and the adjustment wanted for one of its pairs.
+
+    ``ratings`` and ``courts`` have shape (pairs, 2). The mean adjustment of the two players
+    of pair ``pair`` should fall between ``low`` and ``high``.
+    """
+    name: str
+    ratings: np.ndarray
+    courts: np.ndarray
+    pair: int
+    low: float
+    high: float
+    weight: float = 1.0
+
+
+class Calibration(NamedTuple):
+    """Best parameters found, their loss, the number of candidates evaluated and the scenario deltas."""
+    params: dict
+    loss: float
+    evaluations: int
+    deltas: dict
+
+
+def make_scenario(name, rating, initial, final, low, high, average=1500, numpistas=6, weight=1.0):
+    """
+    Build a scenario of a full pozo of ``2 * numpistas`` pairs rated ``average``, where the pair
+    rated ``rating`` moves from court ``initial`` to court ``final``.
+    """
+    pairs = 2 * numpistas
+    ratings = np.full((pairs, 2), average, dtype=np.int64)
+    ratings[0] = rating
+    others = [c for c in range(1, numpistas + 1) for _ in range(2)]
+    others.remove(initial)
+    courts = np.array([(initial, final)] + [(c, c) for c in others], dtype=np.int64)
+    return Scenario(name, ratings, courts, 0, low, high, weight)
+
+
+def observacions_scenarios(gap=400, average=1500, numpistas=6):
+    """The targets of ``observacions.txt``, "much below/above the level" taken as ``gap`` points."""
+    return [
+        make_scenario("1 a 6, molt per sota del nivell", average - gap, 1, numpistas, -15, -10, average, numpistas),
+        make_scenario("1 a 6, molt per sobre del nivell", average + gap, 1, numpistas, -80, -70, average, numpistas),
+        make_scenario("6 a 1, molt per sota del nivell", average - gap, numpistas, 1, 90, 100, average, numpistas),
+    ]
+
+
+def scenario_deltas(scenarios, candidates, fixed=None):
+    """
+    Score every scenario under every candidate in one vectorized pass.
+
+    Args:
+        scenarios (list): ``Scenario`` objects.
+        candidates (list): Dicts with the values of ``PARAMS``.
+        fixed (dict, optional): The other arguments of ``update_elo_american`` (numpistas,
+            factoravg). Defaults to ``DEFAULTS_AMERICAN``.
+
+    Returns:
+        numpy.ndarray: Shape (candidates, scenarios) with the mean adjustment of each scenario's pair.
+    """
+    fixed = {name: value for name, value in {**DEFAULTS_AMERICAN, **(fixed or {})}.items() if name not in PARAMS}
+    c, s = len(candidates), len(scenarios)
+    npairs = np.array([len(sc.ratings) for sc in scenarios])
+    width = npairs.max()
+    ratings = np.zeros((s, width, 2), dtype=np.int64)
+    courts = np.ones((s, width, 2), dtype=np.int64)
+    for i, sc in enumerate(scenarios):
+        ratings[i, :npairs[i]] = sc.ratings
+        courts[i, :npairs[i]] = sc.courts
+
+    params = {name: np.repeat([cand[name] for cand in candidates], s) for name in PARAMS}
+    deltas = update_elo_american_batch(
+        np.tile(ratings, (c, 1, 1)), np.tile(courts, (c, 1, 1)), npairs=np.tile(npairs, c), **params, **fixed)
+    subject = np.tile([sc.pair for sc in scenarios], c)
+    return deltas[np.arange(c * s), subject].mean(axis=1).reshape(c, s)
+
+
+def scenario_loss(scenarios, deltas):
+    """
+    Weighted squared distance of every candidate's deltas to the target ranges, shape (candidates,).
+
+    A small pull towards the middle of each range breaks the plateaus left by the rounding
+    of the adjustments.
+    """
+    low = np.array([sc.low for sc in scenarios])
+    high = np.array([sc.high for sc in scenarios])
+    weight = np.array([sc.weight for sc in scenarios])
+    outside = np.maximum(low - deltas, 0) + np.maximum(deltas - high, 0)
+    middle = deltas - (low + high) / 2
+    return ((outside ** 2 + 0.01 * middle ** 2) * weight).sum(axis=1)
+
+
+def nelder_mead(objective, x0, step=0.1, max_iter=300, xtol=1e-4, ftol=1e-8):
+    """
+    Minimize ``objective`` over the unit cube with Nelder-Mead, clipping candidates to the bounds.
+
+    ``objective`` takes an (m, n) array of candidates and returns their m losses, so every
+    step evaluates its candidates together.
+
+    Returns:
+        tuple: Best point, its loss and the number of candidates evaluated.
+    """
+    x0 = np.clip(np.asarray(x0, dtype=np.float64), 0, 1)
+    n = len(x0)
+    simplex = np.vstack([x0] + [np.clip(x0 + step * np.eye(n)[i] * (1 if x0[i] + step <= 1 else -1), 0, 1)
+                                for i in range(n)])
+    values = objective(simplex)
+    evaluations = n + 1
+
+    for _ in range(max_iter):
+        order = np.argsort(values, kind="stable")
+        simplex, values = simplex[order], values[order]
+        if np.abs(simplex[1:] - simplex[0]).max() < xtol and values[-1] - values[0] < ftol:
+            break
+        centroid = simplex[:-1].mean(axis=0)
+        worst = simplex[-1]
+        reflected = centroid + (centroid - worst)
+        trial = np.clip(np.vstack([
+            reflected,
+            centroid + 2 * (centroid - worst),
+            centroid + 0.5 * (reflected - centroid),
+            centroid - 0.5 * (centroid - worst),
+        ]), 0, 1)
+        fr, fe, foc, fic = objective(trial)
+        evaluations += 4
+
+        if values[0] <= fr < values[-2]:
+            simplex[-1], values[-1] = trial[0], fr
+        elif fr < values[0]:
+            simplex[-1], values[-1] = (trial[1], fe) if fe < fr else (trial[0], fr)
+        elif fr < values[-1] and foc <= fr:
+            simplex[-1], values[-1] = trial[2], foc
+        elif fr >= values[-1] and fic < values[-1]:
+            simplex[-1], values[-1] = trial[3], fic
+        else:
+            simplex[1:] = simplex[0] + 0.5 * (simplex[1:] - simplex[0])
+            values[1:] = objective(simplex[1:])
+            evaluations += n
+
+    best = np.argmin(values)
+    return simplex[best], float(values[best]), evaluations
+
+
+def calibrate(scenarios=None, log=None, num_players=None, history_weight=1.0, start=None, bounds=None,
+              fixed=None, max_iter=300, restarts=2, workers=None, integer=True):
+    """
+    Fit the americana parameters to target scenarios and, optionally, a historical log.
+
+    Args:
+        scenarios (list, optional): ``Scenario`` objects. Defaults to ``observacions_scenarios()``.
+        log (MatchLog, optional): Historical log. Its americana log loss, times ``history_weight``,
+            is added to the scenario loss of every candidate.
+        num_players (int, optional): Number of players of the store the log was encoded with.
+        history_weight (float, optional): Weight of the log loss. Defaults to 1.
+        start (dict, optional): Starting values. Defaults to ``DEFAULTS_AMERICAN``.
+        bounds (dict, optional): ``{name: (low, high)}`` overriding ``BOUNDS``.
+        fixed (dict, optional): The other americana arguments, e.g. factoravg and numpistas.
+        max_iter (int, optional): Nelder-Mead iterations per restart. Defaults to 300.
+        restarts (int, optional): Fresh simplexes built around the best point so far. Defaults to 2.
+        workers (int, optional): Processes replaying the log. Defaults to the number of cores.
+        integer (bool, optional): Round the result to integers, as the sliders do. Defaults to True.
+
+    Returns:
+        Calibration: The best parameters found.
+    """
+    scenarios = observacions_scenarios() if scenarios is None else scenarios
+    bounds = {**BOUNDS, **(bounds or {})}
+    fixed = {name: value for name, value in {**DEFAULTS_AMERICAN, **(fixed or {})}.items() if name not in PARAMS}
+    start = {**DEFAULTS_AMERICAN, **(start or {})}
+    low = np.array([bounds[name][0] for name in PARAMS], dtype=np.float64)
+    span = np.array([bounds[name][1] - bounds[name][0] for name in PARAMS], dtype=np.float64)
+
+    def decode(x):
+        return [dict(zip(PARAMS, (low + xi * span).tolist())) for xi in np.atleast_2d(x)]
+
+    pool = blocks = None
+    if log is not None:
+        workers = workers or os.cpu_count() or 1
+        blocks, spec = _share(log)
+        if workers > 1:
+            pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(spec, num_players, 1000))
+
+    def history(candidates):
+        configs = [(DEFAULTS_2V2, {**fixed, **cand}) for cand in candidates]
+        if pool is not None:
+            metrics = pool.map(_evaluate_shared, configs)
+        else:
+            metrics = (evaluate(log, num_players, p2, pa) for p2, pa in configs)
+        return np.array([m["logloss_americana"] for m in metrics])
+
+    def objective(x):
+        candidates = decode(x)
+        loss = scenario_loss(scenarios, scenario_deltas(scenarios, candidates, fixed))
+        if log is not None:
+            loss = loss + history_weight * history(candidates)
+        return loss
+
+    try:
+        x = np.array([(start[name] - lo) / s for name, lo, s in zip(PARAMS, low, span)])
+        best, loss, evaluations = None, math.inf, 0
+        for attempt in range(restarts + 1):
+            x, value, count = nelder_mead(objective, x, step=0.25 / (attempt + 1), max_iter=max_iter)
+            evaluations += count
+            if value < loss:
+                best, loss = x, value
+            x = best
+
+        params = decode(best)[0]
+        if integer:
+            params = {name: int(round(value)) for name, value in params.items()}
+            loss = float(objective(np.array([[(params[name] - lo) / s for name, lo, s in zip(PARAMS, low, span)]]))[0])
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if blocks is not None:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    deltas = scenario_deltas(scenarios, [params], fixed)[0]
+    return Calibration(params, loss, evaluations, {sc.name: float(d) for sc, d in zip(scenarios, deltas)})
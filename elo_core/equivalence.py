@@ -0,0 +1,637 @@
+"""Differential testing of the accelerated engines against the scalar scoring functions.
+
+Usage: python -m elo_core.equivalence [--cases 20000] [--seed 0] [--family 2v2] [--engine batch] [--workers 1]
+
+Every engine that claims to give the same adjustments as ``update_elo_2v2`` or
+``update_elo_american`` is run on the same generated inputs as the scalar
+function, and every output is compared exactly. Inputs come in groups:
+
+- ``random``: ratings, results and parameters drawn over the slider ranges.
+- ``edges``: values picked from pools of extremes: rating gaps around the 400,
+  700 and 1000 steps of ``update_elo_2v2``, past the ``expected_table`` range and
+  up to 10000 points, ties, ``factoravg`` of 0 and 1, ``k`` of 0, negative ratings,
+  pair ratings on the 200-point tiers of the americana penalty and bonus, and one
+  americana in eight with a NaN or infinite parameter.
+- ``zero``: 0-0 results, where every engine must raise ``ZeroDivisionError``, and
+  NaN or infinite parameters, where it must raise what ``int(round(...))`` raises.
+- ``transitions``: pozos of 1 to 12 courts with one pair for every
+  ``(pista_inicial, pista_final)`` combination.
+- ``live``: the ``random`` and ``edges`` pozos played for a few rounds through
+  ``AmericanaSession.report`` with random winners and occasional ``set_rating``
+  calls, compared after every update with ``update_elo_american`` on the whole pozo.
+- ``log``: a season mixing both kinds of events, replayed sequentially with the
+  scalar functions and with ``Replay``, ``sharded_replay`` and ``IncrementalReplay``.
+
+Engines are run on a whole group at once and timed. When an engine raises on a
+group, its cases are run one by one so the exception is compared per case, as
+the scalar functions raise it. The report gives the first divergence of every
+engine next to the throughput of the engine and of the scalar reference.
+"""
+import argparse
+import sys
+from time import perf_counter
+from typing import NamedTuple
+
+import numpy as np
+
+from .batch import update_elo_2v2_batch, update_elo_american_batch
+from .kernel import DIFF_RANGE, expected_score, expected_table
+from .live import AmericanaSession
+from .pozo import score_pozo
+from .recompute import IncrementalReplay
+from .replay import MATCH_2V2, MatchLog, PlayerStore, Replay, encode_log
+from .scoring import update_elo_2v2, update_elo_american
+from .service import score_2v2, score_americana
+from .shard import plan_shards, sharded_replay
+from .sweep import DEFAULTS_2V2, DEFAULTS_AMERICAN
+
+
+class Cases2v2(NamedTuple):
+    """2v2 matches, one per row. Ratings and results have shape (n, 2), parameters shape (n,)."""
+    team1: np.ndarray
+    team2: np.ndarray
+    results: np.ndarray
+    k: np.ndarray
+    ratio: np.ndarray
+    base: np.ndarray
+    factoravg: np.ndarray
+
+
+class CasesAmerican(NamedTuple):
+    """
+    Americana pozos, one per row.
+
+    Ratings and courts have shape (n, pairs, 2), padded past ``npairs``. Parameters have shape (n,).
+    """
+    ratings: np.ndarray
+    courts: np.ndarray
+    npairs: np.ndarray
+    multipistes: np.ndarray
+    compensacio: np.ndarray
+    compensacio2: np.ndarray
+    bonificacion: np.ndarray
+    k: np.ndarray
+    ratio: np.ndarray
+    numpistas: np.ndarray
+    base: np.ndarray
+    factoravg: np.ndarray
+
+
+class Season(NamedTuple):
+    """A generated season: its events, encoded log and the parameters of both kinds of events."""
+    events: list
+    log: MatchLog
+    num_players: int
+    params_2v2: dict
+    params_american: dict
+
+
+class Divergence(NamedTuple):
+    """The first case where an engine disagrees with the reference."""
+    case: int
+    inputs: dict
+    expected: object
+    got: object
+
+
+class Report(NamedTuple):
+    """Outcome of one engine on one group of cases. Rates are cases per second."""
+    family: str
+    group: str
+    engine: str
+    cases: int
+    mismatches: int
+    first: Divergence
+    reference_rate: float
+    engine_rate: float
+
+
+def _take(cases, index):
+    return type(cases)(*(np.asarray(field)[index] for field in cases))
+
+
+def _inputs(cases, i):
+    if isinstance(cases, Season):
+        return {"player": i}
+    inputs = {name: np.asarray(field)[i].tolist() for name, field in zip(cases._fields, cases)}
+    if isinstance(cases, CasesAmerican):
+        n = inputs.pop("npairs")
+        inputs["ratings"], inputs["courts"] = inputs["ratings"][:n], inputs["courts"][:n]
+    return inputs
+
+
+def _number(value):
+    """Python int when integral, as the sliders give them, float otherwise."""
+    value = value.item() if isinstance(value, np.generic) else value
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def _pick(rng, pool, n):
+    return np.asarray(pool)[rng.integers(0, len(pool), n)]
+
+
+# Generators ###########################################################################################################
+
+def _params_2v2(rng, n, block=64):
+    """Slider-range parameters, shared by blocks of ``block`` consecutive cases as in a real replay."""
+    blocks = -(-n // block)
+    values = (rng.integers(0, 101, blocks), rng.integers(2, 41, blocks) * 50, rng.integers(0, 101, blocks),
+              rng.integers(0, 101, blocks) / 100)
+    return [np.repeat(v, block)[:n] for v in values]
+
+
+def _results_2v2(rng, n):
+    results = rng.integers(0, 8, (n, 2))
+    results[results.sum(axis=1) == 0] = (7, 0)
+    return results
+
+
+def random_2v2(rng, n):
+    return Cases2v2(rng.integers(0, 3000, (n, 2)), rng.integers(0, 3000, (n, 2)), _results_2v2(rng, n),
+                    *_params_2v2(rng, n))
+
+
+def edges_2v2(rng, n):
+    gaps = [0, 1, 399, 400, 401, 699, 700, 701, 999, 1000, 1001, DIFF_RANGE, DIFF_RANGE + 1, 6000, 9999]
+    low = _pick(rng, [-500, 0, 1, 1000, 1499], n)
+    gap = _pick(rng, gaps, n) * _pick(rng, [1, -1], n)
+    spread = _pick(rng, [0, 1, 50, 799, 2000], n)
+    team1 = np.stack((low, low + spread), axis=1)
+    team2 = np.stack((low + gap + spread, low + gap), axis=1)
+
+    scores = [(a, b) for a in range(8) for b in range(8) if a or b] + [(30, 0), (0, 30), (50, 49)]
+    results = np.array(scores)[np.arange(n) % len(scores)]
+    k = _pick(rng, [0, 1, 20, 100], n)
+    ratio = _pick(rng, [50, 100, 400, 2000, 3000], n)
+    base = _pick(rng, [0, 15, 50, 100], n)
+    factoravg = _pick(rng, [0.0, 0.01, 0.5, 0.7, 1.0], n)
+    return Cases2v2(team1, team2, results, k, ratio, base, factoravg)
+
+
+def _non_finite(rng, params, names, rows):
+    """Set one of ``names`` to NaN or an infinity in each of ``rows``."""
+    params = {name: np.asarray(value, dtype=np.float64).copy() for name, value in params.items()}
+    for row, name in zip(rows, _pick(rng, names, len(rows)).tolist()):
+        params[name][row] = _pick(rng, [np.nan, np.inf, -np.inf], 1)[0]
+    return params
+
+
+def zero_2v2(rng, n):
+    n = min(n, 32)
+    zero = random_2v2(rng, n)._replace(results=np.zeros((n, 2), dtype=np.int64))
+    cases = random_2v2(rng, n)
+    params = _non_finite(rng, cases._asdict(), ["k", "ratio", "base", "factoravg"], range(n))
+    non_finite = cases._replace(**{name: params[name] for name in ("k", "ratio", "base", "factoravg")})
+    return Cases2v2(*(np.concatenate(fields) for fields in zip(zero, non_finite)))
+
+
+def _params_american(rng, n, numpistas):
+    return dict(multipistes=rng.integers(0, 101, n), compensacio=rng.integers(0, 101, n),
+                compensacio2=rng.integers(0, 101, n) * (rng.random(n) < 0.8), bonificacion=rng.integers(0, 101, n),
+                k=rng.integers(10, 301, n), ratio=rng.integers(5, 151, n) * 20, numpistas=numpistas,
+                base=rng.integers(0, 101, n), factoravg=rng.integers(0, 101, n) / 100)
+
+
+def _pozos(ratings, courts, npairs, params):
+    return CasesAmerican(ratings, courts, npairs, **params)
+
+
+def random_american(rng, n):
+    n = max(n // 20, 1)
+    numpistas = rng.integers(2, 9, n)
+    npairs = np.maximum(2 * numpistas - rng.integers(0, 3, n), 2)
+    width = npairs.max()
+    ratings = rng.integers(500, 2500, (n, width, 2))
+    courts = rng.integers(1, numpistas[:, np.newaxis, np.newaxis] + 1, (n, width, 2))
+    return _pozos(ratings, courts, npairs, _params_american(rng, n, numpistas))
+
+
+def edges_american(rng, n):
+    n = max(n // 20, 1)
+    numpistas = _pick(rng, [1, 2, 6, 12], n)
+    npairs = np.maximum(2 * numpistas, 2)
+    width = npairs.max()
+    # Multiples of 100 with factoravg 0, 0.5 or 1 put pair ratings right on the 200-point tiers.
+    ratings = _pick(rng, [-500, 0, 100, 1000, 1200, 1400, 3000, 9000, 10000], (n, width, 2))
+    courts = rng.integers(1, numpistas[:, np.newaxis, np.newaxis] + 1, (n, width, 2))
+    params = _params_american(rng, n, numpistas)
+    params.update(multipistes=_pick(rng, [0, 100], n), compensacio2=_pick(rng, [0, 1, 100], n),
+                  bonificacion=_pick(rng, [0, 1, 100], n), k=_pick(rng, [10, 300], n), ratio=_pick(rng, [100, 3000], n),
+                  factoravg=_pick(rng, [0.0, 0.5, 1.0], n))
+    names = ["multipistes", "compensacio", "compensacio2", "bonificacion", "k", "ratio", "base", "factoravg"]
+    params.update(_non_finite(rng, {name: params[name] for name in names}, names, range(0, n, 8)))
+    return _pozos(ratings, courts, npairs, params)
+
+
+def transitions_american(rng, n):
+    pozos = []
+    for numpistas in range(1, 13):
+        initial, final = np.divmod(np.arange(numpistas * numpistas), numpistas)
+        pozos.append((numpistas, np.stack((initial + 1, final + 1), axis=1)))
+    repeats = max(n // 2000, 1)
+    width = max(len(courts) for _, courts in pozos)
+    count = len(pozos) * repeats
+    ratings = rng.integers(500, 2500, (count, width, 2))
+    courts = np.ones((count, width, 2), dtype=np.int64)
+    npairs = np.empty(count, dtype=np.int64)
+    numpistas = np.empty(count, dtype=np.int64)
+    for e in range(count):
+        numpistas[e], pozo = pozos[e % len(pozos)]
+        npairs[e] = len(pozo)
+        courts[e, :len(pozo)] = pozo
+    return _pozos(ratings, courts, npairs, _params_american(rng, count, numpistas))
+
+
+def season(rng, n, americana_share=0.02):
+    num_players = max(48, n // 20)
+    events = []
+    for _ in range(n):
+        if rng.random() < americana_share:
+            players = rng.choice(num_players, 24, replace=False).tolist()
+            courts = [(int(a), int(b)) for a, b in rng.integers(1, 7, (12, 2))]
+            events.append(("americana", list(zip(players[::2], players[1::2])), courts))
+        else:
+            p1, p2, p3, p4 = rng.choice(num_players, 4, replace=False).tolist()
+            score = int(rng.integers(0, 7))
+            events.append(("2v2", (p1, p2), (p3, p4), (score, 7) if rng.random() < 0.5 else (7, score)))
+    store = PlayerStore(capacity=num_players)
+    store.indices(range(num_players))
+    return Season(events, encode_log(events, store), num_players, dict(DEFAULTS_2V2), dict(DEFAULTS_AMERICAN))
+
+
+# References ###########################################################################################################
+
+def reference_2v2(cases):
+    out = []
+    for i in range(len(cases.results)):
+        team1, team2 = update_elo_2v2(cases.team1[i].tolist(), cases.team2[i].tolist(), cases.results[i].tolist(),
+                                      _number(cases.k[i]), _number(cases.ratio[i]), _number(cases.base[i]),
+                                      float(cases.factoravg[i]))
+        out.append(tuple(team1 + team2))
+    return out
+
+
+def _american_args(cases, e):
+    n = cases.npairs[e]
+    ratings = [tuple(pair) for pair in cases.ratings[e, :n].tolist()]
+    courts = [tuple(pair) for pair in cases.courts[e, :n].tolist()]
+    params = {name: _number(getattr(cases, name)[e]) for name in
+              ("multipistes", "compensacio", "compensacio2", "bonificacion", "k", "ratio", "numpistas", "base")}
+    params["factoravg"] = float(cases.factoravg[e])
+    return ratings, courts, params
+
+
+def reference_american(cases):
+    out = []
+    for e in range(len(cases.npairs)):
+        ratings, courts, params = _american_args(cases, e)
+        out.append(tuple(update_elo_american(ratings, courts, **params)))
+    return out
+
+
+LIVE_ROUNDS = 3
+
+
+def _live_rng(cases, e):
+    """Generator of the random results of pozo ``e``, seeded by its ratings so it survives ``_take``."""
+    return np.random.default_rng(np.abs(cases.ratings[e, :cases.npairs[e]]).ravel().tolist())
+
+
+def _live_rating(rng, npairs):
+    """A random rating change after a report, or None, as ``(pair, second, value)``."""
+    if rng.random() < 0.25:
+        return int(rng.integers(npairs)), int(rng.integers(2)), int(rng.integers(500, 2500))
+    return None
+
+
+def reference_live(cases):
+    """Every pozo scored again with ``update_elo_american`` after each court result and rating change."""
+    out = []
+    for e in range(len(cases.npairs)):
+        ratings, courts, params = _american_args(cases, e)
+        ratings = [list(pair) for pair in ratings]
+        initial = [c for c, _ in courts]
+        playing, final = list(initial), list(initial)
+        rng = _live_rng(cases, e)
+
+        def score():
+            return tuple(update_elo_american([tuple(pair) for pair in ratings], list(zip(initial, final)), **params))
+
+        steps = [score()]
+        for _ in range(LIVE_ROUNDS):
+            pairs_on = {}
+            for pair, court in enumerate(playing):
+                pairs_on.setdefault(court, []).append(pair)
+            open_courts = [court for court in sorted(pairs_on) if len(pairs_on[court]) > 1]
+            if not open_courts:
+                break
+            for court in rng.permutation(open_courts).tolist():
+                pairs = pairs_on[court]
+                winner = pairs[rng.integers(len(pairs))]
+                for pair in pairs:
+                    final[pair] = max(court - 1, 1) if pair == winner else min(court + 1, params["numpistas"])
+                steps.append(score())
+                change = _live_rating(rng, len(ratings))
+                if change is not None:
+                    pair, second, value = change
+                    ratings[pair][second] = value
+                    steps.append(score())
+            playing = list(final)
+        out.append(tuple(steps))
+    return out
+
+
+def reference_season(season):
+    ratings = [1000] * season.num_players
+    for event in season.events:
+        if event[0] == "2v2":
+            _, team1, team2, result = event
+            deltas = update_elo_2v2([ratings[p] for p in team1], [ratings[p] for p in team2], list(result),
+                                    **season.params_2v2)
+            for p, d in zip(team1 + team2, deltas[0] + deltas[1]):
+                ratings[p] += d
+        else:
+            _, pairs, courts = event
+            deltas = update_elo_american([(ratings[a], ratings[b]) for a, b in pairs], courts, **season.params_american)
+            for (a, b), (da, db) in zip(pairs, deltas):
+                ratings[a] += da
+                ratings[b] += db
+    return ratings
+
+
+# Engines ##############################################################################################################
+
+def batch_2v2(cases):
+    team1, team2 = update_elo_2v2_batch(cases.team1, cases.team2, cases.results, k=cases.k, ratio=cases.ratio,
+                                        base=cases.base, factoravg=cases.factoravg)
+    return [tuple(a + b) for a, b in zip(team1.tolist(), team2.tolist())]
+
+
+def replay_2v2(cases):
+    """``Replay.apply_2v2`` with four new players per match, one replay per parameter set."""
+    n = len(cases.results)
+    params = np.column_stack((cases.k, cases.ratio, cases.base, cases.factoravg))
+    sets, inverse = np.unique(params, axis=0, return_inverse=True)
+    out = [None] * n
+    for s, (k, ratio, base, factoravg) in enumerate(sets.tolist()):
+        rows = np.flatnonzero(inverse.ravel() == s)
+        store = PlayerStore(capacity=4 * len(rows))
+        store.indices(range(4 * len(rows)))
+        store.ratings[:] = np.hstack((cases.team1[rows], cases.team2[rows])).ravel()
+        replay = Replay(store, dict(k=_number(k), ratio=_number(ratio), base=_number(base), factoravg=factoravg))
+        before = store.ratings.copy()
+        replay.apply_2v2(np.arange(4 * len(rows)).reshape(-1, 4), cases.results[rows])
+        for row, delta in zip(rows.tolist(), (store.ratings - before).reshape(-1, 4).tolist()):
+            out[row] = tuple(delta)
+    return out
+
+
+def service_2v2(cases):
+    items = [(tuple(t1), tuple(t2), tuple(r), p) for t1, t2, r, p in
+             zip(cases.team1.tolist(), cases.team2.tolist(), cases.results.tolist(),
+                 zip(cases.k.tolist(), cases.ratio.tolist(), cases.base.tolist(), cases.factoravg.tolist()))]
+    return [tuple(r["team1"] + r["team2"]) for r in score_2v2(items)]
+
+
+def batch_american(cases):
+    params = {name: getattr(cases, name) for name in CasesAmerican._fields[3:]}
+    deltas = update_elo_american_batch(cases.ratings, cases.courts, npairs=cases.npairs, **params).tolist()
+    return [tuple(tuple(pair) for pair in d[:n]) for d, n in zip(deltas, cases.npairs.tolist())]
+
+
+def pozo_american(cases):
+    score_pozo.cache_clear()
+    out = []
+    for e in range(len(cases.npairs)):
+        ratings, courts, params = _american_args(cases, e)
+        flat_ratings = tuple(r for pair in ratings for r in pair)
+        flat_courts = tuple(c for pair in courts for c in pair)
+        out.append(score_pozo(flat_ratings, flat_courts, **params))
+    return out
+
+
+def service_american(cases):
+    items = []
+    for e in range(len(cases.npairs)):
+        ratings, courts, params = _american_args(cases, e)
+        items.append((ratings, courts, tuple(params[name] for name in CasesAmerican._fields[3:])))
+    return [tuple(tuple(pair) for pair in r["deltas"]) for r in score_americana(items)]
+
+
+def live_american(cases):
+    """``AmericanaSession`` driven through ``report`` and ``set_rating``, read after every update."""
+    out = []
+    for e in range(len(cases.npairs)):
+        ratings, courts, params = _american_args(cases, e)
+        session = AmericanaSession(ratings, [initial for initial, _ in courts], params)
+        rng = _live_rng(cases, e)
+        steps = [tuple(session.adjustments())]
+        for _ in range(LIVE_ROUNDS):
+            open_courts = [court for court in range(1, session.numpistas + 1) if len(session.pairs_on(court)) > 1]
+            if not open_courts:
+                break
+            for court in rng.permutation(open_courts).tolist():
+                pairs = session.pairs_on(court)
+                session.report(court, pairs[rng.integers(len(pairs))])
+                steps.append(tuple(session.adjustments()))
+                change = _live_rating(rng, len(session))
+                if change is not None:
+                    session.set_rating(*change)
+                    steps.append(tuple(session.adjustments()))
+        out.append(tuple(steps))
+    return out
+
+
+def _season_store(season):
+    store = PlayerStore(capacity=season.num_players)
+    store.indices(range(season.num_players))
+    return store
+
+
+def replay_season(season, workers=1):
+    store = _season_store(season)
+    Replay(store, season.params_2v2, season.params_american, chunk_size=1024).run_log(season.log)
+    return store.ratings.tolist()
+
+
+def sharded_season(season, workers=1):
+    """``sharded_replay`` on three shards, with components capped so there are cross-shard events."""
+    plan = plan_shards(season.log, season.num_players, 3, max_component=max(len(season.events) // 10, 1))
+    store = _season_store(season)
+    sharded_replay(season.log, store, season.params_2v2, season.params_american, workers=workers, plan=plan)
+    return store.ratings.tolist()
+
+
+def incremental_season(season, workers=1):
+    """``IncrementalReplay`` of the season with the middle 2v2 result swapped, then corrected back."""
+    log = MatchLog(*(np.array(field) for field in season.log))
+    matches = np.flatnonzero(log.kinds == MATCH_2V2)
+    store = _season_store(season)
+    if not len(matches):
+        Replay(store, season.params_2v2, season.params_american).run_log(log)
+        return store.ratings.tolist()
+    event = int(matches[len(matches) // 2])
+    row = len(matches) // 2
+    result = log.scores[row].copy()
+    log.scores[row] = result[::-1] if result[0] != result[1] else (7, 0)
+    incremental = IncrementalReplay(log, store, season.params_2v2, season.params_american)
+    incremental.correct(event, result)
+    return store.ratings.tolist()
+
+
+def expected_tables(ratios):
+    return [value for ratio in ratios.tolist() for value in expected_table(ratio)]
+
+
+def reference_expected(ratios):
+    return [expected_score(d, ratio) for ratio in ratios.tolist() for d in range(-DIFF_RANGE, DIFF_RANGE + 1)]
+
+
+def _ratios(rng, n):
+    expected_table.cache_clear()
+    return np.unique(np.concatenate(([10, 50, 400, 3000], rng.integers(10, 3001, max(n // 2000, 1)))))
+
+
+FAMILIES = {
+    "2v2": (
+        {"random": random_2v2, "edges": edges_2v2, "zero": zero_2v2},
+        reference_2v2,
+        {"batch.update_elo_2v2_batch": batch_2v2, "replay.Replay.apply_2v2": replay_2v2,
+         "service.score_2v2": service_2v2},
+    ),
+    "americana": (
+        {"random": random_american, "edges": edges_american, "transitions": transitions_american},
+        reference_american,
+        {"batch.update_elo_american_batch": batch_american, "pozo.score_pozo": pozo_american,
+         "service.score_americana": service_american},
+    ),
+    "live": (
+        {"random": random_american, "edges": edges_american},
+        reference_live,
+        {"live.AmericanaSession": live_american},
+    ),
+    "log": (
+        {"season": season},
+        reference_season,
+        {"replay.Replay.run_log": replay_season, "shard.sharded_replay": sharded_season,
+         "recompute.IncrementalReplay": incremental_season},
+    ),
+    "kernel": (
+        {"ratios": _ratios},
+        reference_expected,
+        {"kernel.expected_table": expected_tables},
+    ),
+}
+
+
+# Runner ###############################################################################################################
+
+def _size(cases):
+    if isinstance(cases, Season):
+        return len(cases.events)
+    if isinstance(cases, np.ndarray):
+        return len(cases) * (2 * DIFF_RANGE + 1)
+    return len(cases[0])
+
+
+def _outcome(func, cases, **kwargs):
+    """Run ``func`` on every case together, or one by one when it raises, recording the exception per case."""
+    try:
+        return func(cases, **kwargs)
+    except Exception:
+        if isinstance(cases, (Season, np.ndarray)):
+            raise
+    out = []
+    for i in range(len(cases[0])):
+        try:
+            out.extend(func(_take(cases, [i]), **kwargs))
+        except Exception as exc:
+            out.append(("error", type(exc).__name__))
+    return out
+
+
+def _timed(func, cases, **kwargs):
+    start = perf_counter()
+    out = _outcome(func, cases, **kwargs)
+    return out, perf_counter() - start
+
+
+def run(cases=20000, seed=0, families=None, engines=None, workers=1):
+    """
+    Run every engine against the scalar reference on freshly generated cases.
+
+    Args:
+        cases (int, optional): Size of the random 2v2 group; the other groups are scaled from it.
+            Defaults to 20000.
+        seed (int, optional): Seed of the generators. Defaults to 0.
+        families (list, optional): Families to run, among "2v2", "americana", "live", "log" and "kernel".
+            Defaults to all of them.
+        engines (list, optional): Only run engines whose name contains one of these strings.
+        workers (int, optional): Processes of ``sharded_replay``. Defaults to 1, in process.
+
+    Returns:
+        list: One ``Report`` per family, group and engine. For the "log" family cases are events
+        and divergences are players whose final rating differs.
+    """
+    rng = np.random.default_rng(seed)
+    reports = []
+    for family, (groups, reference, family_engines) in FAMILIES.items():
+        if families and family not in families:
+            continue
+        selected = {name: func for name, func in family_engines.items()
+                    if not engines or any(e in name for e in engines)}
+        if not selected:
+            continue
+        for group, generate in groups.items():
+            data = generate(rng, cases)
+            size = _size(data)
+            expected, reference_time = _timed(reference, data)
+            for name, engine in selected.items():
+                kwargs = {"workers": workers} if family == "log" else {}
+                got, engine_time = _timed(engine, data, **kwargs)
+                wrong = [i for i, (a, b) in enumerate(zip(expected, got)) if a != b]
+                if len(got) != len(expected):
+                    wrong.append(min(len(got), len(expected)))
+                first = None
+                if wrong:
+                    i = wrong[0]
+                    first = Divergence(i, _inputs(data, i) if not isinstance(data, np.ndarray) else {},
+                                       expected[i] if i < len(expected) else None, got[i] if i < len(got) else None)
+                reports.append(Report(family, group, name, size, len(wrong), first,
+                                      size / max(reference_time, 1e-9), size / max(engine_time, 1e-9)))
+    return reports
+
+
+def format_reports(reports):
+    """Render reports as a table followed by the first divergence of every failing engine."""
+    lines = [f"{'family':<10} {'group':<12} {'engine':<32} {'cases':>9} {'wrong':>7} "
+             f"{'reference/s':>12} {'engine/s':>12} {'speedup':>8}"]
+    for r in reports:
+        lines.append(f"{r.family:<10} {r.group:<12} {r.engine:<32} {r.cases:>9} {r.mismatches:>7} "
+                     f"{r.reference_rate:>12,.0f} {r.engine_rate:>12,.0f} {r.engine_rate / r.reference_rate:>7.1f}x")
+    for r in reports:
+        if r.first is not None:
+            lines.append("")
+            lines.append(f"First divergence of {r.engine} on {r.family}/{r.group}, case {r.first.case}:")
+            lines.append(f"  inputs:   {r.first.inputs}")
+            lines.append(f"  expected: {r.first.expected}")
+            lines.append(f"  got:      {r.first.got}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the accelerated engines with the scalar scoring functions.")
+    parser.add_argument("--cases", type=int, default=20000, help="size of the random 2v2 group")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--family", action="append", choices=list(FAMILIES), help="repeat to run several")
+    parser.add_argument("--engine", action="append", help="only engines whose name contains this, repeatable")
+    parser.add_argument("--workers", type=int, default=1, help="processes of sharded_replay")
+    args = parser.parse_args()
+
+    reports = run(args.cases, args.seed, args.family, args.engine, args.workers)
+    print(format_reports(reports))
+    sys.exit(1 if any(r.mismatches for r in reports) else 0)
+
+
+if __name__ == "__main__":
+    main()
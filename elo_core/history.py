@@ -0,0 +1,282 @@
+"""Append-only columnar store of every rating change, read through memory maps.
+
+Usage: python -m elo_core.history compact ROOT [--before YYYYMMDD]
+
+A store is a directory of immutable segments named ``<day>-<sequence>``. Each
+segment holds one ``.npy`` file per column::
+
+    player  int32  store index of the player
+    event   int64  event number in the replay
+    old     int32  rating before the event
+    delta   int32  adjustment of the event
+    mode    int8   MATCH_2V2 or AMERICANA
+
+Rows are sorted by player, then by event, and ``index_player`` / ``index_offset``
+give the rows of every player, so one player's history is read with a binary
+search per segment instead of a scan. ``HistoryWriter`` is a ``Replay`` listener
+that buffers the changes and writes them in bulk. ``compact`` merges the segments
+of each day into one. Segments are written to a temporary directory, unique to
+the writer, and renamed into place, so readers and a background compaction never
+see partial segments. A writer that loses a name to another one takes the next.
+"""
+import argparse
+import os
+import shutil
+import time
+import uuid
+from typing import NamedTuple
+
+import numpy as np
+
+from .replay import AMERICANA, MATCH_2V2
+
+COLUMNS = {"player": np.int32, "event": np.int64, "old": np.int32, "delta": np.int32, "mode": np.int8}
+MODES = {"2v2": MATCH_2V2, "americana": AMERICANA}
+
+
+class Trajectory(NamedTuple):
+    """Rating changes of one player in event order."""
+    event: np.ndarray
+    old: np.ndarray
+    delta: np.ndarray
+    mode: np.ndarray
+
+    @property
+    def ratings(self):
+        """Rating after every event."""
+        return self.old + self.delta
+
+
+def _segments(root):
+    """Names of the live segments, leaving out those already merged into a compacted one."""
+    if not os.path.isdir(root):
+        return []
+    names = sorted(name for name in os.listdir(root) if "-" in name and not name.endswith(".tmp"))
+    replaced = set()
+    for name in names:
+        path = os.path.join(root, name, "replaces.txt")
+        if os.path.exists(path):
+            with open(path) as f:
+                replaced.update(f.read().split())
+    return [name for name in names if name not in replaced]
+
+
+def _write_segment(root, day, columns, replaces=()):
+    """Sort ``columns`` by player and event and write them as the next segment of ``day``."""
+    order = np.lexsort((columns["event"], columns["player"]))
+    players = columns["player"][order]
+    index_player, starts = np.unique(players, return_index=True)
+
+    tmp = os.path.join(root, f"{day}-{os.getpid()}-{uuid.uuid4().hex}.tmp")
+    os.makedirs(tmp)
+    for column, dtype in COLUMNS.items():
+        np.save(os.path.join(tmp, f"{column}.npy"), columns[column][order].astype(dtype, copy=False))
+    np.save(os.path.join(tmp, "index_player.npy"), index_player.astype(np.int32))
+    np.save(os.path.join(tmp, "index_offset.npy"), np.append(starts, len(players)).astype(np.int64))
+    if replaces:
+        with open(os.path.join(tmp, "replaces.txt"), "w") as f:
+            f.write("\n".join(replaces))
+
+    existing = [name for name in _segments(root) if name.split("-")[0] == day]
+    sequence = max((int(name.split("-")[1]) for name in existing), default=-1) + 1
+    while True:
+        name = f"{day}-{sequence:06d}"
+        try:
+            os.rename(tmp, os.path.join(root, name))
+            break
+        except OSError:
+            # Another writer took this name since the directory was listed.
+            if not os.path.exists(os.path.join(root, name)):
+                raise
+            sequence += 1
+    return name
+
+
+class HistoryWriter:
+    """
+    Buffer rating changes and write them to ``root`` in segments of up to ``segment_rows`` rows.
+
+    Append it to ``Replay.listeners`` to record a replay, and call ``flush`` (or use it as a
+    context manager) once the replay is done.
+
+    Args:
+        root (str): Store directory, created if needed.
+        day (str, optional): Day the segments belong to, as YYYYMMDD. Defaults to today.
+        segment_rows (int, optional): Rows buffered before a segment is written. Defaults to 4M.
+    """
+
+    def __init__(self, root, day=None, segment_rows=1 << 22):
+        self.root = root
+        self.day = day or time.strftime("%Y%m%d")
+        self.segment_rows = segment_rows
+        self.segments = []
+        self._chunks = []
+        self._rows = 0
+        os.makedirs(root, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def append(self, mode, event_ids, players, old_ratings, deltas):
+        """
+        Add the changes of a group of events.
+
+        Args:
+            mode (str or int): "2v2" or "americana", or ``MATCH_2V2`` / ``AMERICANA``.
+            event_ids (array_like): Shape (n,) with the event of every row of ``players``.
+            players, old_ratings, deltas (array_like): Shape (n, m) with the store index, old
+                rating and adjustment of every player of those events.
+        """
+        players = np.asarray(players)
+        per_row = players.shape[1] if players.ndim == 2 else 1
+        n = players.size
+        self._chunks.append({
+            "player": players.reshape(-1).astype(np.int32),
+            "event": np.repeat(np.asarray(event_ids, dtype=np.int64), per_row),
+            "old": np.asarray(old_ratings).reshape(-1).astype(np.int32),
+            "delta": np.asarray(deltas).reshape(-1).astype(np.int32),
+            "mode": np.full(n, MODES.get(mode, mode), dtype=np.int8),
+        })
+        self._rows += n
+        if self._rows >= self.segment_rows:
+            self.flush()
+
+    def __call__(self, mode, event_ids, players, old_ratings, deltas, results):
+        self.append(mode, event_ids, players, old_ratings, deltas)
+
+    def flush(self):
+        """Write the buffered rows as a new segment."""
+        if not self._rows:
+            return None
+        columns = {c: np.concatenate([chunk[c] for chunk in self._chunks]) for c in COLUMNS}
+        self._chunks, self._rows = [], 0
+        name = _write_segment(self.root, self.day, columns)
+        self.segments.append(name)
+        return name
+
+
+class _Segment:
+    __slots__ = ("name", "columns", "index_player", "index_offset")
+
+    def __init__(self, root, name):
+        path = os.path.join(root, name)
+        self.name = name
+        self.columns = {c: np.load(os.path.join(path, f"{c}.npy"), mmap_mode="r") for c in COLUMNS}
+        self.index_player = np.load(os.path.join(path, "index_player.npy"), mmap_mode="r")
+        self.index_offset = np.load(os.path.join(path, "index_offset.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.columns["player"])
+
+    def rows(self, player):
+        i = np.searchsorted(self.index_player, player)
+        if i == len(self.index_player) or self.index_player[i] != player:
+            return None
+        return slice(int(self.index_offset[i]), int(self.index_offset[i + 1]))
+
+
+class RatingHistory:
+    """
+    Read-only view of a store, every column memory-mapped.
+
+    Call ``refresh`` to see the segments written or compacted since it was opened.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._segments = {}
+        self.refresh()
+
+    def refresh(self):
+        segments = {}
+        for name in _segments(self.root):
+            try:
+                segments[name] = self._segments.get(name) or _Segment(self.root, name)
+            except FileNotFoundError:
+                # Removed by a compaction between listing and opening it.
+                continue
+        self._segments = segments
+
+    @property
+    def segments(self):
+        return list(self._segments)
+
+    def __len__(self):
+        return sum(len(segment) for segment in self._segments.values())
+
+    def player(self, player):
+        """Return the ``Trajectory`` of one player (store index), reading only that player's rows."""
+        parts = []
+        for segment in self._segments.values():
+            rows = segment.rows(player)
+            if rows is not None:
+                parts.append({c: segment.columns[c][rows] for c in ("event", "old", "delta", "mode")})
+        if not parts:
+            return Trajectory(*(np.empty(0, dtype=COLUMNS[c]) for c in ("event", "old", "delta", "mode")))
+        columns = {c: np.concatenate([part[c] for part in parts]) for c in parts[0]}
+        # Segments of different days, or written by different writers, can interleave events.
+        order = np.argsort(columns["event"], kind="stable")
+        return Trajectory(*(columns[c][order] for c in ("event", "old", "delta", "mode")))
+
+    def players(self):
+        """Store indices of every player with at least one change."""
+        indexes = [np.asarray(segment.index_player) for segment in self._segments.values()]
+        return np.unique(np.concatenate(indexes)) if indexes else np.empty(0, dtype=np.int32)
+
+    def column(self, name):
+        """One column of every segment, in segment order, loaded in memory."""
+        parts = [np.asarray(segment.columns[name]) for segment in self._segments.values()]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=COLUMNS[name])
+
+
+def compact(root, before=None):
+    """
+    Merge the segments of every day that has more than one into a single segment.
+
+    Safe to run in the background while readers use the store: the merged segment lists
+    the segments it replaces, so they are hidden as soon as it is renamed into place, and
+    readers keep their memory maps of the files removed afterwards.
+
+    Args:
+        root (str): Store directory.
+        before (str, optional): Only compact days strictly before this YYYYMMDD. Defaults to
+            today, so the day a writer is still appending to is left alone.
+
+    Returns:
+        list: The names of the new segments.
+    """
+    before = before or time.strftime("%Y%m%d")
+    days = {}
+    for name in _segments(root):
+        days.setdefault(name.split("-")[0], []).append(name)
+
+    merged = []
+    for day, names in sorted(days.items()):
+        if len(names) < 2 or day >= before:
+            continue
+        parts = [_Segment(root, name) for name in names]
+        columns = {c: np.concatenate([np.asarray(part.columns[c]) for part in parts]) for c in COLUMNS}
+        del parts
+        merged.append(_write_segment(root, day, columns, replaces=names))
+        for name in names:
+            shutil.rmtree(os.path.join(root, name))
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance of a rating history store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compact_args = sub.add_parser("compact", help="merge the segments of every day")
+    compact_args.add_argument("root")
+    compact_args.add_argument("--before", help="only days before this YYYYMMDD, by default today")
+    args = parser.parse_args()
+
+    for name in compact(args.root, args.before):
+        print(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""Streaming ingestion of match logs from JSONL and CSV files.
+
+Everything here is a generator over lines, so memory stays constant whatever the
+size of the file. ``follow`` tails a growing file and yields ``None`` whenever
+it is idle; the parsers pass it through and ``batches`` treats it as a signal to
+flush, so new results are scored as soon as they are written. A CSV americana
+has no explicit end: it is held until a row of another event follows it, or
+until the log has been idle for ``idle_polls`` polls (0.5 s by default).
+
+JSONL, one event per line::
+
+    {"type": "2v2", "team1": ["ana", "bea"], "team2": ["carla", "dani"], "result": "7-5"}
+    {"type": "americana", "pairs": [["ana", "bea"], ...], "courts": [[3, 1], ...]}
+
+CSV, with a header. A 2v2 match is one row; an americana is one row per pair,
+consecutive rows sharing the same ``event``::
+
+    type,event,player1,player2,player3,player4,result,pista_inicial,pista_final
+    2v2,,ana,bea,carla,dani,7-5,,
+    americana,n1,ana,bea,,,,3,1
+"""
+import csv
+import json
+import os
+import time
+from functools import partial
+
+
+class IngestError(ValueError):
+    """A record that cannot be parsed or fails validation."""
+
+    def __init__(self, message, lineno=None):
+        super().__init__(message if lineno is None else f"line {lineno}: {message}")
+        self.lineno = lineno
+
+
+def parse_score(result):
+    """Parse a 2v2 score given as ``"7-5"`` or a two-item sequence."""
+    if isinstance(result, str):
+        result = result.split("-")
+    try:
+        score1, score2 = (int(s) for s in result)
+    except (TypeError, ValueError):
+        raise IngestError(f"invalid score {result!r}") from None
+    if score1 < 0 or score2 < 0 or score1 + score2 == 0:
+        raise IngestError(f"invalid score {score1}-{score2}")
+    return score1, score2
+
+
+def validate_2v2(team1, team2, result):
+    """Return a validated 2v2 event."""
+    team1, team2 = tuple(team1), tuple(team2)
+    if len(team1) != 2 or len(team2) != 2:
+        raise IngestError("a 2v2 match needs two players per team")
+    if len(set(team1 + team2)) != 4:
+        raise IngestError("a player cannot appear twice in a match")
+    return ("2v2", team1, team2, parse_score(result))
+
+
+def validate_americana(pairs, courts, numpistas=6):
+    """Return a validated americana event."""
+    pairs = [tuple(pair) for pair in pairs]
+    try:
+        courts = [(int(ini), int(fin)) for ini, fin in courts]
+    except (TypeError, ValueError):
+        raise IngestError("invalid courts") from None
+    if len(pairs) < 2 or len(pairs) != len(courts) or any(len(pair) != 2 for pair in pairs):
+        raise IngestError("an americana needs at least two pairs and one (initial, final) court per pair")
+    players = [p for pair in pairs for p in pair]
+    if len(set(players)) != len(players):
+        raise IngestError("a player cannot appear twice in an americana")
+    if any(not (1 <= c <= numpistas) for court in courts for c in court):
+        raise IngestError(f"courts must be between 1 and {numpistas}")
+    return ("americana", pairs, courts)
+
+
+def _errors(on_error):
+    if on_error not in ("raise", "skip"):
+        raise ValueError(f"on_error must be 'raise' or 'skip', not {on_error!r}")
+    return on_error == "raise"
+
+
+def parse_jsonl(lines, numpistas=6, on_error="raise"):
+    """Yield the events of JSONL lines. Invalid records raise ``IngestError`` or are skipped."""
+    strict = _errors(on_error)
+    lineno = 0
+    for line in lines:
+        if line is None:
+            yield None
+            continue
+        lineno += 1
+        if not line.strip():
+            continue
+        try:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise IngestError(f"invalid JSON: {e.msg}") from None
+            kind = record.get("type")
+            if kind == "2v2":
+                yield validate_2v2(record["team1"], record["team2"], record["result"])
+            elif kind == "americana":
+                yield validate_americana(record["pairs"], record["courts"], numpistas)
+            else:
+                raise IngestError(f"unknown event type {kind!r}")
+        except (IngestError, KeyError, AttributeError, TypeError) as e:
+            if strict:
+                raise IngestError(str(e), lineno) from None
+
+
+def parse_csv(lines, numpistas=6, on_error="raise", idle_polls=5):
+    """
+    Yield the events of CSV lines with the header described in the module docstring.
+
+    An americana ends at a row of another event, at the end of the lines, or after
+    ``idle_polls`` consecutive ``None`` (idle polls of ``follow``) with no new row.
+    """
+    strict = _errors(on_error)
+    header = None
+    pozo, pairs, courts = None, [], []
+    lineno = 0
+    idle = 0
+
+    def americana():
+        try:
+            return validate_americana(pairs, courts, numpistas)
+        except IngestError as e:
+            if strict:
+                raise IngestError(str(e), lineno) from None
+
+    for line in lines:
+        if line is None:
+            # The writer may be halfway through a pozo, so an open americana is only
+            # closed once the log has been idle for the whole grace period.
+            idle += 1
+            if pairs and idle >= idle_polls:
+                event = americana()
+                if event:
+                    yield event
+                pozo, pairs, courts = None, [], []
+            yield None
+            continue
+        idle = 0
+        lineno += 1
+        if not line.strip():
+            continue
+        row = next(csv.reader([line]))
+        if header is None:
+            header = row
+            continue
+        record = dict(zip(header, row))
+
+        if pairs and (record.get("type") != "americana" or record.get("event") != pozo):
+            event = americana()
+            if event:
+                yield event
+            pozo, pairs, courts = None, [], []
+
+        try:
+            kind = record.get("type")
+            if kind == "2v2":
+                yield validate_2v2((record["player1"], record["player2"]),
+                                   (record["player3"], record["player4"]), record["result"])
+            elif kind == "americana":
+                pozo = record["event"]
+                pairs.append((record["player1"], record["player2"]))
+                courts.append((record["pista_inicial"], record["pista_final"]))
+            else:
+                raise IngestError(f"unknown event type {kind!r}")
+        except (IngestError, KeyError, TypeError) as e:
+            if strict:
+                raise IngestError(str(e), lineno) from None
+
+    if pairs:
+        event = americana()
+        if event:
+            yield event
+
+
+def follow(path, poll_interval=0.1, stop=None):
+    """
+    Yield the lines of a file as they are appended, like ``tail -f``.
+
+    Existing lines are read first. Whenever there is nothing new, ``None`` is yielded and the
+    file is polled again after ``poll_interval`` seconds. A partial last line is held back
+    until its newline is written. If the file is truncated or replaced it is reopened.
+
+    Args:
+        path (str): File to follow.
+        poll_interval (float, optional): Seconds between polls when idle. Defaults to 0.1.
+        stop (callable, optional): Polled when idle; following ends when it returns True.
+    """
+    f = open(path, encoding="utf-8")
+    try:
+        partial = ""
+        while True:
+            line = f.readline()
+            if line:
+                partial += line
+                if partial.endswith("\n"):
+                    yield partial
+                    partial = ""
+                continue
+
+            yield None
+            if stop is not None and stop():
+                return
+            time.sleep(poll_interval)
+            try:
+                replaced = os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+                truncated = os.path.getsize(path) < f.tell()
+            except FileNotFoundError:
+                continue
+            if replaced or truncated:
+                f.close()
+                f = open(path, encoding="utf-8")
+                partial = ""
+    finally:
+        f.close()
+
+
+def batches(events, size=4096):
+    """Group events in lists of up to ``size``. A ``None`` flushes the current batch early."""
+    batch = []
+    for event in events:
+        if event is not None:
+            batch.append(event)
+            if len(batch) < size:
+                continue
+        if batch:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_events(path, fmt=None, tail=False, numpistas=6, on_error="raise", idle_polls=5, **follow_args):
+    """
+    Yield the events of a JSONL or CSV log.
+
+    Args:
+        path (str): Log file. The format is taken from the extension unless ``fmt`` is given.
+        fmt (str, optional): "jsonl" or "csv".
+        tail (bool, optional): Keep following the file as it grows, see ``follow``.
+        numpistas (int, optional): Number of courts, used to validate americanas. Defaults to 6.
+        on_error (str, optional): "raise" or "skip" invalid records. Defaults to "raise".
+        idle_polls (int, optional): Idle polls after which an open CSV americana is closed
+            while tailing, see ``parse_csv``. Defaults to 5.
+    """
+    fmt = fmt or ("csv" if path.endswith(".csv") else "jsonl")
+    parse = {"jsonl": parse_jsonl, "csv": partial(parse_csv, idle_polls=idle_polls)}[fmt]
+    if tail:
+        yield from parse(follow(path, **follow_args), numpistas, on_error)
+    else:
+        with open(path, encoding="utf-8") as f:
+            yield from parse(f, numpistas, on_error)
+
+
+def ingest(events, replay, batch_size=4096):
+    """
+    Score a stream of events batch by batch with a ``Replay``.
+
+    Yields after each batch, once it has been applied, so the caller can report progress or
+    save snapshots. With a tailed log this runs until the log stops being followed.
+
+    Yields:
+        list: The events of the batch just applied.
+    """
+    for batch in batches(events, batch_size):
+        replay.run(batch)
+        yield batch
@@ -0,0 +1,283 @@
+"""Opt-in instrumentation of the scoring pipeline.
+
+Scoring stages record their duration in histograms, and counters record how
+much work they did. Nothing is recorded until ``enable()`` is called. While
+disabled, a stage returns one shared no-op context manager, so it allocates
+nothing. ``flush()`` pushes a snapshot of every metric to the registered sinks:
+``MemorySink``, ``PrometheusTextSink`` or ``LogSink``. ``profile()`` wraps cProfile and
+tracemalloc around a block of code, such as a replay.
+
+Stages recorded by the package:
+
+- ``scoring.update_elo_2v2`` and ``scoring.update_elo_american``: whole scalar calls.
+- ``batch.expected_score``: the expected-score math of the batch engines.
+- ``batch.court_adjustments``: compensation, penalty and bonus of the americana engine.
+- ``replay.schedule`` and ``replay.score``: grouping 2v2 matches in levels and scoring them.
+- ``pozo.decode`` and ``pozo.score``: decoding page3's session state and scoring it.
+- ``ui.dataframe``: building the result tables of the Streamlit pages.
+- ``ui.rerun`` and ``ui.fragment``: CPU time of a whole Streamlit rerun and of a panel rerun alone.
+- ``service.flush``: scoring one micro-batch of the HTTP service.
+
+Counters: ``replay.events``, ``replay.levels``, ``pozo.cache_misses``, ``service.requests``
+and ``service.batches``.
+"""
+import os
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+# Upper bounds in seconds of the histogram buckets, the last one being +Inf.
+BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+           1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+enabled = False
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_sinks = []
+# (histograms, counters) of every open ``profile()`` block, fed along with the registry.
+_recorders = []
+
+
+class Histogram:
+    """Count, sum and bucketed distribution of the durations of one stage."""
+    __slots__ = ("count", "sum", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+
+    def as_dict(self):
+        return {"count": self.count, "sum": self.sum, "min": self.min if self.count else 0.0,
+                "max": self.max, "buckets": list(self.buckets)}
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Forget every recorded metric."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def observe(name, seconds):
+    """Record ``seconds`` spent in stage ``name``."""
+    with _lock:
+        for histograms in (_histograms, *(h for h, _ in _recorders)):
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+
+def count(name, amount=1):
+    """Add ``amount`` to counter ``name``. Does nothing while disabled."""
+    if enabled:
+        with _lock:
+            for counters in (_counters, *(c for _, c in _recorders)):
+                counters[name] = counters.get(name, 0) + amount
+
+
+_DISABLED = nullcontext()
+
+
+def stage(name):
+    """Time the enclosed block as stage ``name`` when instrumentation is enabled."""
+    return _timed(name) if enabled else _DISABLED
+
+
+@contextmanager
+def _timed(name):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, perf_counter() - start)
+
+
+def snapshot():
+    """Return every metric as plain dicts: ``{"histograms": {...}, "counters": {...}}``."""
+    with _lock:
+        return {
+            "histograms": {name: h.as_dict() for name, h in _histograms.items()},
+            "counters": dict(_counters),
+        }
+
+
+def add_sink(sink):
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+
+def flush():
+    """Send a snapshot of every metric to the registered sinks."""
+    data = snapshot()
+    for sink in _sinks:
+        sink.emit(data)
+
+
+class MemorySink:
+    """Keep the snapshots in memory, the last one in ``latest``."""
+
+    def __init__(self, keep=100):
+        self.keep = keep
+        self.snapshots = []
+
+    @property
+    def latest(self):
+        return self.snapshots[-1] if self.snapshots else None
+
+    def emit(self, data):
+        self.snapshots.append(data)
+        del self.snapshots[:-self.keep]
+
+
+class PrometheusTextSink:
+    """Write the metrics to a file in the Prometheus text format, for the node exporter's textfile collector."""
+
+    def __init__(self, path, prefix="elo"):
+        self.path = path
+        self.prefix = prefix
+
+    def render(self, data):
+        p = self.prefix
+        lines = [f"# HELP {p}_stage_seconds Time spent in each scoring stage.",
+                 f"# TYPE {p}_stage_seconds histogram"]
+        for name, h in sorted(data["histograms"].items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), h["buckets"]):
+                cumulative += n
+                lines.append(f'{p}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{p}_stage_seconds_sum{{stage="{name}"}} {h["sum"]!r}')
+            lines.append(f'{p}_stage_seconds_count{{stage="{name}"}} {h["count"]}')
+        for name, value in sorted(data["counters"].items()):
+            metric = f"{p}_{name.replace('.', '_')}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def emit(self, data):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render(data))
+        os.replace(tmp, self.path)
+
+
+class LogSink:
+    """Log every stage and counter as one JSON object per line."""
+
+    def __init__(self, logger=None, level=None):
+        import logging
+
+        self.logger = logger or logging.getLogger("elo_core.instrument")
+        self.level = logging.INFO if level is None else level
+
+    def emit(self, data):
+        import json
+
+        for name, h in sorted(data["histograms"].items()):
+            mean = h["sum"] / h["count"] if h["count"] else 0.0
+            self.logger.log(self.level, json.dumps({"stage": name, "count": h["count"], "sum_s": h["sum"],
+                                                    "mean_s": mean, "max_s": h["max"]}))
+        for name, value in sorted(data["counters"].items()):
+            self.logger.log(self.level, json.dumps({"counter": name, "value": value}))
+
+
+class ProfileResult:
+    """What ``profile()`` collected: cProfile stats, tracemalloc peak and top allocations."""
+
+    def __init__(self):
+        self.stats = None
+        self.peak_memory = None
+        self.top_allocations = []
+        self.metrics = None
+
+    def report(self, limit=20, sort="cumulative"):
+        import io
+        import pstats
+
+        out = io.StringIO()
+        if self.stats is not None:
+            pstats.Stats(self.stats, stream=out).sort_stats(sort).print_stats(limit)
+        if self.peak_memory is not None:
+            out.write(f"peak traced memory: {self.peak_memory / 1024:.0f} KiB\n")
+            for stat in self.top_allocations[:limit]:
+                out.write(f"  {stat}\n")
+        return out.getvalue()
+
+
+@contextmanager
+def profile(memory=True, allocations=10):
+    """
+    Profile the enclosed block with cProfile, and tracemalloc when ``memory`` is set.
+
+    Instrumentation is enabled for the duration of the block, and the stage metrics
+    recorded inside it are stored in the result. The global metrics are left alone, so
+    the block can run inside a pipeline that already records them. When tracemalloc is
+    already tracing, it is left running; ``peak_memory`` is then the peak above the
+    memory traced on entry, or None if the block never passed the earlier peak.
+
+    Yields:
+        ProfileResult: Filled in when the block exits.
+    """
+    import cProfile
+    import tracemalloc
+
+    result = ProfileResult()
+    was_enabled = enabled
+    recorder = ({}, {})
+    with _lock:
+        _recorders.append(recorder)
+    enable()
+    profiler = cProfile.Profile()
+    start_tracing = memory and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    if memory:
+        entry_current, entry_peak = tracemalloc.get_traced_memory()
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        result.stats = profiler
+        if memory:
+            _, peak = tracemalloc.get_traced_memory()
+            if start_tracing:
+                result.peak_memory = peak
+            elif peak > entry_peak:
+                result.peak_memory = peak - entry_current
+            result.top_allocations = tracemalloc.take_snapshot().statistics("lineno")[:allocations]
+            if start_tracing:
+                tracemalloc.stop()
+        with _lock:
+            _recorders.remove(recorder)
+            histograms, counters = recorder
+            result.metrics = {"histograms": {name: h.as_dict() for name, h in histograms.items()},
+                              "counters": dict(counters)}
+        if not was_enabled:
+            disable()
@@ -0,0 +1,35 @@
+"""Expected-score kernel shared by every scoring engine.
+
+``expected_score`` is the logistic curve of the Elo formula. ``expected_table``
+precomputes it for every integer rating difference in ``[-DIFF_RANGE, DIFF_RANGE]``
+with the very same expression, so a lookup is bit-identical to computing it.
+Tables are kept in an LRU cache keyed by ratio, which in practice only takes a
+few slider values.
+"""
+import math
+from array import array
+from functools import lru_cache
+
+DIFF_RANGE = 3000
+
+
+def expected_score(diff, ratio):
+    """
+    Return the expected score P of a player against an opponent ``diff`` points stronger.
+
+    Args:
+        diff (float): Opponent rating minus player rating.
+        ratio (int): Used to scale the difference in ratings.
+    """
+    return 1 / (1 + math.pow(10, diff / ratio))
+
+
+@lru_cache(maxsize=64)
+def expected_table(ratio):
+    """
+    Return ``expected_score(d, ratio)`` for every integer d from -DIFF_RANGE to DIFF_RANGE.
+
+    Returns:
+        array.array: Doubles where ``table[d + DIFF_RANGE]`` is the expected score at difference d.
+    """
+    return array("d", [expected_score(d, ratio) for d in range(-DIFF_RANGE, DIFF_RANGE + 1)])
@@ -0,0 +1,162 @@
+"""Incremental leaderboard over the integer rating domain.
+
+A Fenwick tree counts players per rating, so rank, percentile and top-N queries
+take O(log R) steps, R being the width of the rating domain, instead of sorting
+every player after each match.
+"""
+
+
+class LeaderboardIndex:
+    """
+    Ratings of every player, indexed for rank queries.
+
+    Slot ``hi - rating`` of the Fenwick tree counts the players with that rating, so
+    prefix sums count the players rated at or above a value. The domain ``[lo, hi)`` grows
+    automatically when a rating falls outside it.
+
+    It can be appended to ``Replay.listeners`` to follow a replay as it is scored.
+    """
+
+    def __init__(self, lo=0, hi=4096):
+        self.lo = lo
+        self.hi = hi
+        self._tree = [0] * (hi - lo + 1)
+        self._ratings = {}
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._ratings)
+
+    def __contains__(self, player):
+        return player in self._ratings
+
+    def __getitem__(self, player):
+        return self._ratings[player]
+
+    @classmethod
+    def from_store(cls, store, margin=1024):
+        """Build an index with every player of a ``PlayerStore``."""
+        ratings = store.ratings.tolist()
+        lo = min(ratings, default=store.default_rating) - margin
+        hi = max(ratings, default=store.default_rating) + margin
+        index = cls(lo, hi)
+        for player, rating in enumerate(ratings):
+            index._insert(player, rating, bulk=True)
+        index._rebuild_tree()
+        return index
+
+    def _add(self, rating, amount):
+        i = self.hi - rating
+        tree = self._tree
+        size = len(tree)
+        while i < size:
+            tree[i] += amount
+            i += i & -i
+
+    def _prefix(self, slot):
+        """Count the players in slots 1 to ``slot``, i.e. rated at or above ``hi - slot``."""
+        total = 0
+        tree = self._tree
+        while slot > 0:
+            total += tree[slot]
+            slot -= slot & -slot
+        return total
+
+    def _find(self, k):
+        """Return the slot holding the k-th best player (1-based)."""
+        tree = self._tree
+        pos = 0
+        step = 1 << ((len(tree) - 1).bit_length() - 1)
+        while step:
+            nxt = pos + step
+            if nxt < len(tree) and tree[nxt] < k:
+                pos = nxt
+                k -= tree[nxt]
+            step >>= 1
+        return pos + 1
+
+    def _rebuild_tree(self):
+        tree = [0] * (self.hi - self.lo + 1)
+        for rating, players in self._buckets.items():
+            tree[self.hi - rating] = len(players)
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _grow(self, rating):
+        span = self.hi - self.lo
+        while not self.lo <= rating < self.hi:
+            if rating < self.lo:
+                self.lo -= span
+            else:
+                self.hi += span
+            span *= 2
+        self._rebuild_tree()
+
+    def _insert(self, player, rating, bulk=False):
+        self._ratings[player] = rating
+        self._buckets.setdefault(rating, {})[player] = None
+        if not bulk:
+            if self.lo <= rating < self.hi:
+                self._add(rating, 1)
+            else:
+                self._grow(rating)
+
+    def remove(self, player):
+        rating = self._ratings.pop(player)
+        bucket = self._buckets[rating]
+        del bucket[player]
+        if not bucket:
+            del self._buckets[rating]
+        self._add(rating, -1)
+
+    def set(self, player, rating):
+        """Set the rating of a player, adding them if new."""
+        old = self._ratings.get(player)
+        if old == rating:
+            return
+        if old is not None:
+            self.remove(player)
+        self._insert(player, rating)
+
+    def __call__(self, mode, event_ids, players, old_ratings, deltas, results):
+        for player, rating in zip(players.ravel().tolist(), (old_ratings + deltas).ravel().tolist()):
+            self.set(player, rating)
+
+    def count_above(self, rating):
+        """Number of players rated strictly above ``rating``."""
+        if rating < self.lo:
+            return len(self._ratings)
+        if rating >= self.hi:
+            return 0
+        return self._prefix(self.hi - 1 - rating)
+
+    def rank(self, player):
+        """Rank of a player, 1 being the best. Players with the same rating share the rank."""
+        return self.count_above(self._ratings[player]) + 1
+
+    def percentile(self, player):
+        """Percentage of the other players rated strictly below this one."""
+        n = len(self._ratings)
+        if n == 1:
+            return 100.0
+        rating = self._ratings[player]
+        below = n - self.count_above(rating) - len(self._buckets[rating])
+        return 100 * below / (n - 1)
+
+    def top(self, n=10):
+        """Return the ``n`` best ``(player, rating)`` pairs, best first."""
+        out = []
+        seen = 0
+        total = len(self._ratings)
+        while len(out) < n and seen < total:
+            rating = self.hi - self._find(seen + 1)
+            bucket = self._buckets[rating]
+            for player in bucket:
+                out.append((player, rating))
+                if len(out) == n:
+                    break
+            seen += len(bucket)
+        return out
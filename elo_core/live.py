@@ -0,0 +1,164 @@
+"""Live scoring of a sube-baja night played over several rounds.
+
+``AmericanaSession`` keeps a pozo in ``array`` buffers: the ratings of every
+player, and for every pair the court it started the night on, the court it plays
+this round and the court it goes to next. Court results are reported one at a
+time as they come in. A result only moves the pairs of its court, so only their
+provisional adjustments (what ``update_elo_american`` would give if the night
+ended now) are computed again, and only those rows are sent to the subscribers.
+
+The pozo average is kept as a running sum of the ratings. Changing a rating
+changes the average and with it every adjustment, so every pair is computed
+again, but still only the rows that changed are sent. Adjustments are computed
+with ``american_pair_adjustment``, the per-pair step of ``update_elo_american``,
+so they are identical to scoring the whole pozo again.
+"""
+from array import array
+from typing import NamedTuple
+
+from .scoring import american_pair_adjustment
+
+
+class PairRow(NamedTuple):
+    """Provisional state of one pair: its courts and the adjustment of both players."""
+    pair: int
+    initial: int
+    final: int
+    delta: tuple
+
+
+class AmericanaSession:
+    """
+    A pozo being played, round by round.
+
+    Args:
+        ratings (list): ``(rating1, rating2)`` of every pair.
+        courts (list): Court every pair starts the night on.
+        params (dict): Arguments for ``update_elo_american``. Must include multipistes,
+            compensacio, compensacio2 and bonificacion; the others take its defaults.
+
+    Callables in ``subscribers`` are called with the list of ``PairRow`` that changed after
+    every report or rating change.
+    """
+    __slots__ = ("multipistes", "compensacio", "compensacio2", "bonificacion", "k", "ratio", "numpistas", "base",
+                 "factoravg", "round", "ratings", "initial", "playing", "final", "deltas", "subscribers",
+                 "_total", "_courts", "_open")
+
+    def __init__(self, ratings, courts, params):
+        params = {"k": 20, "ratio": 800, "numpistas": 6, "base": 10, "factoravg": 0.5, **params}
+        for name in ("multipistes", "compensacio", "compensacio2", "bonificacion", "k", "ratio", "numpistas",
+                     "base", "factoravg"):
+            setattr(self, name, params[name])
+        if len(ratings) != len(courts):
+            raise ValueError(f"{len(ratings)} pairs but {len(courts)} courts")
+        if any(not 1 <= c <= self.numpistas for c in courts):
+            raise ValueError(f"Courts must be between 1 and {self.numpistas}")
+
+        self.round = 0
+        self.ratings = array("i", [r for pair in ratings for r in pair])
+        self.initial = array("h", courts)
+        self.playing = array("h", courts)
+        self.final = array("h", courts)
+        self.deltas = array("i", bytes(4 * len(self.ratings)))
+        self.subscribers = []
+        self._total = sum(self.ratings)
+        self._start_round()
+        self._rescore_all()
+
+    def __len__(self):
+        return len(self.initial)
+
+    def _start_round(self):
+        courts = {}
+        for pair, court in enumerate(self.playing):
+            courts.setdefault(court, []).append(pair)
+        self._courts = courts
+        # A pair alone on its court has no match, so the round does not wait for it.
+        self._open = {court for court, pairs in courts.items() if len(pairs) > 1}
+
+    def _rescore(self, pair):
+        """Compute the adjustments of ``pair`` again and return whether they changed."""
+        deltas = american_pair_adjustment(
+            (self.ratings[2 * pair], self.ratings[2 * pair + 1]), self._total / len(self.ratings),
+            self.initial[pair], self.final[pair], self.multipistes, self.compensacio, self.compensacio2,
+            self.bonificacion, self.k, self.ratio, self.numpistas, self.base, self.factoravg)
+        if (self.deltas[2 * pair], self.deltas[2 * pair + 1]) == deltas:
+            return False
+        self.deltas[2 * pair], self.deltas[2 * pair + 1] = deltas
+        return True
+
+    def _rescore_all(self):
+        return [pair for pair in range(len(self.initial)) if self._rescore(pair)]
+
+    def _emit(self, pairs):
+        rows = [self.row(pair) for pair in pairs]
+        if rows:
+            for callback in self.subscribers:
+                callback(rows)
+        return rows
+
+    def row(self, pair):
+        """The ``PairRow`` of one pair."""
+        return PairRow(pair, self.initial[pair], self.final[pair], (self.deltas[2 * pair], self.deltas[2 * pair + 1]))
+
+    def rows(self):
+        """The ``PairRow`` of every pair, e.g. to draw the whole table for a new subscriber."""
+        return [self.row(pair) for pair in range(len(self.initial))]
+
+    def pairs_on(self, court):
+        """Pairs playing on ``court`` this round."""
+        return list(self._courts.get(court, ()))
+
+    def report(self, court, winner):
+        """
+        Record the result of one court of the current round.
+
+        The winner goes up a court and the other pairs of the court go down one, within
+        1 and ``numpistas``. Reporting a court again before the round is over replaces its
+        result. The next round starts once every court with a match has reported.
+
+        Args:
+            court (int): Court of the match.
+            winner (int): Pair that won it.
+
+        Returns:
+            list: The ``PairRow`` that changed, as sent to the subscribers.
+        """
+        pairs = self._courts.get(court, ())
+        if len(pairs) < 2:
+            raise ValueError(f"No match on court {court} in round {self.round}")
+        if winner not in pairs:
+            raise ValueError(f"Pair {winner} does not play on court {court} in round {self.round}")
+
+        changed = []
+        for pair in pairs:
+            self.final[pair] = max(court - 1, 1) if pair == winner else min(court + 1, self.numpistas)
+            if self._rescore(pair):
+                changed.append(pair)
+
+        self._open.discard(court)
+        if not self._open:
+            self.playing[:] = self.final
+            self.round += 1
+            self._start_round()
+        return self._emit(changed)
+
+    def set_rating(self, pair, second, value):
+        """
+        Change the rating of one player, e.g. a late substitute.
+
+        Returns:
+            list: The ``PairRow`` that changed, as sent to the subscribers.
+        """
+        index = 2 * pair + second
+        self._total += value - self.ratings[index]
+        self.ratings[index] = value
+        return self._emit(self._rescore_all())
+
+    def adjustments(self):
+        """The provisional adjustment of every pair, as returned by ``update_elo_american``."""
+        return [(self.deltas[2 * pair], self.deltas[2 * pair + 1]) for pair in range(len(self.initial))]
+
+    def results(self):
+        """``(pista_inicial, pista_final)`` of every pair, to score the night with ``update_elo_american``."""
+        return list(zip(self.initial, self.final))
@@ -0,0 +1,64 @@
+"""Compact mutable state of one americana pozo, for the sube-baja pages.
+
+Ratings and courts live in fixed-size ``array`` buffers that are edited in place,
+and scoring is memoized on their contents and the parameters.
+"""
+from array import array
+from functools import lru_cache
+
+from . import instrument
+from .scoring import update_elo_american
+
+
+class PozoState:
+    """
+    Ratings and courts of every pair of a pozo.
+
+    ``ratings`` holds the two players of pair ``i`` at ``2 * i`` and ``2 * i + 1``, and
+    ``courts`` holds its initial and final court at the same positions.
+    """
+    __slots__ = ("ratings", "courts")
+
+    def __init__(self, pairs=12, rating=1000, numpistas=6):
+        self.ratings = array("i", [rating]) * (2 * pairs)
+        pairs_per_court = -(-pairs // numpistas)
+        self.courts = array("b", [min(i // pairs_per_court + 1, numpistas) for i in range(pairs) for _ in range(2)])
+
+    def __len__(self):
+        return len(self.ratings) // 2
+
+    def set_rating(self, pair, second, value):
+        self.ratings[2 * pair + second] = value
+
+    def set_court(self, pair, final, value):
+        self.courts[2 * pair + final] = value
+
+    def set_pairs(self, ratings, results):
+        """Replace every pair's ratings and courts from lists of tuples."""
+        self.ratings[:] = array("i", [r for pair in ratings for r in pair])
+        self.courts[:] = array("b", [c for pair in results for c in pair])
+
+    def key(self):
+        """Return the contents as a hashable tuple, decoded once for the whole rerun."""
+        with instrument.stage("pozo.decode"):
+            return tuple(self.ratings), tuple(self.courts)
+
+
+def _pairs(flat):
+    return list(zip(flat[::2], flat[1::2]))
+
+
+@lru_cache(maxsize=1024)
+def score_pozo(ratings, courts, multipistes, compensacio, compensacio2, bonificacion,
+               k=20, ratio=800, numpistas=6, base=10, factoravg=0.5):
+    """
+    Memoized ``update_elo_american`` on the flat tuples returned by ``PozoState.key``.
+
+    Returns:
+        tuple: The adjustment of every pair, as in ``update_elo_american``.
+    """
+    instrument.count("pozo.cache_misses")
+    with instrument.stage("pozo.score"):
+        return tuple(update_elo_american(_pairs(ratings), _pairs(courts), multipistes, compensacio, compensacio2,
+                                         bonificacion, k=k, ratio=ratio, numpistas=numpistas, base=base,
+                                         factoravg=factoravg))
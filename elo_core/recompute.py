@@ -0,0 +1,163 @@
+"""Incremental recomputation after correcting the result of an old event.
+
+A full replay is run once, keeping the old rating and delta of every player in
+every event. When a result is corrected, only the edited event and the later
+events of players whose rating changed are scored again. Those events are taken
+in log order from a heap that holds, for every affected player, their next event,
+so the work grows with the affected part of the match graph instead of with the
+length of the season.
+"""
+import heapq
+from typing import NamedTuple
+
+import numpy as np
+
+from .replay import AMERICANA, MATCH_2V2, Replay
+from .scoring import update_elo_2v2, update_elo_american
+
+
+class Correction(NamedTuple):
+    """Outcome of one correction: the players whose final rating changed, before and after."""
+    rescored: int
+    players: np.ndarray
+    old_ratings: np.ndarray
+    new_ratings: np.ndarray
+
+
+class IncrementalReplay:
+    """
+    A replayed ``MatchLog`` whose results can be corrected without replaying it again.
+
+    Args:
+        log (MatchLog): The encoded log. Corrections are written into its arrays.
+        store (PlayerStore): Store the log's player indices refer to, with the ratings before
+            the first event. It holds the final ratings once the replay is done.
+        params_2v2, params_american (dict): As in ``Replay``.
+    """
+
+    def __init__(self, log, store, params_2v2=None, params_american=None):
+        self.log = log
+        self.store = store
+        self.params_2v2 = params_2v2 or {}
+        self.params_american = params_american
+
+        kinds = np.asarray(log.kinds)
+        is_2v2 = kinds == MATCH_2V2
+        pozo_sizes = 2 * np.diff(log.pozo_offsets)
+        sizes = np.empty(len(kinds), dtype=np.int64)
+        sizes[is_2v2] = 4
+        sizes[~is_2v2] = pozo_sizes
+        self.kinds = kinds
+        self.offsets = np.concatenate(([0], np.cumsum(sizes)))
+        # Row of every event in ``log.players`` for 2v2 matches, pozo number for americanas.
+        self.rows = np.where(is_2v2, np.cumsum(is_2v2) - 1, np.cumsum(~is_2v2) - 1)
+
+        players = np.empty(self.offsets[-1], dtype=np.int64)
+        starts = self.offsets[:-1][is_2v2]
+        players[starts[:, np.newaxis] + np.arange(4)] = log.players
+        for pozo, event in enumerate(np.flatnonzero(~is_2v2).tolist()):
+            lo, hi = log.pozo_offsets[pozo], log.pozo_offsets[pozo + 1]
+            players[self.offsets[event]:self.offsets[event + 1]] = log.pozo_pairs[lo:hi].ravel()
+        self.players = players
+        self.old = np.empty(len(players), dtype=np.int64)
+        self.delta = np.empty(len(players), dtype=np.int64)
+
+        # Events of every player in log order: player_events[player_offsets[p]:player_offsets[p + 1]].
+        events = np.repeat(np.arange(len(kinds)), sizes)
+        order = np.lexsort((events, players))
+        self.player_events = events[order]
+        self.player_offsets = np.searchsorted(players[order], np.arange(len(store) + 1))
+
+        replay = Replay(store, params_2v2, params_american)
+        replay.listeners.append(self._record)
+        replay.run_log(log)
+
+    def _record(self, mode, event_ids, players, old_ratings, deltas, results):
+        if mode == "2v2":
+            positions = self.offsets[event_ids][:, np.newaxis] + np.arange(4)
+        else:
+            positions = self.offsets[event_ids[0]] + np.arange(players.size)
+        self.old[positions.ravel()] = old_ratings.ravel()
+        self.delta[positions.ravel()] = deltas.ravel()
+
+    def _next_event(self, player, event):
+        events = self.player_events[self.player_offsets[player]:self.player_offsets[player + 1]]
+        i = np.searchsorted(events, event, side="right")
+        return int(events[i]) if i < len(events) else None
+
+    def _results(self, event):
+        row = self.rows[event]
+        if self.kinds[event] == MATCH_2V2:
+            return self.log.scores[row].tolist()
+        lo, hi = self.log.pozo_offsets[row], self.log.pozo_offsets[row + 1]
+        return self.log.pozo_courts[lo:hi].tolist()
+
+    def _score(self, event, old, results):
+        if self.kinds[event] == MATCH_2V2:
+            team1, team2 = update_elo_2v2(old[:2], old[2:], results, **self.params_2v2)
+            return team1 + team2
+        pairs = list(zip(old[::2], old[1::2]))
+        return [d for pair in update_elo_american(pairs, results, **self.params_american) for d in pair]
+
+    def correct(self, event, result):
+        """
+        Replace the result of ``event`` and update every rating that depends on it.
+
+        Args:
+            event (int): Position of the event in the log.
+            result: ``(score1, score2)`` for a 2v2 match, or the ``[(pista_inicial, pista_final), ...]``
+                of every pair for an americana.
+
+        Returns:
+            Correction: Number of events scored again and the players whose final rating changed.
+        """
+        row = self.rows[event]
+        if self.kinds[event] == AMERICANA:
+            lo, hi = self.log.pozo_offsets[row], self.log.pozo_offsets[row + 1]
+            result = np.asarray(result, dtype=np.int64).reshape(-1, 2)
+            numpistas = self.params_american.get("numpistas", 6)
+            if len(result) != hi - lo or (result < 1).any() or (result > numpistas).any():
+                raise ValueError(f"An americana of {hi - lo} pairs needs one court between 1 and {numpistas} per pair")
+        else:
+            result = np.asarray(result, dtype=np.int64).reshape(2)
+        lo, hi = self.offsets[event], self.offsets[event + 1]
+        edited = self._score(event, self.old[lo:hi].tolist(), result.tolist())
+
+        if self.kinds[event] == AMERICANA:
+            self.log.pozo_courts[self.log.pozo_offsets[row]:self.log.pozo_offsets[row + 1]] = result
+        else:
+            self.log.scores[row] = result
+
+        # Rating of every affected player minus the one cached in the log, after the events done so far.
+        offset = {}
+        heap = [event]
+        queued = {event}
+        rescored = 0
+        while heap:
+            current = heapq.heappop(heap)
+            queued.discard(current)
+            lo, hi = self.offsets[current], self.offsets[current + 1]
+            players = self.players[lo:hi].tolist()
+            old = [o + offset.get(p, 0) for p, o in zip(players, self.old[lo:hi].tolist())]
+            deltas = edited if current == event else self._score(current, old, self._results(current))
+            rescored += 1
+
+            for p, cached, delta in zip(players, self.delta[lo:hi].tolist(), deltas):
+                shift = offset.get(p, 0) + delta - cached
+                if shift:
+                    offset[p] = shift
+                    following = self._next_event(p, current)
+                    if following is not None and following not in queued:
+                        queued.add(following)
+                        heapq.heappush(heap, following)
+                else:
+                    offset.pop(p, None)
+            self.old[lo:hi] = old
+            self.delta[lo:hi] = deltas
+
+        changed = np.array(sorted(offset), dtype=np.int64)
+        ratings = self.store._ratings
+        before = ratings[changed].astype(np.int64)
+        ratings[changed] += np.array([offset[p] for p in changed.tolist()], dtype=ratings.dtype)
+        return Correction(rescored, changed, before, ratings[changed].astype(np.int64))
+
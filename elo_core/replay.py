@@ -0,0 +1,460 @@
+"""Sequential replay of a match log onto a persistent table of player ratings.
+
+The scoring functions only return rating adjustments. ``Replay`` applies them,
+in log order, to a ``PlayerStore`` that keeps every rating in one contiguous
+int32 array indexed through a player-id map.
+"""
+import os
+from itertools import islice
+from pickle import dump, load
+from typing import NamedTuple
+
+import numpy as np
+
+from . import instrument
+from .batch import update_elo_2v2_batch, update_elo_american_batch
+from .scoring import update_elo_2v2, update_elo_american
+
+
+class PlayerStore:
+    """Ratings of every known player, stored in a contiguous int32 array."""
+
+    def __init__(self, default_rating=1000, capacity=1024):
+        self.default_rating = default_rating
+        self.ids = {}
+        self.player_ids = []
+        self._ratings = np.full(capacity, default_rating, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def __contains__(self, player_id):
+        return player_id in self.ids
+
+    def __getitem__(self, player_id):
+        return int(self._ratings[self.ids[player_id]])
+
+    def __setitem__(self, player_id, rating):
+        self._ratings[self.index(player_id)] = rating
+
+    @property
+    def ratings(self):
+        """View of the ratings of the known players, indexed like ``player_ids``."""
+        return self._ratings[:len(self.player_ids)]
+
+    def index(self, player_id):
+        """Return the index of a player, registering them with the default rating if new."""
+        idx = self.ids.get(player_id)
+        if idx is None:
+            idx = len(self.player_ids)
+            if idx == len(self._ratings):
+                grown = np.full(2 * idx, self.default_rating, dtype=np.int32)
+                grown[:idx] = self._ratings
+                self._ratings = grown
+            self.ids[player_id] = idx
+            self.player_ids.append(player_id)
+        return idx
+
+    def indices(self, player_ids):
+        """Return the indices of many players as an int64 array."""
+        return np.fromiter((self.index(p) for p in player_ids), dtype=np.int64)
+
+    def as_dict(self):
+        return dict(zip(self.player_ids, self.ratings.tolist()))
+
+
+class Snapshot(NamedTuple):
+    """State of a replay after ``events`` events of the log."""
+    events: int
+    default_rating: int
+    player_ids: list
+    ratings: np.ndarray
+
+
+def save_snapshot(snapshot, path):
+    """Write a snapshot to ``path``, replacing any previous file atomically."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        dump(snapshot, f)
+    os.replace(tmp, path)
+
+
+def load_snapshot(path):
+    with open(path, "rb") as f:
+        return load(f)
+
+
+MATCH_2V2 = 0
+AMERICANA = 1
+
+
+class MatchLog(NamedTuple):
+    """
+    A match log encoded as flat arrays of store indices.
+
+    ``kinds`` has one entry per event, ``MATCH_2V2`` or ``AMERICANA``. The 2v2 matches are
+    the rows of ``players`` (n, 4) and ``scores`` (n, 2) in log order. The pairs of the
+    i-th americana are ``pozo_pairs[pozo_offsets[i]:pozo_offsets[i + 1]]``, with their
+    initial and final courts in the same rows of ``pozo_courts``.
+    """
+    kinds: np.ndarray
+    players: np.ndarray
+    scores: np.ndarray
+    pozo_offsets: np.ndarray
+    pozo_pairs: np.ndarray
+    pozo_courts: np.ndarray
+
+
+def encode_log(events, store):
+    """Encode an iterable of events (see ``Replay``) as a ``MatchLog``, registering players in ``store``."""
+    index = store.index
+    kinds, players, scores = [], [], []
+    offsets, pairs, courts = [0], [], []
+    for event in events:
+        if event[0] == "2v2":
+            _, (p1, p2), (p3, p4), result = event
+            kinds.append(MATCH_2V2)
+            players.append((index(p1), index(p2), index(p3), index(p4)))
+            scores.append(tuple(result))
+        elif event[0] == "americana":
+            kinds.append(AMERICANA)
+            pairs.extend((index(a), index(b)) for a, b in event[1])
+            courts.extend(tuple(c) for c in event[2])
+            offsets.append(len(pairs))
+        else:
+            raise ValueError(f"Unknown event type: {event[0]!r}")
+    return MatchLog(
+        np.array(kinds, dtype=np.int8),
+        np.array(players, dtype=np.int64).reshape(-1, 4),
+        np.array(scores, dtype=np.int64).reshape(-1, 2),
+        np.array(offsets, dtype=np.int64),
+        np.array(pairs, dtype=np.int64).reshape(-1, 2),
+        np.array(courts, dtype=np.int64).reshape(-1, 2),
+    )
+
+
+# A batch call costs about as much as scoring 20 matches one by one, so smaller levels are
+# scored with the scalar functions, and a chunk whose levels are this small on average is
+# replayed match by match without scheduling it.
+_MIN_BATCH = 24
+_MIN_LEVEL = 8
+_MIN_AMERICANA_BATCH = 8
+
+
+def _slice_log(log, start, stop, prefix_2v2, prefix_pozos):
+    """Events ``start:stop`` of a log, given the number of 2v2 matches and pozos before every event."""
+    m0, m1 = prefix_2v2[start], prefix_2v2[stop]
+    p0, p1 = prefix_pozos[start], prefix_pozos[stop]
+    lo, hi = log.pozo_offsets[p0], log.pozo_offsets[p1]
+    return MatchLog(log.kinds[start:stop], log.players[m0:m1], log.scores[m0:m1],
+                    log.pozo_offsets[p0:p1 + 1] - lo, log.pozo_pairs[lo:hi], log.pozo_courts[lo:hi])
+
+
+def _levels(log, num_players):
+    """
+    Assign every event of ``log`` the earliest level after the previous events of its players.
+
+    Events in the same level share no player, so they can be scored together and
+    applied in any order without changing the result of the sequential replay.
+    """
+    last = [-1] * num_players
+    levels = []
+    players = iter(log.players.tolist())
+    pairs = log.pozo_pairs.ravel().tolist()
+    offsets = (2 * log.pozo_offsets).tolist()
+    pozo = 0
+    for kind in log.kinds.tolist():
+        if kind == MATCH_2V2:
+            a, b, c, d = next(players)
+            level = max(last[a], last[b], last[c], last[d]) + 1
+            last[a] = last[b] = last[c] = last[d] = level
+        else:
+            members = pairs[offsets[pozo]:offsets[pozo + 1]]
+            pozo += 1
+            level = max([last[p] for p in members]) + 1
+            for p in members:
+                last[p] = level
+        levels.append(level)
+    return np.array(levels, dtype=np.int64)
+
+
+class Replay:
+    """
+    Apply a chronologically ordered match log to a ``PlayerStore``.
+
+    The log is an iterable of events, either
+    ``("2v2", (p1, p2), (p3, p4), (score1, score2))`` or
+    ``("americana", [(p1, p2), ...], [(pista_inicial, pista_final), ...])``.
+    Consecutive 2v2 matches are buffered in arrays of ``chunk_size`` rows. Each chunk is split
+    in levels of matches that share no player, scored with ``update_elo_2v2_batch``, or one by
+    one when the levels are small. Americana events are scored with ``update_elo_american``,
+    and ``run_log`` schedules them in the levels too, batching the ones that share no player
+    with ``update_elo_american_batch``.
+
+    Args:
+        store (PlayerStore, optional): Ratings to update. A new store is created if omitted.
+        params_2v2 (dict, optional): Keyword arguments for ``update_elo_2v2``.
+        params_american (dict, optional): Arguments for ``update_elo_american``. Must include
+            multipistes, compensacio, compensacio2 and bonificacion.
+        chunk_size (int, optional): Number of events scheduled together. Defaults to 65536.
+
+    Callables appended to ``listeners`` are called after every scored batch with
+    ``(mode, event_ids, players, old_ratings, deltas, results)``. For ``"2v2"`` there is one
+    row per match: players, old ratings and deltas have shape (n, 4) and results (n, 2).
+    For ``"americana"`` there is one row per pair of the pozo, all with shape (pairs, 2)
+    and results holding the courts. Rows of different players may arrive out of log order,
+    but the rows of one player always arrive in log order.
+    """
+
+    def __init__(self, store=None, params_2v2=None, params_american=None, chunk_size=65536):
+        self.store = store if store is not None else PlayerStore()
+        self.params_2v2 = params_2v2 or {}
+        self.params_american = params_american
+        self.chunk_size = chunk_size
+        self.events = 0
+        self.listeners = []
+        self._players = np.empty((chunk_size, 4), dtype=np.int64)
+        self._results = np.empty((chunk_size, 2), dtype=np.int64)
+        self._pending = 0
+
+    @classmethod
+    def from_snapshot(cls, snapshot, **kwargs):
+        """Create a replay that continues from ``snapshot``."""
+        store = PlayerStore(snapshot.default_rating, capacity=max(len(snapshot.player_ids), 1024))
+        store.ids = {p: i for i, p in enumerate(snapshot.player_ids)}
+        store.player_ids = list(snapshot.player_ids)
+        store._ratings[:len(snapshot.ratings)] = snapshot.ratings
+        replay = cls(store, **kwargs)
+        replay.events = snapshot.events
+        return replay
+
+    def snapshot(self):
+        self.flush()
+        return Snapshot(self.events, self.store.default_rating, list(self.store.player_ids), self.store.ratings.copy())
+
+    def apply_2v2(self, players, results):
+        """
+        Score 2v2 matches given as arrays and apply them to the store.
+
+        Args:
+            players (array_like): Shape (n, 4) with the store indices of team 1 and team 2 players.
+            results (array_like): Shape (n, 2) with the scores of team 1 and team 2.
+        """
+        players = np.asarray(players, dtype=np.int64).reshape(-1, 4)
+        empty = np.empty((0, 2), dtype=np.int64)
+        self._apply_log(MatchLog(np.zeros(len(players), dtype=np.int8), players,
+                                 np.asarray(results).reshape(-1, 2), np.zeros(1, dtype=np.int64), empty, empty))
+
+    def apply_american(self, pairs, results):
+        """Score one americana and apply it to the store. ``pairs`` holds player ids."""
+        index = self.store.index
+        self.apply_american_indexed([(index(a), index(b)) for a, b in pairs], results)
+
+    def apply_american_indexed(self, pairs, results):
+        """Score one americana whose ``pairs`` hold store indices and apply it to the store."""
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        self._score_americanas([self.events], [pairs], [np.asarray(results).reshape(-1, 2)])
+        instrument.count("replay.events")
+        self.events += 1
+
+    def _score_2v2(self, events, players, results):
+        """Score matches that share no player and apply them."""
+        ratings = self.store._ratings
+        current = ratings[players]
+        if len(players) >= _MIN_BATCH:
+            delta1, delta2 = update_elo_2v2_batch(current[:, :2], current[:, 2:], results, **self.params_2v2)
+            deltas = np.hstack((delta1, delta2))
+        else:
+            deltas = np.array([team1 + team2 for team1, team2 in (
+                update_elo_2v2(c[:2], c[2:], r, **self.params_2v2)
+                for c, r in zip(current.tolist(), results.tolist()))], dtype=np.int64).reshape(-1, 4)
+        ratings[players] += deltas.astype(np.int32)
+        for listener in self.listeners:
+            listener("2v2", events, players, current, deltas, results)
+
+    def _score_americanas(self, events, pairs, courts):
+        """Score americanas that share no player and apply them, in one batch when there are enough."""
+        ratings = self.store._ratings
+        current = [ratings[p] for p in pairs]
+        if len(pairs) >= _MIN_AMERICANA_BATCH:
+            npairs = np.array([len(p) for p in pairs])
+            shape = (len(pairs), npairs.max(), 2)
+            padded_ratings = np.zeros(shape, dtype=np.int64)
+            padded_courts = np.ones(shape, dtype=np.int64)
+            for e, (r, c) in enumerate(zip(current, courts)):
+                padded_ratings[e, :len(r)] = r
+                padded_courts[e, :len(c)] = c
+            batch = update_elo_american_batch(padded_ratings, padded_courts, npairs=npairs, **self.params_american)
+            deltas = [batch[e, :n] for e, n in enumerate(npairs.tolist())]
+        else:
+            deltas = [np.array(update_elo_american(r.tolist(), c.tolist(), **self.params_american), dtype=np.int64)
+                      for r, c in zip(current, courts)]
+        for event, p, r, d, c in zip(events, pairs, current, deltas, courts):
+            ratings[p] += d.astype(np.int32)
+            for listener in self.listeners:
+                listener("americana", np.full(len(p), event), p, r, d, c)
+
+    def _replay_sequential(self, log):
+        """Score every event of ``log`` in order with the scalar functions."""
+        ratings = self.store._ratings
+        params_2v2, params_american = self.params_2v2, self.params_american
+        kinds = log.kinds.tolist()
+        players = log.players.tolist()
+        scores = log.scores.tolist()
+        offsets = log.pozo_offsets.tolist()
+        involved = np.unique(np.concatenate((log.players.ravel(), log.pozo_pairs.ravel())))
+        local = dict(zip(involved.tolist(), range(len(involved))))
+        current = ratings[involved].tolist()
+
+        matches, rows = [], []
+        row = pozo = 0
+        for position, kind in enumerate(kinds):
+            if kind == MATCH_2V2:
+                a, b, c, d = (local[p] for p in players[row])
+                old = [current[a], current[b], current[c], current[d]]
+                team1, team2 = update_elo_2v2(old[:2], old[2:], scores[row], **params_2v2)
+                current[a] += team1[0]
+                current[b] += team1[1]
+                current[c] += team2[0]
+                current[d] += team2[1]
+                rows.append(old + team1 + team2)
+                matches.append(position)
+                row += 1
+            else:
+                lo, hi = offsets[pozo], offsets[pozo + 1]
+                pozo += 1
+                pairs = [(local[a], local[b]) for a, b in log.pozo_pairs[lo:hi].tolist()]
+                old = [(current[a], current[b]) for a, b in pairs]
+                deltas = update_elo_american(old, log.pozo_courts[lo:hi].tolist(), **params_american)
+                for (a, b), (da, db) in zip(pairs, deltas):
+                    current[a] += da
+                    current[b] += db
+                if self.listeners:
+                    # Rows of earlier matches go first, so every player's rows arrive in log order.
+                    self._notify_2v2(log, matches, rows, row)
+                    matches, rows = [], []
+                    for listener in self.listeners:
+                        listener("americana", np.full(hi - lo, self.events + position), log.pozo_pairs[lo:hi],
+                                 np.array(old, dtype=np.int64), np.array(deltas, dtype=np.int64), log.pozo_courts[lo:hi])
+        ratings[involved] = current
+        if self.listeners:
+            self._notify_2v2(log, matches, rows, row)
+
+    def _notify_2v2(self, log, matches, rows, end):
+        """Send the listeners the last ``len(rows)`` matches before row ``end`` of ``log``."""
+        if not matches:
+            return
+        start = end - len(rows)
+        values = np.array(rows, dtype=np.int64)
+        for listener in self.listeners:
+            listener("2v2", self.events + np.array(matches, dtype=np.int64), log.players[start:end],
+                     values[:, :4], values[:, 4:], log.scores[start:end])
+
+    def _apply_log(self, log):
+        """Score a ``MatchLog`` of store indices, level by level or, when levels are tiny, in order."""
+        kinds = np.asarray(log.kinds)
+        n = len(kinds)
+        if not n:
+            return
+        participants = np.concatenate((log.players.ravel(), log.pozo_pairs.ravel()))
+        # There are at least as many levels as events of the busiest player, and with
+        # random pairings a few times more, so skip the scheduling when it cannot pay off.
+        busiest = np.bincount(participants).max()
+        levels = None
+        if n / busiest >= 4 * _MIN_LEVEL:
+            with instrument.stage("replay.schedule"):
+                levels = _levels(log, len(self.store))
+                order = np.argsort(levels, kind="stable")
+                bounds = np.flatnonzero(np.diff(levels[order])) + 1
+        if levels is None or n / (len(bounds) + 1) < _MIN_LEVEL:
+            with instrument.stage("replay.score"):
+                self._replay_sequential(log)
+            instrument.count("replay.events", n)
+            self.events += n
+            return
+
+        is_2v2 = kinds == MATCH_2V2
+        rows = np.cumsum(is_2v2) - 1
+        pozos = np.cumsum(~is_2v2) - 1
+        with instrument.stage("replay.score"):
+            for idx in np.split(order, bounds):
+                matches = idx[is_2v2[idx]]
+                if len(matches):
+                    r = rows[matches]
+                    self._score_2v2(self.events + matches, log.players[r], log.scores[r])
+                americanas = idx[~is_2v2[idx]].tolist()
+                if americanas:
+                    spans = [(log.pozo_offsets[pozos[e]], log.pozo_offsets[pozos[e] + 1]) for e in americanas]
+                    self._score_americanas([self.events + e for e in americanas],
+                                           [log.pozo_pairs[lo:hi] for lo, hi in spans],
+                                           [log.pozo_courts[lo:hi] for lo, hi in spans])
+
+        instrument.count("replay.events", n)
+        instrument.count("replay.levels", len(bounds) + 1)
+        self.events += n
+
+    def flush(self):
+        """Score the buffered 2v2 matches."""
+        if self._pending:
+            n, self._pending = self._pending, 0
+            self.apply_2v2(self._players[:n], self._results[:n])
+
+    def run(self, events, checkpoint_every=None, checkpoint=None):
+        """
+        Apply every event of ``events`` to the store.
+
+        Args:
+            events (iterable): Events in chronological order, see the class docstring.
+            checkpoint_every (int, optional): Save a snapshot every this many events.
+            checkpoint (str, optional): Path of the snapshot file.
+
+        Returns:
+            PlayerStore: The updated store.
+        """
+        index = self.store.index
+        next_checkpoint = self.events + checkpoint_every if checkpoint_every else None
+        for event in events:
+            if event[0] == "2v2":
+                _, (p1, p2), (p3, p4), result = event
+                row = self._pending
+                self._players[row] = (index(p1), index(p2), index(p3), index(p4))
+                self._results[row] = result
+                self._pending += 1
+                if self._pending == self.chunk_size:
+                    self.flush()
+            elif event[0] == "americana":
+                self.flush()
+                self.apply_american(event[1], event[2])
+            else:
+                raise ValueError(f"Unknown event type: {event[0]!r}")
+
+            if next_checkpoint is not None and self.events + self._pending >= next_checkpoint:
+                save_snapshot(self.snapshot(), checkpoint)
+                next_checkpoint += checkpoint_every
+
+        self.flush()
+        return self.store
+
+    def run_log(self, log):
+        """
+        Apply an encoded ``MatchLog`` to the store, without building per-event objects.
+
+        The log's player indices must refer to this replay's store. Events are scheduled in
+        chunks of ``chunk_size``: 2v2 matches and americanas that share no player are scored
+        together with the batch engines.
+
+        Returns:
+            PlayerStore: The updated store.
+        """
+        self.flush()
+        kinds = np.asarray(log.kinds)
+        prefix_2v2 = np.concatenate(([0], np.cumsum(kinds == MATCH_2V2)))
+        prefix_pozos = np.concatenate(([0], np.cumsum(kinds == AMERICANA)))
+        for start in range(0, len(kinds), self.chunk_size):
+            stop = min(start + self.chunk_size, len(kinds))
+            self._apply_log(_slice_log(log, start, stop, prefix_2v2, prefix_pozos))
+        return self.store
+
+    def resume(self, events, **kwargs):
+        """Run the full log ``events``, skipping the events already applied."""
+        return self.run(islice(events, self.events, None), **kwargs)
@@ -0,0 +1,160 @@
+from time import perf_counter
+
+from . import instrument
+from .kernel import expected_score
+
+def update_elo_2v2(team1_ratings, team2_ratings, result, k=32, ratio=400, base=50, factoravg = 0.5):
+    """
+    Calculate new Elo ratings for two teams based on the outcome of a match.
+
+    Args:
+        team1_ratings (list): List of integers representing the Elo ratings of the first team's players.
+        team2_ratings (list): List of integers representing the Elo ratings of the second team's players.
+        result (list): List of two integers representing the scores of team 1 and team 2, respectively.
+        k (int, optional): The maximum possible adjustment per player per game. Defaults to 32.
+        ratio (int, optional): Used to scale the difference in ratings. Defaults to 400.
+        base (int, optional): A base adjustment factor that can be modified based on the rating difference. Defaults to 50.
+
+    Returns:
+        tuple: Two lists containing the new Elo ratings for the players of team 1 and team 2 respectively.
+    """
+    start = perf_counter() if instrument.enabled else None
+    team1_avg = sum(team1_ratings) / len(team1_ratings)
+    team2_avg = sum(team2_ratings) / len(team2_ratings)
+    
+    # if (result[0] == 0): result[0] = 1
+    # if (result[1] == 0): result[1] = 1
+    
+    # game_result = (result[0] / sum(result))*0.8 + 0.1
+    game_result = (result[0] / sum(result))*0.9+ 0.05
+    # game_result = result[0] / sum(result)
+        
+    rating_diff = abs(team1_avg - team2_avg)
+    
+    if result[0] > result[1]:
+        team1_factor, team2_factor = 1, -1
+    else:
+        team1_factor, team2_factor = -1, 1
+    
+    if rating_diff > 1000:
+        base -= 15
+    elif rating_diff > 700:
+        base -= 10
+    elif rating_diff > 400:
+        base -= 5
+    
+    def calculate_new_rating(rating, opponent_avg, game_result, factor):
+        P = expected_score(opponent_avg - rating, ratio)
+        return int(round(factor * base + k * (game_result - P)))
+    
+    team1_new_ratings = []
+    for i in range(len(team1_ratings)):
+        if i == 0:
+            weightedavg = team1_ratings[i] * factoravg + team1_ratings[i+1] * (1-factoravg)
+        else:
+            weightedavg = team1_ratings[i] * factoravg + team1_ratings[i-1] * (1-factoravg)
+
+        new_rating = calculate_new_rating(weightedavg, team2_avg, game_result, team1_factor)
+        team1_new_ratings.append(new_rating)
+    
+    team2_new_ratings = []
+    for i in range(len(team2_ratings)):
+        if i == 0:
+            weightedavg = team2_ratings[i] * factoravg + team2_ratings[i+1] * (1-factoravg)
+        else:
+            weightedavg = team2_ratings[i] * factoravg + team2_ratings[i-1] * (1-factoravg)
+        new_rating = calculate_new_rating(weightedavg, team1_avg, 1 - game_result, team2_factor)
+        team2_new_ratings.append(new_rating)
+    
+    if start is not None:
+        instrument.observe("scoring.update_elo_2v2", perf_counter() - start)
+    return team1_new_ratings, team2_new_ratings
+   
+def american_pair_adjustment(pareja, avg, pistainicial, pistafinal, multipistes, compensacio, compensacio2,
+                             bonificacion, k=20, ratio=800, numpistas=6, base=10, factoravg=0.5):
+    """
+    Calculate the adjustments of one pair of an americana sube-baja.
+
+    Args:
+        pareja (tuple): Ratings of the two players of the pair.
+        avg (float): Average rating of every player of the pozo.
+        pistainicial, pistafinal (int): Court the pair started and finished on.
+        multipistes, compensacio, compensacio2, bonificacion, k, ratio, numpistas, base, factoravg:
+            Same meaning as in ``update_elo_american``.
+
+    Returns:
+        tuple: The adjustments of the first and the second player.
+    """
+    gained = pistainicial - pistafinal
+    gainedfactor = 0
+    
+    if (gained != 0):
+        gainedfactor = abs(gained) - 1
+        
+    factor = (1 + gainedfactor * (multipistes/100))
+    if (gained < 0):
+        factor *= -1
+    
+    
+    americana_result = (gained / numpistas)/2+0.5
+    
+    preajuste = 0
+    if ((pistainicial == 1 or pistainicial == 2) and pistafinal == 1):
+        preajuste = compensacio
+    elif ((pistainicial == numpistas - 1 or pistainicial == numpistas) and pistafinal == numpistas):
+        preajuste = -compensacio
+    
+    
+    
+    new_ratings_pareja = []
+    
+    for j in range(len(pareja)):
+        if j == 0:
+            weightedavg = pareja[j] * factoravg + pareja[j+1] * (1-factoravg)
+        else:
+            weightedavg = pareja[j] * factoravg + pareja[j-1] * (1-factoravg)
+
+
+        P = expected_score(avg - weightedavg, ratio)
+        new_elo = int(round(factor * base + k * (americana_result - P)))
+
+
+        ajuste = preajuste
+        diff = weightedavg - avg
+
+        if compensacio2 != 0:
+            if pistafinal == numpistas:
+                ajuste -= compensacio2 * (1+(abs(diff)//200)/10 if diff > 0 else 1)
+            elif pistafinal == numpistas - 1:
+                ajuste -= compensacio2*0.5
+            elif pistafinal == 1:
+                ajuste += bonificacion * (1+(abs(diff)//200)/10 if diff < 0 else 1)
+            elif pistafinal == 2:
+                ajuste += bonificacion*0.5
+
+
+        new_elo += round(ajuste)
+        new_ratings_pareja.append(new_elo)
+        
+    return (new_ratings_pareja[0],new_ratings_pareja[1])
+
+
+def update_elo_american(ratings, results, multipistes, compensacio, compensacio2, bonificacion, k=20, ratio = 800,numpistas = 6, base = 10, factoravg = 0.5):
+    # Calcula los nuevos puntajes Elo de los jugadores
+    start = perf_counter() if instrument.enabled else None
+    if len(ratings) != len(results):
+        raise ValueError(f"{len(ratings)} pairs but {len(results)} results")
+    new_ratings = []
+    avg = 0
+    for pareja in ratings: 
+        avg += pareja[0] + pareja[1]
+    avg = avg / (len(ratings)*2)
+    
+    for pareja, result in zip(ratings, results):
+        new_ratings.append(american_pair_adjustment(pareja, avg, result[0], result[1], multipistes, compensacio,
+                                                    compensacio2, bonificacion, k, ratio, numpistas, base, factoravg))
+
+
+    if start is not None:
+        instrument.observe("scoring.update_elo_american", perf_counter() - start)
+    return new_ratings
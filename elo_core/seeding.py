@@ -0,0 +1,166 @@
+"""Seeding of pozos and 2v2 matches from a pool of sign-ups.
+
+Players are sorted by rating once, and every step after that works on
+consecutive slices of the sorted order, so seeding is O(n log n) and fully
+vectorized: no pair of players is ever compared with every other.
+
+- ``seed_pozos`` cuts the sorted players into pozos of similar level, forms the
+  pairs of each pozo and gives them their starting courts.
+- ``assign_courts`` gives starting courts to pairs that are already formed.
+- ``seed_matches`` groups the sorted players four by four into 2v2 matches and
+  picks the most even split of each group into two teams.
+
+Balance is measured with the same expected score and ``factoravg`` partner
+weighting as ``update_elo_2v2`` and ``update_elo_american``.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+from .batch import _weighted_pair, expected_score_batch
+from .sweep import DEFAULTS_2V2, DEFAULTS_AMERICAN
+
+
+class PozoSeeding(NamedTuple):
+    """
+    Seeded pozos, strongest first.
+
+    ``players`` has shape (pozos, pairs, 2) with indices into the sign-up ratings, ``courts``
+    shape (pozos, pairs) with the starting court of every pair, and ``expected`` shape
+    (pozos, numpistas) with the expected score of the stronger pair on every court.
+    ``waiting`` holds the players left over when they do not fill a whole pozo.
+    """
+    players: np.ndarray
+    courts: np.ndarray
+    expected: np.ndarray
+    waiting: np.ndarray
+
+
+class MatchSeeding(NamedTuple):
+    """
+    Seeded 2v2 matches, strongest first.
+
+    ``players`` has shape (matches, 4): team 1 then team 2, as indices into the sign-up
+    ratings. ``expected`` is the expected score of team 1. ``waiting`` holds the players
+    left over when their number is not a multiple of four.
+    """
+    players: np.ndarray
+    expected: np.ndarray
+    waiting: np.ndarray
+
+
+def _pair_strength(pair_ratings, factoravg):
+    """Mean partner-weighted rating of every pair, the rating ``update_elo_american`` scores it with."""
+    return _weighted_pair(pair_ratings.astype(np.float64), factoravg).mean(axis=-1)
+
+
+def assign_courts(ratings, numpistas=6, ratio=DEFAULTS_AMERICAN["ratio"], factoravg=DEFAULTS_AMERICAN["factoravg"]):
+    """
+    Give starting courts to formed pairs: the strongest pairs on court 1, and pairs of
+    neighbouring strength sharing a court so every match is as even as possible.
+
+    Args:
+        ratings (array_like): Shape (pairs, 2), or (pozos, pairs, 2) for many pozos.
+        numpistas (int, optional): Number of courts. Defaults to 6.
+        ratio (int, optional): Ratio of the expected score. Defaults to the page3 slider.
+        factoravg (float, optional): Partner weighting. Defaults to the page3 slider.
+
+    Returns:
+        tuple: The courts, shape (pairs,) or (pozos, pairs), and the expected score of the
+        stronger pair on every court, shape (numpistas,) or (pozos, numpistas).
+    """
+    ratings = np.asarray(ratings)
+    single = ratings.ndim == 2
+    if single:
+        ratings = ratings[np.newaxis]
+    pozos, pairs, _ = ratings.shape
+    strength = _pair_strength(ratings, factoravg)
+    # Ties keep the sign-up order, so the same pozo is always seeded the same way.
+    order = np.argsort(-strength, axis=1, kind="stable")
+    pairs_per_court = -(-pairs // numpistas)
+    court_of_rank = np.minimum(np.arange(pairs) // pairs_per_court + 1, numpistas)
+    courts = np.empty((pozos, pairs), dtype=np.int64)
+    np.put_along_axis(courts, order, court_of_rank, axis=1)
+
+    ranked = np.take_along_axis(strength, order, axis=1)
+    expected = np.full((pozos, numpistas), np.nan)
+    firsts = np.arange(0, pairs, pairs_per_court)[:numpistas]
+    has_rival = firsts + 1 < pairs
+    used = firsts[has_rival]
+    expected[:, :len(used)] = expected_score_batch(ranked[:, used + 1] - ranked[:, used], ratio)
+    if single:
+        return courts[0], expected[0]
+    return courts, expected
+
+
+def seed_pozos(ratings, numpistas=6, ratio=DEFAULTS_AMERICAN["ratio"], factoravg=DEFAULTS_AMERICAN["factoravg"],
+               pairing="balanced"):
+    """
+    Split sign-ups into pozos of ``4 * numpistas`` players of similar level, form the pairs of
+    each pozo and assign their starting courts.
+
+    Args:
+        ratings (array_like): Shape (players,) with the rating of every sign-up.
+        numpistas (int, optional): Courts per pozo. Defaults to 6.
+        ratio, factoravg: See ``assign_courts``.
+        pairing (str, optional): "balanced" pairs the best player of a pozo with the worst,
+            the second with the second worst and so on, so all pairs are close in strength.
+            "level" pairs players of neighbouring rating. Defaults to "balanced".
+
+    Returns:
+        PozoSeeding: The pozos, strongest first.
+    """
+    if pairing not in ("balanced", "level"):
+        raise ValueError(f"pairing must be 'balanced' or 'level', not {pairing!r}")
+    ratings = np.asarray(ratings)
+    size = 4 * numpistas
+    order = np.argsort(-ratings, kind="stable")
+    pozos = len(order) // size
+    seated = order[:pozos * size].reshape(pozos, size)
+
+    if pairing == "balanced":
+        players = np.stack((seated[:, :size // 2], seated[:, size - 1:size // 2 - 1:-1]), axis=-1)
+    else:
+        players = seated.reshape(pozos, size // 2, 2)
+    courts, expected = assign_courts(ratings[players].reshape(pozos, size // 2, 2), numpistas, ratio, factoravg)
+    return PozoSeeding(players, courts, expected, order[pozos * size:])
+
+
+# The three ways of splitting four players sorted by rating into two teams.
+_SPLITS = np.array([[0, 3, 1, 2], [0, 2, 1, 3], [0, 1, 2, 3]])
+
+
+def seed_matches(ratings, ratio=DEFAULTS_2V2["ratio"], factoravg=DEFAULTS_2V2["factoravg"]):
+    """
+    Group sign-ups into 2v2 matches of four players of neighbouring rating.
+
+    Each group is split into the two teams that bring the expected score of every player,
+    as computed by ``update_elo_2v2``, closest to 0.5.
+
+    Args:
+        ratings (array_like): Shape (players,) with the rating of every sign-up.
+        ratio (int, optional): Ratio of the expected score. Defaults to the "Partido Normal" slider.
+        factoravg (float, optional): Partner weighting. Defaults to the "Partido Normal" slider.
+
+    Returns:
+        MatchSeeding: The matches, strongest first.
+    """
+    ratings = np.asarray(ratings)
+    order = np.argsort(-ratings, kind="stable")
+    matches = len(order) // 4
+    groups = order[:matches * 4].reshape(matches, 4)
+
+    candidates = groups[:, _SPLITS]
+    r = ratings[candidates].astype(np.float64)
+    team1, team2 = r[..., :2], r[..., 2:]
+    team1_avg = team1.mean(axis=-1, keepdims=True)
+    team2_avg = team2.mean(axis=-1, keepdims=True)
+    P1 = expected_score_batch(team2_avg - _weighted_pair(team1, factoravg), ratio)
+    P2 = expected_score_batch(team1_avg - _weighted_pair(team2, factoravg), ratio)
+    imbalance = np.maximum(np.abs(P1 - 0.5).max(axis=-1), np.abs(P2 - 0.5).max(axis=-1))
+    best = imbalance.argmin(axis=1)
+
+    rows = np.arange(matches)
+    players = candidates[rows, best]
+    expected = expected_score_batch(team2_avg[rows, best, 0] - team1_avg[rows, best, 0], ratio)
+    return MatchSeeding(players, expected, order[matches * 4:])
@@ -0,0 +1,368 @@
+"""Asyncio HTTP service scoring 2v2 matches and americana pozos.
+
+Usage: python -m elo_core.service [--host 127.0.0.1] [--port 8080] [--max-batch 256] [--max-delay 0.002]
+
+Endpoints, all JSON::
+
+    POST /score/2v2        {"team1": [1000, 1100], "team2": [1200, 900], "result": "7-5", "params": {...}}
+                        -> {"team1": [12, 10], "team2": [-12, -9]}
+    POST /score/americana  {"ratings": [[1000, 1100], ...], "courts": [[3, 1], ...], "params": {...}}
+                        -> {"deltas": [[25, 23], ...]}
+    GET  /health        -> {"status": "ok", "pending": 0}
+
+``params`` is optional and overrides the slider defaults of ``sweep``. Concurrent
+requests are queued and scored together: a batch is flushed when it reaches
+``max_batch`` requests or ``max_delay`` seconds after its first one, with one call
+to ``update_elo_2v2_batch`` or ``update_elo_american_batch``. If that call fails,
+the requests of the batch are scored one by one, so only the bad ones get a 500. Connections are kept
+alive as in HTTP/1.1. When ``max_pending`` requests are waiting, the handlers stop
+reading from their sockets until the queue drains, so clients are slowed down by
+TCP instead of the server buffering without limit.
+"""
+import argparse
+import asyncio
+import json
+import math
+
+import numpy as np
+
+from . import instrument
+from .batch import update_elo_2v2_batch, update_elo_american_batch
+from .ingest import IngestError, parse_score
+from .sweep import DEFAULTS_2V2, DEFAULTS_AMERICAN
+
+PARAMS_2V2 = ("k", "ratio", "base", "factoravg")
+PARAMS_AMERICAN = ("multipistes", "compensacio", "compensacio2", "bonificacion",
+                   "k", "ratio", "numpistas", "base", "factoravg")
+
+MAX_HEADER = 16 * 1024
+MAX_BODY = 1024 * 1024
+MAX_RATING = 100_000
+MAX_NUMPISTAS = 256
+MAX_PAIRS = 2 * MAX_NUMPISTAS
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent requests into batches scored by one function call.
+
+    Args:
+        score (callable): Takes a list of items and returns one result per item.
+        max_batch (int, optional): Largest batch. Defaults to 256.
+        max_delay (float, optional): Seconds a batch waits for more items after its first one. Defaults to 0.002.
+        max_pending (int, optional): Items that can wait in the queue before ``submit`` blocks. Defaults to 4096.
+    """
+
+    def __init__(self, score, max_batch=256, max_delay=0.002, max_pending=4096):
+        self.score = score
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue(max_pending)
+        self.batches = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, item):
+        """Queue an item, waiting while the queue is full, and return its result."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            items = [item for item, _ in batch]
+            try:
+                with instrument.stage("service.flush"):
+                    results = self.score(items)
+            except Exception:
+                # Score the items one by one, so a bad item only fails its own request.
+                for item, future in batch:
+                    try:
+                        result = self.score([item])[0]
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            self.batches += 1
+            instrument.count("service.batches")
+            # Let the handlers write their responses before the next batch is collected.
+            await asyncio.sleep(0)
+
+
+def _rating(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise IngestError(f"ratings must be integers, not {value!r}")
+    if not -MAX_RATING <= value <= MAX_RATING:
+        raise IngestError(f"ratings must be between {-MAX_RATING} and {MAX_RATING}")
+    return value
+
+
+def _finite(value):
+    try:
+        return math.isfinite(value)
+    except OverflowError:
+        # An integer too large for a float.
+        return False
+
+
+def _court(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise IngestError(f"courts must be integers, not {value!r}")
+    return value
+
+
+def _params(body, names, defaults):
+    params = body.get("params") or {}
+    if not isinstance(params, dict):
+        raise IngestError("params must be an object")
+    unknown = set(params) - set(names)
+    if unknown:
+        raise IngestError(f"unknown params: {', '.join(sorted(unknown))}")
+    values = []
+    for name in names:
+        value = params.get(name, defaults[name])
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not _finite(value):
+            raise IngestError(f"param {name} must be a finite number")
+        values.append(value)
+    return tuple(values)
+
+
+def parse_2v2(body):
+    """Validate a /score/2v2 request body and return it as a batch item."""
+    try:
+        team1 = tuple(_rating(r) for r in body["team1"])
+        team2 = tuple(_rating(r) for r in body["team2"])
+        result = parse_score(body["result"])
+    except (KeyError, TypeError):
+        raise IngestError("team1, team2 and result are required") from None
+    if len(team1) != 2 or len(team2) != 2:
+        raise IngestError("a 2v2 match needs two ratings per team")
+    params = _params(body, PARAMS_2V2, DEFAULTS_2V2)
+    if params[1] == 0:
+        raise IngestError("ratio cannot be 0")
+    return team1, team2, result, params
+
+
+def parse_americana(body):
+    """Validate a /score/americana request body and return it as a batch item."""
+    params = _params(body, PARAMS_AMERICAN, DEFAULTS_AMERICAN)
+    numpistas = params[6]
+    if numpistas != int(numpistas) or not 1 <= numpistas <= MAX_NUMPISTAS or params[5] == 0:
+        raise IngestError(f"numpistas must be an integer between 1 and {MAX_NUMPISTAS} and ratio cannot be 0")
+    try:
+        ratings = [(_rating(a), _rating(b)) for a, b in body["ratings"]]
+        courts = [(_court(ini), _court(fin)) for ini, fin in body["courts"]]
+    except IngestError:
+        raise
+    except (KeyError, TypeError, ValueError):
+        raise IngestError("ratings and courts must be lists of pairs") from None
+    if len(ratings) < 2 or len(ratings) != len(courts):
+        raise IngestError("an americana needs at least two pairs and one (initial, final) court per pair")
+    if len(ratings) > MAX_PAIRS:
+        raise IngestError(f"an americana has at most {MAX_PAIRS} pairs")
+    if any(not (1 <= c <= numpistas) for court in courts for c in court):
+        raise IngestError(f"courts must be between 1 and {int(numpistas)}")
+    return ratings, courts, params
+
+
+def score_2v2(items):
+    """Score a batch of /score/2v2 items with one ``update_elo_2v2_batch`` call."""
+    team1, team2, results, params = zip(*items)
+    k, ratio, base, factoravg = np.array(params, dtype=np.float64).T
+    delta1, delta2 = update_elo_2v2_batch(team1, team2, results, k=k, ratio=ratio, base=base, factoravg=factoravg)
+    return [{"team1": a, "team2": b} for a, b in zip(delta1.tolist(), delta2.tolist())]
+
+
+def score_americana(items):
+    """Score a batch of /score/americana items with one ``update_elo_american_batch`` call."""
+    npairs = [len(ratings) for ratings, _, _ in items]
+    shape = (len(items), max(npairs), 2)
+    ratings = np.zeros(shape, dtype=np.int64)
+    courts = np.ones(shape, dtype=np.int64)
+    for e, (r, c, _) in enumerate(items):
+        ratings[e, :len(r)] = r
+        courts[e, :len(c)] = c
+    params = dict(zip(PARAMS_AMERICAN, np.array([p for _, _, p in items], dtype=np.float64).T))
+    params["numpistas"] = params["numpistas"].astype(np.int64)
+    deltas = update_elo_american_batch(ratings, courts, npairs=np.array(npairs), **params).tolist()
+    return [{"deltas": d[:n]} for d, n in zip(deltas, npairs)]
+
+
+class ScoringService:
+    """
+    The HTTP server and one ``MicroBatcher`` per scoring endpoint.
+
+    Args:
+        max_batch, max_delay, max_pending: Passed to both batchers.
+        keep_alive_timeout (float, optional): Seconds an idle connection is kept open. Defaults to 30.
+    """
+
+    def __init__(self, max_batch=256, max_delay=0.002, max_pending=4096, keep_alive_timeout=30.0):
+        self.batchers = {
+            "/score/2v2": (parse_2v2, MicroBatcher(score_2v2, max_batch, max_delay, max_pending)),
+            "/score/americana": (parse_americana, MicroBatcher(score_americana, max_batch, max_delay, max_pending)),
+        }
+        self.keep_alive_timeout = keep_alive_timeout
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=8080):
+        for _, batcher in self.batchers.values():
+            batcher.start()
+        self.server = await asyncio.start_server(self._handle, host, port, limit=MAX_HEADER)
+        return self.server
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for _, batcher in self.batchers.values():
+            await batcher.stop()
+
+    async def serve_forever(self, host="127.0.0.1", port=8080):
+        server = await self.start(host, port)
+        try:
+            await server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def dispatch(self, method, path, body):
+        """Return the status and JSON payload of one request."""
+        if path == "/health":
+            pending = sum(batcher.queue.qsize() for _, batcher in self.batchers.values())
+            return 200, {"status": "ok", "pending": pending}
+        route = self.batchers.get(path)
+        if route is None:
+            return 404, {"error": f"unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        parse, batcher = route
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                raise IngestError("the body must be a JSON object")
+            item = parse(data)
+        except (IngestError, ValueError, OverflowError) as e:
+            return 400, {"error": str(e)}
+        instrument.count("service.requests")
+        try:
+            return 200, await batcher.submit(item)
+        except Exception as e:
+            return 500, {"error": repr(e)}
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keep_alive_timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    _respond(writer, 431, {"error": "headers too large"}, False)
+                    break
+
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                    headers = {}
+                    for line in lines[1:]:
+                        if line:
+                            name, _, value = line.partition(":")
+                            headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    _respond(writer, 400, {"error": "malformed request"}, False)
+                    break
+                if length < 0:
+                    _respond(writer, 400, {"error": "invalid content-length"}, False)
+                    break
+                if length > MAX_BODY:
+                    _respond(writer, 413, {"error": f"bodies are limited to {MAX_BODY} bytes"}, False)
+                    break
+                try:
+                    body = await reader.readexactly(length) if length else b""
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                status, payload = await self.dispatch(method, target.split("?", 1)[0], body)
+                _respond(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def _respond(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode()
+    writer.write(
+        f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--max-delay", type=float, default=0.002, help="seconds")
+    parser.add_argument("--max-pending", type=int, default=4096)
+    args = parser.parse_args()
+
+    service = ScoringService(args.max_batch, args.max_delay, args.max_pending)
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
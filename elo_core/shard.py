@@ -0,0 +1,278 @@
+"""Sharded replay of a match log across worker processes.
+
+Players are partitioned by the connected components of the match graph (players
+joined by playing in the same event), found by a vectorized union-find (hooking
+and pointer jumping) over the participants of every event. Components are packed into as many shards as workers, balancing
+the number of ratings each one updates. Every shard replays its own events on a
+process pool with the usual ``Replay``, reading and writing its players' ratings
+in a shared memory array. Shards never share players, so they can run at the
+same time without changing any result.
+
+Events whose players end up in different shards (when ``max_component`` splits a
+large component, or with a plan built on an older log) are cross-shard events.
+The log is cut at them: every shard first replays its events up to the cut, then
+the cross-shard event is scored in the parent process, and so on in log order,
+so the final ratings are exactly those of a sequential replay.
+"""
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+import numpy as np
+
+from .replay import AMERICANA, MATCH_2V2, MatchLog, PlayerStore, Replay, _slice_log
+from .scoring import update_elo_2v2, update_elo_american
+
+
+class ShardPlan(NamedTuple):
+    """
+    Assignment of players and events to shards.
+
+    ``player_shard`` has the shard of every player (-1 for players without events), and
+    ``event_shard`` the shard of every event of the log, -1 for cross-shard events.
+    """
+    shards: int
+    player_shard: np.ndarray
+    event_shard: np.ndarray
+
+
+def _participants(log):
+    """Return the flat participants of every event and the offsets of each event in them."""
+    kinds = np.asarray(log.kinds)
+    is_2v2 = kinds == MATCH_2V2
+    sizes = np.empty(len(kinds), dtype=np.int64)
+    sizes[is_2v2] = 4
+    sizes[~is_2v2] = 2 * np.diff(log.pozo_offsets)
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    players = np.empty(offsets[-1], dtype=np.int64)
+    players[offsets[:-1][is_2v2][:, np.newaxis] + np.arange(4)] = log.players
+    for pozo, event in enumerate(np.flatnonzero(~is_2v2).tolist()):
+        lo, hi = log.pozo_offsets[pozo], log.pozo_offsets[pozo + 1]
+        players[offsets[event]:offsets[event + 1]] = log.pozo_pairs[lo:hi].ravel()
+    return players, offsets
+
+
+def _components(players, offsets, num_players):
+    """Label every player with the smallest index of its component, by hooking and pointer jumping."""
+    first = np.repeat(players[offsets[:-1]], np.diff(offsets))
+    labels = np.arange(num_players)
+    while True:
+        lu, lv = labels[first], labels[players]
+        low = np.minimum(lu, lv)
+        hooked = labels.copy()
+        np.minimum.at(hooked, lu, low)
+        np.minimum.at(hooked, lv, low)
+        while True:
+            jumped = hooked[hooked]
+            if (jumped == hooked).all():
+                break
+            hooked = jumped
+        if (hooked == labels).all():
+            return labels
+        labels = hooked
+
+
+def _capped_components(players, offsets, num_players, max_component):
+    """Union-find in log order that skips the unions making a component play more than ``max_component`` events."""
+    parent = list(range(num_players))
+    events = [0] * num_players
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    flat = players.tolist()
+    bounds = offsets.tolist()
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        roots = {find(p) for p in flat[lo:hi]}
+        total = sum(events[r] for r in roots) + 1
+        if len(roots) > 1 and total > max_component:
+            continue
+        root = min(roots)
+        for r in roots:
+            parent[r] = root
+        events[root] = total
+    return np.array([find(p) for p in range(num_players)], dtype=np.int64)
+
+
+def plan_shards(log, num_players, shards, max_component=None):
+    """
+    Partition the players and events of a log into ``shards`` shards.
+
+    Args:
+        log (MatchLog): Encoded log.
+        num_players (int): Number of players of the store the log was encoded with.
+        shards (int): Number of shards, usually the number of workers.
+        max_component (int, optional): Largest number of events a component may have. Unions
+            past it are skipped, which splits giant components at the cost of cross-shard events.
+
+    Returns:
+        ShardPlan: The plan. Components are assigned largest first to the least loaded shard,
+        so the plan only depends on the log.
+    """
+    players, offsets = _participants(log)
+    if max_component is None:
+        labels = _components(players, offsets, num_players)
+    else:
+        labels = _capped_components(players, offsets, num_players, max_component)
+
+    load = np.bincount(labels[players], minlength=num_players)
+    components = np.flatnonzero(load)
+    components = components[np.lexsort((components, -load[components]))]
+    shard_of_component = np.full(num_players, -1, dtype=np.int64)
+    heap = [(0, s) for s in range(shards)]
+    for component in components.tolist():
+        total, s = heapq.heappop(heap)
+        shard_of_component[component] = s
+        heapq.heappush(heap, (total + int(load[component]), s))
+
+    player_shard = shard_of_component[labels]
+    player_shard[np.bincount(players, minlength=num_players) == 0] = -1
+    event_players = player_shard[players]
+    lo = np.minimum.reduceat(event_players, offsets[:-1]) if len(offsets) > 1 else event_players[:0]
+    hi = np.maximum.reduceat(event_players, offsets[:-1]) if len(offsets) > 1 else event_players[:0]
+    event_shard = np.where(lo == hi, lo, -1)
+    return ShardPlan(shards, player_shard, event_shard)
+
+
+def _sublog(log, events, local, prefix_2v2, prefix_pozos):
+    """The events at positions ``events`` of ``log`` as a new log, with players renumbered by ``local``."""
+    kinds = np.asarray(log.kinds)[events]
+    matches = prefix_2v2[events[kinds == MATCH_2V2]]
+    pairs, courts, offsets = [], [], [0]
+    for pozo in prefix_pozos[events[kinds == AMERICANA]].tolist():
+        lo, hi = log.pozo_offsets[pozo], log.pozo_offsets[pozo + 1]
+        pairs.append(local[log.pozo_pairs[lo:hi]])
+        courts.append(log.pozo_courts[lo:hi])
+        offsets.append(offsets[-1] + hi - lo)
+    empty = np.empty((0, 2), dtype=np.int64)
+    return MatchLog(
+        kinds,
+        local[log.players[matches]].reshape(-1, 4),
+        np.asarray(log.scores)[matches].reshape(-1, 2),
+        np.array(offsets, dtype=np.int64),
+        np.concatenate(pairs) if pairs else empty,
+        np.concatenate(courts) if courts else empty,
+    )
+
+
+_shared = {}
+
+
+def _init_worker(name, size, members, params_2v2, params_american):
+    block = shared_memory.SharedMemory(name=name)
+    _shared.update(block=block, ratings=np.ndarray(size, np.int32, buffer=block.buf), members=members,
+                   params_2v2=params_2v2, params_american=params_american)
+
+
+def _replay_shard(task):
+    shard, log = task
+    members = _shared["members"][shard]
+    ratings = _shared["ratings"]
+    store = PlayerStore(capacity=max(len(members), 1))
+    store.player_ids = members.tolist()
+    store._ratings[:len(members)] = ratings[members]
+    Replay(store, _shared["params_2v2"], _shared["params_american"]).run_log(log)
+    ratings[members] = store.ratings
+    return shard
+
+
+def _score_cross(log, event, prefix_2v2, prefix_pozos, ratings, params_2v2, params_american):
+    if log.kinds[event] == MATCH_2V2:
+        row = prefix_2v2[event]
+        players = log.players[row]
+        current = ratings[players].tolist()
+        team1, team2 = update_elo_2v2(current[:2], current[2:], log.scores[row].tolist(), **params_2v2)
+        ratings[players] += np.array(team1 + team2, dtype=ratings.dtype)
+    else:
+        pozo = prefix_pozos[event]
+        lo, hi = log.pozo_offsets[pozo], log.pozo_offsets[pozo + 1]
+        pairs = log.pozo_pairs[lo:hi]
+        deltas = update_elo_american(ratings[pairs].tolist(), log.pozo_courts[lo:hi].tolist(), **params_american)
+        ratings[pairs] += np.array(deltas, dtype=ratings.dtype)
+
+
+def sharded_replay(log, store, params_2v2=None, params_american=None, workers=None, plan=None,
+                   max_component=None):
+    """
+    Replay ``log`` on ``store`` shard by shard on a process pool.
+
+    The final ratings are the same as with ``Replay(store, ...).run_log(log)``. Listeners are
+    not supported, since shards are replayed in other processes.
+
+    Args:
+        log (MatchLog): Encoded log whose player indices refer to ``store``.
+        store (PlayerStore): Ratings to update.
+        params_2v2, params_american (dict): As in ``Replay``.
+        workers (int, optional): Number of processes. Defaults to the number of cores.
+        plan (ShardPlan, optional): Plan to use, built with ``plan_shards`` if omitted.
+        max_component (int, optional): Passed to ``plan_shards``.
+
+    Returns:
+        PlayerStore: The updated store.
+    """
+    params_2v2 = params_2v2 or {}
+    num_players = len(store)
+    workers = workers or os.cpu_count() or 1
+    if plan is None:
+        plan = plan_shards(log, num_players, workers, max_component)
+    kinds = np.asarray(log.kinds)
+    prefix_2v2 = np.concatenate(([0], np.cumsum(kinds == MATCH_2V2)))
+    prefix_pozos = np.concatenate(([0], np.cumsum(kinds == AMERICANA)))
+
+    members, sublogs, splits = [], [], []
+    cross = np.flatnonzero(plan.event_shard == -1)
+    for shard in range(plan.shards):
+        shard_members = np.flatnonzero(plan.player_shard == shard)
+        local = np.full(num_players, -1, dtype=np.int64)
+        local[shard_members] = np.arange(len(shard_members))
+        events = np.flatnonzero(plan.event_shard == shard)
+        members.append(shard_members)
+        sublogs.append(_sublog(log, events, local, prefix_2v2, prefix_pozos))
+        splits.append(np.searchsorted(events, cross).tolist() + [len(events)])
+    sub_prefixes = [(np.concatenate(([0], np.cumsum(s.kinds == MATCH_2V2))),
+                     np.concatenate(([0], np.cumsum(s.kinds == AMERICANA)))) for s in sublogs]
+
+    def epochs():
+        """Yield the shard tasks up to every cut, followed by the cross-shard event at the cut."""
+        done = [0] * plan.shards
+        for cut, event in enumerate(cross.tolist() + [None]):
+            tasks = []
+            for shard in range(plan.shards):
+                stop = splits[shard][cut]
+                if stop > done[shard]:
+                    tasks.append((shard, _slice_log(sublogs[shard], done[shard], stop, *sub_prefixes[shard])))
+                    done[shard] = stop
+            yield tasks, event
+
+    ratings = store.ratings
+    if workers <= 1 or plan.shards <= 1:
+        _shared.update(ratings=ratings, members=members, params_2v2=params_2v2, params_american=params_american)
+        for tasks, event in epochs():
+            for task in tasks:
+                _replay_shard(task)
+            if event is not None:
+                _score_cross(log, event, prefix_2v2, prefix_pozos, ratings, params_2v2, params_american)
+        _shared.clear()
+        return store
+
+    block = shared_memory.SharedMemory(create=True, size=max(ratings.nbytes, 1))
+    try:
+        shared = np.ndarray(ratings.shape, np.int32, buffer=block.buf)
+        shared[...] = ratings
+        with ProcessPoolExecutor(min(workers, plan.shards), initializer=_init_worker,
+                                 initargs=(block.name, len(ratings), members, params_2v2, params_american)) as pool:
+            for tasks, event in epochs():
+                list(pool.map(_replay_shard, tasks))
+                if event is not None:
+                    _score_cross(log, event, prefix_2v2, prefix_pozos, shared, params_2v2, params_american)
+        ratings[...] = shared
+        del shared
+    finally:
+        block.close()
+        block.unlink()
+    return store
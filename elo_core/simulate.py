@@ -0,0 +1,149 @@
+"""Monte Carlo simulation of americana sube-baja leagues.
+
+Synthetic players get a hidden true strength. Every night they are split into
+pozos, play several sube-baja rounds decided by their true strength, and are
+scored round by round with ``update_elo_american_batch``, so the simulated
+ratings can be compared with the strength they are supposed to track.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+from .batch import expected_score_batch, update_elo_american_batch
+from .sweep import DEFAULTS_AMERICAN
+
+
+class SimulationResult(NamedTuple):
+    """Hidden strength of every player and their rating before the first night and after each one."""
+    strength: np.ndarray
+    ratings: np.ndarray
+
+
+def random_courts(rng, events, numpistas, pairs_per_court=2):
+    """
+    Draw the courts of ``events`` pozos as random permutations, ``pairs_per_court`` pairs per court.
+
+    Returns:
+        numpy.ndarray: Shape (events, numpistas * pairs_per_court) with courts from 1 to numpistas.
+    """
+    courts = np.repeat(np.arange(1, numpistas + 1), pairs_per_court)
+    return rng.permuted(np.broadcast_to(courts, (events, len(courts))), axis=1)
+
+
+def play_round(rng, courts, strength, numpistas):
+    """
+    Play one sube-baja round: on every court the winner moves up a court and the loser down.
+
+    Args:
+        rng (numpy.random.Generator): Random generator.
+        courts (numpy.ndarray): Shape (events, pairs) with the court of every pair, two pairs per court.
+        strength (numpy.ndarray): Shape (events, pairs) with the true strength of every pair.
+        numpistas (int): Number of courts.
+
+    Returns:
+        numpy.ndarray: The courts after the round.
+    """
+    events = len(courts)
+    rows = np.arange(events)[:, np.newaxis]
+    match = np.argsort(courts, axis=1, kind="stable").reshape(events, numpistas, 2)
+    first, second = match[..., 0], match[..., 1]
+
+    P = expected_score_batch(strength[rows, second] - strength[rows, first], 400)
+    first_wins = rng.random(P.shape) < P
+    winner = np.where(first_wins, first, second)
+    loser = np.where(first_wins, second, first)
+
+    court = np.arange(1, numpistas + 1)
+    new_courts = np.empty_like(courts)
+    new_courts[rows, winner] = np.maximum(court - 1, 1)
+    new_courts[rows, loser] = np.minimum(court + 1, numpistas)
+    return new_courts
+
+
+def simulate_league(num_players=240, nights=100, rounds=6, numpistas=6, params=None,
+                    initial_rating=1500, strength_sd=200, seed=None):
+    """
+    Simulate a league of americana sube-baja nights.
+
+    Every night the players are shuffled into pozos of ``2 * numpistas`` pairs. Players left
+    over when ``num_players`` is not a multiple of ``4 * numpistas`` sit the night out.
+
+    Args:
+        num_players (int, optional): Number of players. Defaults to 240.
+        nights (int, optional): Number of nights. Defaults to 100.
+        rounds (int, optional): Rounds per night, each one scored separately. Defaults to 6.
+        numpistas (int, optional): Courts per pozo. Defaults to 6.
+        params (dict, optional): Parameters for ``update_elo_american_batch`` overriding
+            ``DEFAULTS_AMERICAN``.
+        initial_rating (int, optional): Rating of every player before the first night. Defaults to 1500.
+        strength_sd (float, optional): Standard deviation of the true strength around
+            ``initial_rating``. Defaults to 200.
+        seed (int or numpy.random.SeedSequence, optional): Seed for reproducible runs.
+
+    Returns:
+        SimulationResult: Strengths and the (nights + 1, num_players) rating history.
+    """
+    params = {**DEFAULTS_AMERICAN, **(params or {}), "numpistas": numpistas}
+    rng = np.random.default_rng(seed)
+    pairs = 2 * numpistas
+    pozos = num_players // (2 * pairs)
+    if pozos == 0:
+        raise ValueError(f"At least {2 * pairs} players are needed for {numpistas} courts")
+
+    strength = rng.normal(initial_rating, strength_sd, num_players)
+    ratings = np.full(num_players, initial_rating, dtype=np.int64)
+    history = np.empty((nights + 1, num_players), dtype=np.int32)
+    history[0] = ratings
+
+    for night in range(nights):
+        players = rng.permutation(num_players)[:pozos * 2 * pairs].reshape(pozos, pairs, 2)
+        pair_strength = strength[players].mean(axis=2)
+        courts = random_courts(rng, pozos, numpistas)
+        for _ in range(rounds):
+            new_courts = play_round(rng, courts, pair_strength, numpistas)
+            deltas = update_elo_american_batch(ratings[players], np.stack((courts, new_courts), axis=-1), **params)
+            ratings[players] += deltas
+            courts = new_courts
+        history[night + 1] = ratings
+
+    return SimulationResult(strength, history)
+
+
+def _simulate(args):
+    seed, kwargs = args
+    return simulate_league(seed=seed, **kwargs)
+
+
+def monte_carlo(replicas, seed=None, workers=None, **kwargs):
+    """
+    Run independent ``simulate_league`` replicas on a process pool.
+
+    Each replica gets its own child of ``SeedSequence(seed)``, so the results only depend on
+    ``seed`` and never on the number of workers.
+
+    Returns:
+        list: One ``SimulationResult`` per replica.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(replicas)
+    workers = min(workers or os.cpu_count() or 1, replicas)
+    tasks = [(s, kwargs) for s in seeds]
+    if workers <= 1:
+        return [_simulate(task) for task in tasks]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(_simulate, tasks))
+
+
+def summary(result):
+    """Return how well the final ratings of a simulation track the hidden strength."""
+    final = result.ratings[-1].astype(np.float64)
+    strength_rank = np.argsort(np.argsort(result.strength))
+    rating_rank = np.argsort(np.argsort(final))
+    return {
+        "pearson": float(np.corrcoef(result.strength, final)[0, 1]),
+        "spearman": float(np.corrcoef(strength_rank, rating_rank)[0, 1]),
+        "mean_rating": float(final.mean()),
+        "rating_sd": float(final.std()),
+        "mean_drift": float((final - result.ratings[0]).mean()),
+    }
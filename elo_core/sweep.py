@@ -0,0 +1,198 @@
+"""Parameter sweeps: replay a historical log under many Elo settings in parallel.
+
+The encoded log is copied once into shared memory. Worker processes attach to it
+in their initializer, so each task only carries the parameters it evaluates.
+"""
+import itertools
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .batch import expected_score_batch
+from .replay import MatchLog, PlayerStore, Replay
+
+# Slider defaults of the "Partido Normal" and "Americana Sube-Baja Entera" pages.
+DEFAULTS_2V2 = dict(k=20, ratio=400, base=50, factoravg=0.7)
+DEFAULTS_AMERICAN = dict(multipistes=20, compensacio=0, compensacio2=10, bonificacion=0,
+                         k=32, ratio=600, numpistas=6, base=20, factoravg=0.7)
+
+_EPS = 1e-12
+
+
+class _Metrics:
+    """Accumulate prediction and volatility metrics from ``Replay`` listener calls."""
+
+    def __init__(self, params_2v2, params_american):
+        self.ratio_2v2 = params_2v2["ratio"]
+        self.ratio_american = params_american["ratio"]
+        self.numpistas = params_american.get("numpistas", 6)
+        self.brier = {"2v2": 0.0, "americana": 0.0}
+        self.logloss = {"2v2": 0.0, "americana": 0.0}
+        self.count = {"2v2": 0, "americana": 0}
+        self.deltas = 0
+        self.delta_sum = 0.0
+        self.delta_sq = 0.0
+        self.max_drop = 0
+
+    def __call__(self, mode, event_ids, players, old_ratings, deltas, results):
+        old = old_ratings.astype(np.float64)
+        if mode == "2v2":
+            team1 = old[:, :2].mean(axis=1)
+            team2 = old[:, 2:].mean(axis=1)
+            P = expected_score_batch(team2 - team1, self.ratio_2v2)
+            y = (results[:, 0] > results[:, 1]).astype(np.float64)
+        else:
+            pair = old.mean(axis=1)
+            P = expected_score_batch(pair.mean() - pair, self.ratio_american)
+            y = ((results[:, 0] - results[:, 1]) / self.numpistas) / 2 + 0.5
+
+        P = np.clip(P, _EPS, 1 - _EPS)
+        self.brier[mode] += float(((P - y) ** 2).sum())
+        self.logloss[mode] += float(-(y * np.log(P) + (1 - y) * np.log(1 - P)).sum())
+        self.count[mode] += len(P)
+
+        self.deltas += deltas.size
+        self.delta_sum += float(deltas.sum())
+        self.delta_sq += float((deltas.astype(np.float64) ** 2).sum())
+        self.max_drop = min(self.max_drop, int(deltas.min()))
+
+    def report(self):
+        total = sum(self.count.values())
+        out = {
+            "brier": sum(self.brier.values()) / total if total else math.nan,
+            "logloss": sum(self.logloss.values()) / total if total else math.nan,
+        }
+        for mode in ("2v2", "americana"):
+            n = self.count[mode]
+            out[f"brier_{mode}"] = self.brier[mode] / n if n else math.nan
+            out[f"logloss_{mode}"] = self.logloss[mode] / n if n else math.nan
+        mean = self.delta_sum / self.deltas if self.deltas else 0.0
+        out["volatility"] = math.sqrt(max(self.delta_sq / self.deltas - mean ** 2, 0.0)) if self.deltas else 0.0
+        out["max_drop"] = self.max_drop
+        return out
+
+
+def evaluate(log, num_players, params_2v2=None, params_american=None, default_rating=1000):
+    """
+    Replay ``log`` from scratch with one configuration and return its metrics.
+
+    Returns:
+        dict: ``brier`` and ``logloss`` of the expected score P against the outcome (over all
+        predictions and per mode), ``volatility`` (standard deviation of the adjustments)
+        and ``max_drop`` (the largest single adjustment down).
+    """
+    params_2v2 = {**DEFAULTS_2V2, **(params_2v2 or {})}
+    params_american = {**DEFAULTS_AMERICAN, **(params_american or {})}
+
+    store = PlayerStore(default_rating, capacity=max(num_players, 1))
+    store.player_ids = list(range(num_players))
+    store.ids = dict(zip(store.player_ids, store.player_ids))
+    replay = Replay(store, params_2v2, params_american)
+    metrics = _Metrics(params_2v2, params_american)
+    replay.listeners.append(metrics)
+    replay.run_log(log)
+    return metrics.report()
+
+
+def grid(space):
+    """Yield every combination of a ``{name: [values]}`` space as a dict."""
+    names = list(space)
+    for values in itertools.product(*(space[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def sample(space, n, seed=None):
+    """
+    Yield ``n`` random configurations of a space.
+
+    Each value of ``space`` is a list to choose from or a ``(low, high)`` tuple, sampled as an
+    integer when both bounds are integers and uniformly otherwise.
+    """
+    rng = random.Random(seed)
+    for _ in range(n):
+        config = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(low, int) and isinstance(high, int):
+                    config[name] = rng.randint(low, high)
+                else:
+                    config[name] = rng.uniform(low, high)
+            else:
+                config[name] = rng.choice(values)
+        yield config
+
+
+_shared = {}
+
+
+def _share(log):
+    blocks, spec = [], []
+    for array in log:
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        spec.append((block.name, array.shape, array.dtype.str))
+    return blocks, spec
+
+
+def _init_worker(spec, num_players, default_rating):
+    blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in spec]
+    arrays = [np.ndarray(shape, dtype, buffer=block.buf) for block, (_, shape, dtype) in zip(blocks, spec)]
+    _shared.update(blocks=blocks, log=MatchLog(*arrays), num_players=num_players, default_rating=default_rating)
+
+
+def _evaluate_shared(configs):
+    params_2v2, params_american = configs
+    return evaluate(_shared["log"], _shared["num_players"], params_2v2, params_american, _shared["default_rating"])
+
+
+def sweep(log, num_players, configs, workers=None, default_rating=1000, sort_by="logloss"):
+    """
+    Evaluate many configurations of a log on a process pool.
+
+    Args:
+        log (MatchLog): Encoded log, see ``encode_log``.
+        num_players (int): Number of players of the store the log was encoded with.
+        configs (iterable): ``(params_2v2, params_american)`` tuples. Missing parameters
+            take the values of ``DEFAULTS_2V2`` and ``DEFAULTS_AMERICAN``.
+        workers (int, optional): Number of processes. Defaults to the number of cores.
+        sort_by (str, optional): Metric to sort the results by, ascending. Defaults to "logloss".
+
+    Returns:
+        list: ``(params_2v2, params_american, metrics)`` tuples, best first.
+    """
+    configs = [(dict(p2 or {}), dict(pa or {})) for p2, pa in configs]
+    workers = min(workers or os.cpu_count() or 1, len(configs)) or 1
+
+    blocks, spec = _share(log)
+    try:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(spec, num_players, default_rating)) as pool:
+            metrics = list(pool.map(_evaluate_shared, configs))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    results = [(p2, pa, m) for (p2, pa), m in zip(configs, metrics)]
+    results.sort(key=lambda r: r[2][sort_by])
+    return results
+
+
+def grid_search(log, num_players, space_2v2=None, space_american=None, **kwargs):
+    """Sweep every combination of the 2v2 and americana grids, see ``sweep``."""
+    configs = itertools.product(list(grid(space_2v2 or {})), list(grid(space_american or {})))
+    return sweep(log, num_players, configs, **kwargs)
+
+
+def random_search(log, num_players, space_2v2=None, space_american=None, n=100, seed=None, **kwargs):
+    """Sweep ``n`` random configurations of the 2v2 and americana spaces, see ``sweep``."""
+    rng = random.Random(seed)
+    configs = zip(sample(space_2v2 or {}, n, rng.random()), sample(space_american or {}, n, rng.random()))
+    return sweep(log, num_players, configs, **kwargs)